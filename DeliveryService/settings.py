@@ -47,6 +47,9 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'app.Account'
 
 MIDDLEWARE = [
+    'app.middleware.MetricsMiddleware',
+    'app.middleware.QueryCountMiddleware',
+    'app.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,8 +57,31 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.ProfilingMiddleware',
 ]
 
+# Adds X-Query-Count and Server-Timing headers with the SQL query count and database time of every request
+QUERY_COUNT_ENABLED = False
+
+# Request, cache, import and outbox metrics served in Prometheus text format at /metrics.
+# Set the PROMETHEUS_MULTIPROC_DIR environment variable when running several worker processes.
+METRICS_ENABLED = True
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+# Upper bound for the time MetricsMiddleware may add to a request, checked by the tests
+METRICS_OVERHEAD_BUDGET = 0.0005
+
+# Request profiling: staff requests with HEADER and 1 in SAMPLE_RATE requests (0 disables sampling) are saved
+# as cProfile .prof files, requests slower than SLOW_THRESHOLD seconds (None disables) as flamegraph .collapsed
+# stacks sampled every INTERVAL seconds. File names carry the route, duration and query count.
+PROFILING = {
+    'ENABLED': False,
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': 0,
+    'SLOW_THRESHOLD': 1.0,
+    'INTERVAL': 0.005,
+    'DIRECTORY': BASE_DIR / 'profiles',
+}
+
 ROOT_URLCONF = 'DeliveryService.urls'
 
 TEMPLATES = [
@@ -91,6 +117,19 @@ DATABASES = {
     }
 }
 
+# Read replicas: aliases in DATABASES that GET requests to views with read_replica = True are sent to,
+# for example {'ENGINE': ..., 'NAME': ..., 'HOST': 'replica-host', 'TEST': {'MIRROR': 'default'}}.
+# REPLICA_SELECTION is 'round_robin' or 'least_lag', replicas further behind than REPLICA_MAX_LAG seconds
+# are skipped. Clients stay on the primary for REPLICA_STICKY_SECONDS after a write to read their own writes,
+# REPLICA_STICKY_CACHE must be shared by all workers in production.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+REPLICA_SELECTION = 'round_robin'
+REPLICA_MAX_LAG = 10
+REPLICA_LAG_CHECK_INTERVAL = 1
+REPLICA_STICKY_SECONDS = 5
+REPLICA_STICKY_CACHE = 'default'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -109,6 +148,34 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing cost, lower it to trade hash strength for login throughput (manage.py bench_login)
+PASSWORD_HASH_ITERATIONS = 320000
+
+PASSWORD_HASHERS = [
+    'app.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Caches
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Login and registration attempt counters. Use 'django.core.cache.backends.db.DatabaseCache'
+    # (after manage.py createcachetable) to share the counters between workers.
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth-throttle',
+    },
+}
+
+AUTH_THROTTLE_CACHE = 'throttle'
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
@@ -134,11 +201,26 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 30,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'app.authentication.CachedTokenAuthentication',
     ],
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': '30/min',
+        'auth_email': '10/min',
+    },
+    # Number of reverse proxies in front of the app. Throttles key on the address the nearest of them saw,
+    # with 0 on REMOTE_ADDR, never on the client supplied part of X-Forwarded-For.
+    'NUM_PROXIES': 0,
     "EXCEPTION_HANDLER": "app.permissions.custom_exception_handler"
 }
 
+# Token -> user snapshots kept by app.authentication.CachedTokenAuthentication. Set BACKEND to a CACHES alias
+# shared by all workers (e.g. redis or memcached) to replace the per-process LRU.
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'BACKEND': None,
+}
+
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 EMAIL_HOST = ''
@@ -147,3 +229,40 @@ EMAIL_HOST_PASSWORD = ''
 EMAIL_PORT = ''
 EMAIL_USE_SSL = True
 SERVER_EMAIL = EMAIL_HOST_USER
+
+# Outbox worker (manage.py send_emails): messages per SMTP connection, attempts before giving up
+# and the first retry delay in seconds, doubled after every failed attempt. Claimed messages of a worker
+# that stopped while sending are retried after EMAIL_OUTBOX_SENDING_TIMEOUT seconds.
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 60
+EMAIL_OUTBOX_SENDING_TIMEOUT = 600
+
+# Seconds between supplier order digests (manage.py send_supplier_digests)
+SUPPLIER_DIGEST_WINDOW = 300
+
+# Seconds a worker keeps a shop delivery rate in memory before reloading it
+DELIVERY_RATE_CACHE_TTL = 300
+
+# Seconds to wait for a partner price list download
+PRICE_LIST_TIMEOUT = 30
+
+# Directory of the gzip catalog snapshots (api/v1/products/snapshot), run manage.py build_catalog_snapshots
+# every minute to serialize again the shops changed since the last run. Production servers can also serve
+# it as static files. 'msgpack' requires the msgpack package.
+CATALOG_SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+CATALOG_SNAPSHOT_FORMATS = ['ndjson']
+
+# Row estimate above which the admin changelists and the catalog lists report the planner estimate
+# (PostgreSQL) instead of an exact COUNT(*). Other databases cache the exact count of the catalog lists.
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+# Sub-requests accepted by one api/v1/batch call
+BATCH_MAX_REQUESTS = 20
+
+# Delivered and canceled orders older than ORDER_ARCHIVE_AFTER_DAYS are moved to the archive tables by
+# manage.py archive_orders, ORDER_ARCHIVE_BATCH_SIZE orders per transaction. The order history reads the
+# archive only for pages older than that age: lowering the value is safe, raising it hides archived orders
+# from the first pages until they are older than the new age.
+ORDER_ARCHIVE_AFTER_DAYS = 180
+ORDER_ARCHIVE_BATCH_SIZE = 500
@@ -17,8 +17,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django_rest_passwordreset.views import reset_password_request_token, reset_password_confirm
 from rest_framework.routers import DefaultRouter
+from app.async_views import partner_update_view
+from app.metrics import metrics_view
 from app.views import RegisterView, LoginView, CategoryView, ShopView, ProductView, BasketView, \
-    PartnerView, ContactView, UserOrderView, PartnerOrdersView, AccountView, ConfirmAccount, PartnerUpdateView
+    PartnerView, ContactView, UserOrderView, PartnerOrdersView, AccountView, ConfirmAccount, PartnerUpdateView, \
+    PartnerOrdersExportView, PartnerDeliveryView, CatalogSnapshotView, \
+    CatalogChangesView, PriceHistoryView, BatchView
 
 app_name = 'password_reset'
 
@@ -29,6 +33,10 @@ router.register(r'products', ProductView, basename='products')
 
 urlpatterns = [
     path('api/v1/', include(router.urls)),
+    path('api/v1/products/changes', CatalogChangesView.as_view()),
+    path('api/v1/products/<int:product_id>/prices', PriceHistoryView.as_view()),
+    path('api/v1/products/snapshot', CatalogSnapshotView.as_view()),
+    path('api/v1/products/snapshot/<int:shop_id>', CatalogSnapshotView.as_view()),
     path('api/v1/account/register', RegisterView.as_view()),
     path('api/v1/account/confirm', ConfirmAccount.as_view()),
     path('api/v1/account/login', LoginView.as_view()),
@@ -36,12 +44,18 @@ urlpatterns = [
     path('api/v1/basket', BasketView.as_view()),
     path('api/v1/basket/update', UserOrderView.as_view()),
     path('api/v1/partner/orders', PartnerOrdersView.as_view()),
+    path('api/v1/partner/orders/export', PartnerOrdersExportView.as_view()),
     # reset pasword send "POST" api/v1/account/password-reset
     path('api/v1/account/password-reset', reset_password_request_token, name='reset-password-request'),
     # new pasword and token send "POST"- api/v1/account/password_reset/confirm
     path('api/v1/account/password_reset/confirm', reset_password_confirm, name='password-reset-confirm'),
     path('api/v1/partner/shop', PartnerView.as_view()),
+    path('api/v1/partner/delivery', PartnerDeliveryView.as_view()),
     path('api/v1/partner/contacts', ContactView.as_view()),
     path('api/v1/partner/update', PartnerUpdateView.as_view()),
+    # coroutine version for ASGI servers, the price list is downloaded without holding a worker thread
+    path('api/v1/async/partner/update', partner_update_view),
+    path('api/v1/batch', BatchView.as_view()),
+    path('metrics', metrics_view),
     path('admin/', admin.site.urls)
 ]
@@ -1,16 +1,22 @@
-from django.contrib import admin
+from functools import partial, reduce
+from operator import or_
+
+from django.contrib import admin, messages
 
 # Register your models here.
 from django.contrib.auth.admin import UserAdmin
-
-
-
-
-
+from django.db import transaction
+from django.db.models import Q
 
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
-from app.models import Account
+from app.authentication import invalidate_users
+from app.importer import set_shops_status
+from app.models import Account, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, \
+    ShopOrder, OrderItem, DeliveryRate, DeliveryRateTier, Contact, OutgoingEmail, CatalogChange, PriceHistory, \
+    ArchivedOrder, ArchivedShopOrder, ArchivedOrderItem
+from app.pagination import EstimatedCountPaginator
+from app.signals import order_status_changed
 
 class CustomUserCreationForm(UserCreationForm):
 
@@ -25,14 +31,34 @@ class CustomUserChangeForm(UserChangeForm):
         fields = ('email',)
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+    # Changelist of a table with millions of rows: estimated count, newest rows first by primary key,
+    # foreign keys as raw ids and no filters listing the values of big tables
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+    # Integer lookups compared exactly with a numeric search term, through their indexes
+    search_id_fields = ('id',)
+
+    def get_search_fields(self, request):
+        # Keeps the search box of the tables searched by id only
+        return self.search_fields or self.search_id_fields
 
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(reduce(or_, (Q(**{field: int(term)}) for field in self.search_id_fields))), False
+        if not self.search_fields:
+            return (queryset.none() if term else queryset), False
+        return super().get_search_results(request, queryset, search_term)
 
-class CustomUserAdmin(UserAdmin):
+
+class CustomUserAdmin(LargeTableAdmin, UserAdmin):
     add_form = CustomUserCreationForm
     form = CustomUserChangeForm
     model = Account
-    list_display = ('email', 'is_staff', 'is_active',)
-    list_filter = ('email', 'is_staff', 'is_active',)
+    list_display = ('email', 'type_account', 'is_staff', 'is_active',)
+    list_filter = ('type_account', 'is_staff', 'is_active',)
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         ('Permissions', {'fields': ('is_staff', 'is_active')}),
@@ -43,7 +69,230 @@ class CustomUserAdmin(UserAdmin):
             'fields': ('email', 'password1', 'password2', 'is_staff', 'is_active')}
         ),
     )
-    search_fields = ('email',)
+    search_fields = ('email__exact',)
     ordering = ('email',)
+    actions = ['deactivate']
+
+    @admin.action(description='Deactivate selected accounts')
+    def deactivate(self, request, queryset):
+        # The UPDATE skips the account signals, the cached tokens are dropped here
+        with transaction.atomic():
+            user_ids = list(queryset.filter(is_active=True).values_list('id', flat=True))
+            Account.objects.filter(id__in=user_ids).update(is_active=False)
+            transaction.on_commit(partial(invalidate_users, user_ids))
+        self.message_user(request, f'{len(user_ids)} accounts deactivated.')
+
+admin.site.register(Account, CustomUserAdmin)
+
+
+@admin.register(Shop)
+class ShopAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'status', 'url')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('name',)
+    raw_id_fields = ('user',)
+    actions = ['enable', 'disable']
+
+    @admin.action(description='Switch on selected shops')
+    def enable(self, request, queryset):
+        self.message_user(request, f'{set_shops_status(queryset, True)} shops switched on.')
+
+    @admin.action(description='Switch off selected shops')
+    def disable(self, request, queryset):
+        self.message_user(request, f'{set_shops_status(queryset, False)} shops switched off.')
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name')
+    search_fields = ('name',)
+    autocomplete_fields = ('shops',)
+
+
+@admin.register(Parameter)
+class ParameterAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'category')
+    list_select_related = ('category',)
+    search_fields = ('name',)
+    search_id_fields = ('id', 'category_id')
+    autocomplete_fields = ('category',)
+
+
+class ProductParameterInline(admin.TabularInline):
+    model = ProductParameter
+    autocomplete_fields = ('parameter',)
+    extra = 0
+
+
+@admin.register(ProductInfo)
+class ProductInfoAdmin(LargeTableAdmin):
+    list_display = ('id', 'product', 'shop', 'price', 'price_rrc', 'quantity')
+    list_select_related = ('product', 'shop')
+    list_filter = ('shop',)
+    search_id_fields = ('id', 'product_id')
+    raw_id_fields = ('product',)
+    autocomplete_fields = ('shop',)
+    inlines = [ProductParameterInline]
+
+
+@admin.register(ProductParameter)
+class ProductParameterAdmin(LargeTableAdmin):
+    list_display = ('id', 'product_info', 'parameter', 'value')
+    list_select_related = ('product_info', 'parameter')
+    search_id_fields = ('product_info_id',)
+    raw_id_fields = ('product_info',)
+    autocomplete_fields = ('parameter',)
+
+
+class CancelOrdersMixin:
+    # Set-based cancellation of the selected orders that can still be canceled, the buyers are notified
+    actions = ['cancel']
+
+    @admin.action(description='Cancel selected orders')
+    def cancel(self, request, queryset):
+        sources = Order.source_statuses('canceled')
+        selected = queryset.count()
+        with transaction.atomic():
+            changes = self.cancel_orders(queryset.filter(status__in=sources), sources)
+        if changes:
+            order_status_changed.send(sender=self.__class__, status='canceled', changes=changes)
+        if len(changes) < selected:
+            self.message_user(request, f'{len(changes)} orders canceled, {selected - len(changes)} orders can no '
+                                       f'longer be canceled.', messages.WARNING)
+        else:
+            self.message_user(request, f'{len(changes)} orders canceled.')
+
+
+@admin.register(Order)
+class OrderAdmin(CancelOrdersMixin, LargeTableAdmin):
+    list_display = ('id', 'user', 'dt', 'status', 'delivery_cost')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('user__email__exact',)
+    search_id_fields = ('id', 'user_id')
+    raw_id_fields = ('user',)
+
+    def cancel_orders(self, orders, sources):
+        # Orders with a shop order past the cancelable statuses are skipped, the shop orders are locked so a
+        # partner cannot send one meanwhile
+        rows = list(orders.select_for_update(of=('self',)).values_list('id', 'user__email'))
+        blocked = {order_id for order_id, status in ShopOrder.objects.select_for_update().filter(
+            order_id__in=[order_id for order_id, _ in rows]).values_list('order_id', 'status')
+            if status not in sources and status != 'canceled'}
+        changes = [(email, order_id) for order_id, email in rows if order_id not in blocked]
+        order_ids = [order_id for _, order_id in changes]
+        Order.objects.filter(id__in=order_ids).update(status='canceled')
+        ShopOrder.objects.filter(order_id__in=order_ids, status__in=sources).update(status='canceled')
+        return changes
+
+
+@admin.register(ShopOrder)
+class ShopOrderAdmin(CancelOrdersMixin, LargeTableAdmin):
+    list_display = ('id', 'order', 'shop', 'dt', 'status', 'total_sum', 'delivery_cost', 'notified')
+    list_select_related = ('order', 'shop')
+    list_filter = ('status', 'shop')
+    search_id_fields = ('id', 'order_id')
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('shop',)
+
+    def cancel_orders(self, shop_orders, sources):
+        # An order is canceled with its last active shop order, as in the partner order updates
+        rows = list(shop_orders.select_for_update(of=('self',)).values_list('id', 'order_id', 'order__user__email'))
+        ShopOrder.objects.filter(id__in=[shop_order_id for shop_order_id, _, _ in rows]).update(status='canceled')
+        Order.objects.filter(id__in={order_id for _, order_id, _ in rows}).exclude(
+            shop_orders__status__in=[status for status, _ in Order.CHOICES_STATUS if status != 'canceled']).update(
+            status='canceled')
+        return [(email, order_id) for _, order_id, email in rows]
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ('id', 'order', 'shop_order', 'product_info', 'quantity')
+    list_select_related = ('order', 'shop_order', 'product_info')
+    search_id_fields = ('order_id', 'shop_order_id')
+    raw_id_fields = ('order', 'shop_order', 'product_info')
+
+
+class DeliveryRateTierInline(admin.TabularInline):
+    model = DeliveryRateTier
+    extra = 0
+
+
+@admin.register(DeliveryRate)
+class DeliveryRateAdmin(admin.ModelAdmin):
+    list_display = ('shop', 'base_fee', 'free_threshold', 'version')
+    list_select_related = ('shop',)
+    autocomplete_fields = ('shop',)
+    inlines = [DeliveryRateTierInline]
+
+    def save_model(self, request, obj, form, change):
+        # the tiers are saved after the rate, bumping the version on every change keeps cached tables honest
+        if change:
+            obj.version += 1
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(Contact)
+class ContactAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'type', 'value')
+    list_select_related = ('user',)
+    list_filter = ('type',)
+    search_fields = ('user__email__exact',)
+    search_id_fields = ('user_id',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(LargeTableAdmin):
+    list_display = ('id', 'recipient', 'subject', 'status', 'attempts', 'next_attempt', 'sent')
+    list_filter = ('status',)
+    search_fields = ('recipient__exact',)
+
+
+@admin.register(CatalogChange)
+class CatalogChangeAdmin(LargeTableAdmin):
+    list_display = ('id', 'kind', 'shop_id', 'product_info_id', 'status', 'dt')
+    list_filter = ('kind',)
+
+
+@admin.register(PriceHistory)
+class PriceHistoryAdmin(LargeTableAdmin):
+    list_display = ('id', 'product', 'shop', 'price', 'price_rrc', 'dt')
+    list_select_related = ('product', 'shop')
+    search_id_fields = ('id', 'product_id')
+    raw_id_fields = ('product',)
+    autocomplete_fields = ('shop',)
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'dt', 'status', 'total_sum', 'delivery_cost', 'archived')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('user__email__exact',)
+    search_id_fields = ('id', 'user_id')
+    raw_id_fields = ('user',)
+
+
+@admin.register(ArchivedShopOrder)
+class ArchivedShopOrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'order', 'shop', 'dt', 'status', 'total_sum', 'delivery_cost')
+    list_select_related = ('order', 'shop')
+    list_filter = ('status',)
+    search_id_fields = ('id', 'order_id')
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('shop',)
+
 
-admin.site.register(Account, CustomUserAdmin)
\ No newline at end of file
+@admin.register(ArchivedOrderItem)
+class ArchivedOrderItemAdmin(LargeTableAdmin):
+    list_display = ('id', 'order', 'shop_order', 'product_info', 'quantity')
+    list_select_related = ('order', 'shop_order', 'product_info')
+    search_id_fields = ('order_id', 'shop_order_id')
+    raw_id_fields = ('order', 'shop_order', 'product_info')
@@ -0,0 +1,65 @@
+from datetime import timedelta
+from time import sleep
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from app.models import Order, ShopOrder, OrderItem, ArchivedOrder, ArchivedShopOrder, ArchivedOrderItem
+
+ARCHIVED_STATUSES = ('delivered', 'canceled')
+
+
+def horizon():
+    # Every archived order and shop order was created before this moment
+    return timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+
+
+def archivable(before):
+    # Finished orders created before the date, whose shop orders are all finished and created before it too
+    return Order.objects.filter(status__in=ARCHIVED_STATUSES, dt__lt=before).exclude(
+        shop_orders__dt__gte=before).exclude(
+        shop_orders__status__in=[status for status, _ in Order.CHOICES_STATUS if status not in ARCHIVED_STATUSES])
+
+
+def _copy(queryset, model, extra=None):
+    # Copies the rows into the archive model by field or annotation name, extra(row) gives the values the live
+    # rows lack
+    names = {field.attname for field in queryset.model._meta.concrete_fields} | set(queryset.query.annotations)
+    fields = [field.attname for field in model._meta.concrete_fields if field.attname in names]
+    model.objects.bulk_create([model(**row, **(extra(row) if extra else {}))
+                               for row in queryset.order_by().values(*fields)])
+
+
+def archive_batch(before, batch_size):
+    # One short transaction per batch: only the orders of the batch are locked and orders locked by
+    # a concurrent request are skipped instead of waited for
+    with transaction.atomic():
+        order_ids = list(archivable(before).select_for_update(skip_locked=True, of=('self',)).order_by(
+            'id').values_list('id', flat=True)[:batch_size])
+        if not order_ids:
+            return 0
+        items = OrderItem.objects.filter(order_id__in=order_ids)
+        totals = dict(items.values('order_id').annotate(total=Sum(F('quantity') * F('product_info__price'))).order_by(
+            ).values_list('order_id', 'total'))
+        _copy(Order.objects.filter(id__in=order_ids), ArchivedOrder, lambda row: {'total_sum': totals.get(row['id'])})
+        _copy(ShopOrder.objects.filter(order_id__in=order_ids), ArchivedShopOrder)
+        _copy(items.annotate(product_name=F('product_info__product__name'), price=F('product_info__price')),
+              ArchivedOrderItem)
+        items.delete()
+        ShopOrder.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(id__in=order_ids).delete()
+    return len(order_ids)
+
+
+def archive_orders(batch_size=None, pause=0):
+    # Moves the finished orders older than ORDER_ARCHIVE_AFTER_DAYS to the archive tables batch by batch
+    before = horizon()
+    archived = 0
+    while True:
+        count = archive_batch(before, batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE)
+        if not count:
+            return archived
+        archived += count
+        sleep(pause)
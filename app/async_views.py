@@ -0,0 +1,60 @@
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.http import JsonResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from app.importer import import_price_list
+from app.permissions import IsShopOnly
+
+# Django 4.0 has no async ORM methods yet, a coroutine view only pays off where it awaits real network io.
+# The price import awaits the partner download, the database work still runs in a thread with sync_to_async.
+
+
+def _seller_request(request):
+    # Authentication of a DRF view, returns (request, None) or (None, error response)
+    request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                      authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = request.user
+    except APIException as error:
+        return None, JsonResponse({'Status': False, 'Errors': error.detail}, status=error.status_code)
+    if not user.is_authenticated:
+        return None, JsonResponse({'Status': False, 'Errors': 'Authentication credentials were not provided.'},
+                                  status=401)
+    if not IsShopOnly().has_permission(request, None):
+        return None, JsonResponse(IsShopOnly.message, status=403)
+    return request, None
+
+
+async def partner_update_view(request):
+    # Loading shop data in yaml format, the price list is downloaded without holding a worker thread
+    if request.method != 'POST':
+        return JsonResponse({'Status': False, 'Errors': f'Method "{request.method}" not allowed.'}, status=405)
+    request, error = await sync_to_async(_seller_request)(request)
+    if error is not None:
+        return error
+    try:
+        url = request.data.get('url')
+    except APIException as error:
+        return JsonResponse({'Status': False, 'Errors': error.detail}, status=error.status_code)
+    if not url:
+        return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
+    try:
+        URLValidator()(url)
+    except ValidationError as e:
+        return JsonResponse({'Status': False, 'Error': str(e)})
+    try:
+        async with httpx.AsyncClient(timeout=settings.PRICE_LIST_TIMEOUT) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        return JsonResponse({'Status': False, 'Error': f'Price list download failed: {e}'})
+    return JsonResponse(await sync_to_async(import_price_list)(request.user.id, response.content))
+
+
+partner_update_view.csrf_exempt = True
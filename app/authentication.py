@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from app.metrics import observe_cache
+from app.models import Account
+
+
+class TokenCache:
+    # Bounded LRU of token key -> user snapshot, entries expire after ttl seconds
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, snapshot = entry
+            if expires < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def set(self, key, snapshot):
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _config():
+    config = {'MAX_SIZE': 10000, 'TTL': 300, 'BACKEND': None}
+    config.update(getattr(settings, 'TOKEN_AUTH_CACHE', {}))
+    return config
+
+
+local_cache = TokenCache(_config()['MAX_SIZE'], _config()['TTL'])
+
+
+def _shared_cache():
+    backend = _config()['BACKEND']
+    return caches[backend] if backend else None
+
+
+def _cache_key(key):
+    return f'token-auth:{key}'
+
+
+def get_snapshot(key):
+    shared = _shared_cache()
+    if shared is not None:
+        return shared.get(_cache_key(key))
+    return local_cache.get(key)
+
+
+def set_snapshot(key, user):
+    snapshot = {field.attname: getattr(user, field.attname) for field in Account._meta.concrete_fields}
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set(_cache_key(key), snapshot, _config()['TTL'])
+    else:
+        local_cache.set(key, snapshot)
+
+
+def invalidate_token(key):
+    # Dropping a token from the cache, called on token deletion
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(_cache_key(key))
+    local_cache.delete(key)
+
+
+def invalidate_user(user_id):
+    # Dropping all tokens of a user, called on password change and deactivation
+    invalidate_users([user_id])
+
+
+def invalidate_users(user_ids):
+    # Dropping all tokens of the users, for updates bypassing the account signals
+    for key in Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # Token authentication that skips the Token + Account query on a cache hit.
+    # Snapshots live in a per-process LRU unless TOKEN_AUTH_CACHE['BACKEND'] names a shared cache.
+
+    def authenticate_credentials(self, key):
+        snapshot = get_snapshot(key)
+        if snapshot is None:
+            observe_cache('token_auth', 0, 1)
+            user, token = super().authenticate_credentials(key)
+            set_snapshot(key, user)
+            return user, token
+        observe_cache('token_auth', 1, 0)
+        user = Account.from_db(DEFAULT_DB_ALIAS, list(snapshot), list(snapshot.values()))
+        token = Token(key=key, user=user)
+        return user, token
+
+
+class BatchAuthentication(BaseAuthentication):
+    # Credentials of an authenticated batch request, given to the views of its sub-requests
+    def __init__(self, user, auth):
+        self.user = user
+        self.auth = auth
+
+    def authenticate(self, request):
+        return self.user, self.auth
+
+    def authenticate_header(self, request):
+        return 'Token'
@@ -0,0 +1,208 @@
+import random
+from bisect import bisect
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from itertools import accumulate
+
+from django.db import connection, transaction
+
+from app.models import Account, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, \
+    ShopOrder, OrderItem, Contact
+
+# Row counts at scale factor 1, offers = products * OFFERS_PER_PRODUCT, order lines ~ orders * 5
+SCALE_1 = {'shops': 100, 'categories': 500, 'products': 200000, 'buyers': 50000, 'orders': 1000000}
+MINIMUM = {'shops': 5, 'categories': 5, 'products': 10, 'buyers': 10, 'orders': 10}
+OFFERS_PER_PRODUCT = 5
+PARAMETERS = {
+    'color': ['black', 'white', 'red', 'blue', 'green', 'silver'],
+    'size': ['XS', 'S', 'M', 'L', 'XL'],
+    'memory': ['32', '64', '128', '256', '512'],
+    'material': ['plastic', 'metal', 'glass', 'wood', 'cotton'],
+}
+ORDER_STATUSES = {'delivered': 60, 'sent': 8, 'assembled': 5, 'confirmed': 5, 'new': 8, 'canceled': 9, 'basket': 5}
+HISTORY_DAYS = 365
+BATCH_SIZE = 5000
+
+
+def counts(scale):
+    return {name: max(MINIMUM[name], round(count * scale)) for name, count in SCALE_1.items()}
+
+
+def entity_random(plan, kind, number):
+    # Every generated entity has its own generator, so the data does not depend on chunking or workers
+    return random.Random(f'{plan["seed"]}:{kind}:{number}')
+
+
+@lru_cache(maxsize=None)
+def zipf_weights(size, exponent):
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(size)))
+
+
+def zipf_index(generator, size, exponent=1.1):
+    # Zipf distributed rank spread over 0..size-1 with a fixed permutation, popular items are not adjacent ids
+    weights = zipf_weights(size, exponent)
+    rank = bisect(weights, generator.random() * weights[-1])
+    return (rank * 7919 + 13) % size if size % 7919 else rank
+
+
+@lru_cache(maxsize=100000)
+def offers(seed, shops, product):
+    # Shops and prices of the offers of a product: a lognormal base price, each shop within +-15% of it
+    generator = random.Random(f'{seed}:offers:{product}')
+    base_price = generator.lognormvariate(7, 1.2)
+    chosen = []
+    while len(chosen) < OFFERS_PER_PRODUCT:
+        shop = zipf_index(generator, shops, 0.8)
+        if shop not in chosen:
+            chosen.append(shop)
+    return [(shop, Decimal(f'{base_price * generator.uniform(0.85, 1.15):.2f}')) for shop in chosen]
+
+
+def product_offers(plan, product):
+    return offers(plan['seed'], plan['counts']['shops'], product)
+
+
+def plan_dataset(scale, seed, password_hash, until):
+    # Id ranges of the new rows start after the existing ones, so chunks can be generated independently
+    def next_id(model):
+        return (model.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+    return {
+        'seed': seed, 'counts': counts(scale), 'password_hash': password_hash,
+        'until': until, 'account_id': next_id(Account), 'shop_id': next_id(Shop), 'category_id': next_id(Category),
+        'product_id': next_id(Product), 'product_info_id': next_id(ProductInfo), 'order_id': next_id(Order),
+    }
+
+
+def create_dimensions(plan):
+    # Sellers, buyers with contacts, shops, categories and parameters
+    sizes = plan['counts']
+    accounts, contacts = [], []
+    for number in range(sizes['shops'] + sizes['buyers']):
+        account_id = plan['account_id'] + number
+        seller = number < sizes['shops']
+        generator = entity_random(plan, 'account', number)
+        accounts.append(Account(
+            id=account_id, email=f'{"seller" if seller else "buyer"}{account_id}@example.com',
+            password=plan['password_hash'], is_active=True, type_account='seller' if seller else 'buyer',
+            first_name=f'Name{number}', last_name=f'Surname{number}', surname=f'Patronymic{number}',
+            position='Manager' if seller else 'Buyer',
+            date_joined=plan['until'] - timedelta(days=generator.uniform(HISTORY_DAYS, 3 * HISTORY_DAYS))))
+        if not seller:
+            contacts.append(Contact(user_id=account_id, type='phone', value=f'+7{generator.randrange(10 ** 10):010}'))
+            contacts.append(Contact(user_id=account_id, type='address',
+                                    value=f'City {generator.randrange(100)}, street {generator.randrange(1000)}'))
+    Account.objects.bulk_create(accounts, batch_size=BATCH_SIZE)
+    Contact.objects.bulk_create(contacts, batch_size=BATCH_SIZE)
+    Shop.objects.bulk_create([
+        Shop(id=plan['shop_id'] + number, name=f'Shop {plan["shop_id"] + number}',
+             url=f'https://shop{plan["shop_id"] + number}.example.com/price.yaml',
+             user_id=plan['account_id'] + number)
+        for number in range(sizes['shops'])], batch_size=BATCH_SIZE)
+    Category.objects.bulk_create([
+        Category(id=plan['category_id'] + number, name=f'Category {plan["category_id"] + number}')
+        for number in range(sizes['categories'])], batch_size=BATCH_SIZE)
+    return {name: Parameter.objects.get_or_create(name=name)[0].id for name in PARAMETERS}
+
+
+def generate_products(plan, parameters, start, stop):
+    # Products start..stop with their offers and offer parameters, returns the (category, shop) pairs used
+    sizes = plan['counts']
+    products, product_infos, product_parameters, pairs = [], [], [], set()
+    for number in range(start, stop):
+        generator = entity_random(plan, 'product', number)
+        category_id = plan['category_id'] + zipf_index(generator, sizes['categories'], 0.9)
+        product_id = plan['product_id'] + number
+        products.append(Product(id=product_id, category_id=category_id, name=f'Product {product_id}'))
+        for offer, (shop, price) in enumerate(product_offers(plan, number)):
+            product_info_id = plan['product_info_id'] + number * OFFERS_PER_PRODUCT + offer
+            shop_id = plan['shop_id'] + shop
+            pairs.add((category_id, shop_id))
+            product_infos.append(ProductInfo(
+                id=product_info_id, product_id=product_id, shop_id=shop_id, price=price,
+                price_rrc=Decimal(f'{float(price) * generator.uniform(1, 1.3):.2f}'),
+                quantity=int(generator.expovariate(1 / 50)) + 1))
+            for name in ['color'] + generator.sample(sorted(PARAMETERS)[1:], 1):
+                product_parameters.append(ProductParameter(product_info_id=product_info_id,
+                                                           parameter_id=parameters[name],
+                                                           value=generator.choice(PARAMETERS[name])))
+    with transaction.atomic():
+        Product.objects.bulk_create(products, batch_size=BATCH_SIZE)
+        ProductInfo.objects.bulk_create(product_infos, batch_size=BATCH_SIZE)
+        ProductParameter.objects.bulk_create(product_parameters, batch_size=BATCH_SIZE)
+    return pairs
+
+
+def insert_raw(model, objs):
+    # bulk_create in raw mode, the way loaddata saves: auto_now_add fields keep the generated dates instead of the
+    # current time. Rows without an id get the ones the database assigned.
+    meta = model._meta
+    with_ids = bool(objs) and objs[0].pk is not None
+    fields = [field for field in meta.concrete_fields if with_ids or field is not meta.pk]
+    queryset = model._base_manager.all()
+    batch_size = min(BATCH_SIZE, max(connection.ops.bulk_batch_size(fields, objs), 1))
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        rows = queryset._insert(batch, fields, returning_fields=None if with_ids else meta.db_returning_fields,
+                                raw=True)
+        for obj, row in zip(batch, rows or []):
+            obj.pk = row[0]
+            obj._state.adding = False
+
+
+def generate_orders(plan, start, stop):
+    # Orders start..stop spread over HISTORY_DAYS, split into shop orders like checkout does
+    sizes = plan['counts']
+    offer_count = sizes['products'] * OFFERS_PER_PRODUCT
+    statuses, weights = list(ORDER_STATUSES), list(ORDER_STATUSES.values())
+    orders, shop_orders, lines = [], [], []
+    for number in range(start, stop):
+        generator = entity_random(plan, 'order', number)
+        order_id = plan['order_id'] + number
+        status = generator.choices(statuses, weights)[0]
+        dt = plan['until'] - timedelta(seconds=generator.uniform(0, HISTORY_DAYS * 86400))
+        orders.append(Order(id=order_id, user_id=plan['account_id'] + sizes['shops'] + generator.randrange(
+            sizes['buyers']), status=status, dt=dt))
+        items = {}
+        for _ in range(min(20, max(1, round(generator.gauss(5, 2))))):
+            offer = zipf_index(generator, offer_count)
+            items[offer] = items.get(offer, 0) + min(10, int(generator.expovariate(0.7)) + 1)
+        by_shop = {}
+        for offer, quantity in sorted(items.items()):
+            shop, price = product_offers(plan, offer // OFFERS_PER_PRODUCT)[offer % OFFERS_PER_PRODUCT]
+            by_shop.setdefault(plan['shop_id'] + shop, []).append(
+                (plan['product_info_id'] + offer, quantity, price))
+        for shop_id, shop_lines in by_shop.items():
+            shop_order = None
+            if status != 'basket':
+                shop_order = ShopOrder(order_id=order_id, shop_id=shop_id, status=status, dt=dt, notified=dt,
+                                       total_sum=sum(quantity * price for _, quantity, price in shop_lines))
+                shop_orders.append(shop_order)
+            lines.extend((order_id, shop_order, product_info_id, quantity)
+                         for product_info_id, quantity, _ in shop_lines)
+    with transaction.atomic():
+        insert_raw(Order, orders)
+        insert_raw(ShopOrder, shop_orders)
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order_id, shop_order_id=shop_order.id if shop_order else None,
+                      product_info_id=product_info_id, quantity=quantity)
+            for order_id, shop_order, product_info_id, quantity in lines], batch_size=BATCH_SIZE)
+    return len(lines)
+
+
+def link_categories(pairs):
+    Category.shops.through.objects.bulk_create(
+        [Category.shops.through(category_id=category_id, shop_id=shop_id) for category_id, shop_id in sorted(pairs)],
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def finish():
+    # Sequences continue after the explicit ids, statistics are refreshed for the planner
+    from django.core.management.color import no_style
+
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Account, Shop, Category, Product, ProductInfo,
+                                                                  Order]):
+            cursor.execute(sql)
+        cursor.execute('ANALYZE')
@@ -0,0 +1,85 @@
+from decimal import Decimal
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+from app.metrics import observe_cache
+from app.models import DeliveryRate
+
+_rate_tables = {}
+_lock = Lock()
+
+
+class RateTable:
+    # In-memory copy of a shop delivery rate, tiers are sorted by min_quantity
+    def __init__(self, version=0, base_fee=Decimal('0'), free_threshold=None, tiers=(), rate_id=None):
+        self.rate_id = rate_id
+        self.version = version
+        self.base_fee = base_fee
+        self.free_threshold = free_threshold
+        self.tiers = tuple(tiers)
+        self.loaded_at = monotonic()
+
+    def cost(self, quantity, subtotal):
+        if self.free_threshold is not None and subtotal >= self.free_threshold:
+            return Decimal('0')
+        surcharge = Decimal('0')
+        for min_quantity, fee in self.tiers:
+            if quantity < min_quantity:
+                break
+            surcharge = fee
+        return self.base_fee + surcharge
+
+
+def get_rate_tables(shop_ids):
+    # Rate tables for the given shops. Cached ones are checked against the rate versions with one query,
+    # the missing and outdated ones are loaded with two more
+    ttl = getattr(settings, 'DELIVERY_RATE_CACHE_TTL', 300)
+    now = monotonic()
+    with _lock:
+        tables = {shop_id: _rate_tables[shop_id] for shop_id in shop_ids
+                  if shop_id in _rate_tables and now - _rate_tables[shop_id].loaded_at < ttl}
+    if tables:
+        versions = dict(DeliveryRate.objects.filter(shop_id__in=tables).order_by().values_list('shop_id', 'version'))
+        tables = {shop_id: table for shop_id, table in tables.items() if table.version == versions.get(shop_id, 0)}
+    missing = set(shop_ids) - set(tables)
+    observe_cache('delivery_rate', len(tables), len(missing))
+    if missing:
+        loaded = {shop_id: RateTable() for shop_id in missing}
+        for rate in DeliveryRate.objects.filter(shop_id__in=missing).prefetch_related('tiers'):
+            loaded[rate.shop_id] = RateTable(rate.version, rate.base_fee, rate.free_threshold,
+                                             [(tier.min_quantity, tier.fee) for tier in rate.tiers.all()],
+                                             rate.id)
+        with _lock:
+            _rate_tables.update(loaded)
+        tables.update(loaded)
+    return tables
+
+
+def invalidate(shop_id=None):
+    # Dropping the cached rate table of a shop, or all of them
+    with _lock:
+        if shop_id is None:
+            _rate_tables.clear()
+        else:
+            _rate_tables.pop(shop_id, None)
+
+
+def invalidate_rate(rate_id):
+    # Dropping the cached rate table loaded from the given rate, tiers only know their rate id
+    with _lock:
+        for shop_id in [shop_id for shop_id, table in _rate_tables.items() if table.rate_id == rate_id]:
+            del _rate_tables[shop_id]
+
+
+def quote_order(order):
+    # Delivery cost per shop for an order with prefetched lines and product infos
+    totals = {}
+    for item in order.ordered_items.all():
+        shop_id = item.product_info.shop_id
+        quantity, subtotal = totals.get(shop_id, (0, Decimal('0')))
+        totals[shop_id] = (quantity + item.quantity, subtotal + item.quantity * item.product_info.price)
+    rate_tables = get_rate_tables(totals)
+    return {shop_id: rate_tables[shop_id].cost(quantity, subtotal)
+            for shop_id, (quantity, subtotal) in totals.items()}
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import Order, OrderItem, ShopOrder
+from app.outbox import enqueue_mass_mail
+
+DIGEST_STATUSES = ('new', 'confirmed')
+
+
+def queue_supplier_digests():
+    # Queueing one e-mail per supplier with all of their order lines they were not notified about yet
+    with transaction.atomic():
+        shop_order_ids = list(ShopOrder.objects.select_for_update(skip_locked=True).filter(
+            notified__isnull=True, status__in=DIGEST_STATUSES).values_list('id', flat=True))
+        if not shop_order_ids:
+            return 0
+        lines = OrderItem.objects.filter(
+            shop_order_id__in=shop_order_ids, shop_order__shop__user__isnull=False).order_by(
+            'shop_order__shop__user_id', 'shop_order_id', 'id').values_list(
+            'shop_order__shop__user__email', 'shop_order__shop__name', 'shop_order__order_id',
+            'shop_order__status', 'product_info__product__name', 'quantity', 'product_info__price')
+        status_names = dict(Order.CHOICES_STATUS)
+        digests = {}
+        for email, shop_name, order_id, status, product_name, quantity, price in lines:
+            digests.setdefault(email, []).append(
+                f'Заказ {order_id} ({shop_name}, {status_names[status]}): {product_name} x {quantity} по {price}')
+        enqueue_mass_mail([
+            (
+                # title:
+                'Новые заказы',
+                # message:
+                '\n'.join(digest_lines),
+                # from:
+                settings.EMAIL_HOST_USER,
+                # to:
+                [email]
+            )
+            for email, digest_lines in digests.items()
+        ])
+        ShopOrder.objects.filter(id__in=shop_order_ids).update(notified=timezone.now())
+    return len(digests)
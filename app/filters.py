@@ -1,7 +1,7 @@
 import django_filters
 from django_filters.rest_framework import FilterSet
 
-from app.models import ProductInfo
+from app.models import ProductInfo, Order, ShopOrder, OrderItem
 
 
 class ProductFilterSet(FilterSet):
@@ -11,4 +11,31 @@ class ProductFilterSet(FilterSet):
 
     class Meta:
         model = ProductInfo
-        fields = ['category', 'product', 'shop']
\ No newline at end of file
+        fields = ['category', 'product', 'shop']
+
+
+class OrderFilterSet(FilterSet):
+    # A column of the filtered table, no joined rows to remove with DISTINCT
+    status = django_filters.MultipleChoiceFilter(choices=Order.CHOICES_STATUS, distinct=False)
+    date_from = django_filters.IsoDateTimeFilter(field_name='dt', lookup_expr='gte')
+    date_to = django_filters.IsoDateTimeFilter(field_name='dt', lookup_expr='lte')
+
+    class Meta:
+        model = Order
+        fields = ['status', 'date_from', 'date_to']
+
+
+class ShopOrderFilterSet(OrderFilterSet):
+    class Meta:
+        model = ShopOrder
+        fields = ['status', 'date_from', 'date_to']
+
+
+class PartnerOrderItemFilterSet(FilterSet):
+    status = django_filters.MultipleChoiceFilter(field_name='shop_order__status', choices=Order.CHOICES_STATUS)
+    date_from = django_filters.IsoDateTimeFilter(field_name='shop_order__dt', lookup_expr='gte')
+    date_to = django_filters.IsoDateTimeFilter(field_name='shop_order__dt', lookup_expr='lte')
+
+    class Meta:
+        model = OrderItem
+        fields = ['status', 'date_from', 'date_to']
@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # PBKDF2 with the iteration count taken from PASSWORD_HASH_ITERATIONS.
+    # Stored hashes with another count are upgraded on the next successful login.
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,84 @@
+from decimal import Decimal
+from time import perf_counter
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from yaml import load as load_yaml, Loader
+
+from app.metrics import observe_import
+from app.models import Category, Shop, ProductInfo, Product, ProductParameter, Parameter, CatalogChange, \
+    PriceHistory
+
+
+def _changed(product_info, values, parameters):
+    current = {parameter.parameter_id: parameter.value for parameter in product_info.product_parameters.all()}
+    return any(getattr(product_info, field) != value for field, value in values.items()) or current != parameters
+
+
+def import_price_list(user_id, stream):
+    # Upserting the offers of the user shop by product from the yaml price list, offers missing from the list
+    # are deleted. Only the offers that changed are written and logged as catalog changes, changed prices are added
+    # to the price history. Returns the response data.
+    data = load_yaml(stream, Loader=Loader)
+    start = perf_counter()
+    try:
+        with transaction.atomic():
+            shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=user_id)
+
+            for category in data['categories']:
+                category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
+                category_object.shops.add(shop.id)
+                category_object.save()
+            offers = {product_info.product_id: product_info for product_info in
+                      ProductInfo.objects.filter(shop_id=shop.id).prefetch_related('product_parameters')}
+            changes, prices, now = [], [], timezone.now()
+            for item in data['goods']:
+                product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
+                values = {'price': Decimal(str(item['price'])), 'price_rrc': Decimal(str(item['price_rrc'])),
+                          'quantity': item['quantity']}
+                parameters = {}
+                for name, value in item['parameters'].items():
+                    parameter_object, _ = Parameter.objects.get_or_create(name=name)
+                    parameters[parameter_object.id] = str(value)
+                product_info = offers.pop(product.id, None)
+                if product_info is None or (product_info.price, product_info.price_rrc) != (values['price'],
+                                                                                            values['price_rrc']):
+                    prices.append(PriceHistory(product_id=product.id, shop_id=shop.id, price=values['price'],
+                                               price_rrc=values['price_rrc'], dt=now))
+                if product_info is None:
+                    product_info = ProductInfo.objects.create(product_id=product.id, shop_id=shop.id, **values)
+                elif _changed(product_info, values, parameters):
+                    ProductInfo.objects.filter(id=product_info.id).update(**values)
+                    ProductParameter.objects.filter(product_info_id=product_info.id).delete()
+                else:
+                    continue
+                ProductParameter.objects.bulk_create([
+                    ProductParameter(product_info_id=product_info.id, parameter_id=parameter_id, value=value)
+                    for parameter_id, value in parameters.items()])
+                changes.append(CatalogChange(kind='upsert', shop_id=shop.id, product_info_id=product_info.id))
+            # Offers left in the shop are not in the price list anymore
+            ProductInfo.objects.filter(id__in=[product_info.id for product_info in offers.values()]).delete()
+            changes += [CatalogChange(kind='delete', shop_id=shop.id, product_info_id=product_info.id)
+                        for product_info in offers.values()]
+            PriceHistory.objects.bulk_create(prices)
+            # Written last, the log lock is held for as short as possible. The log also tells
+            # manage.py build_catalog_snapshots which shop snapshots to serialize again.
+            CatalogChange.write(changes)
+    except KeyError as error:
+        return {'Status': False, 'Error': f'Field {str(error)} missing. Check the file for errors.'}
+    except IntegrityError as error:
+        # Another import of the same shop or categories committed first
+        return {'Status': False, 'Error': f'Price list import conflict, retry later: {error}'}
+    observe_import(len(data['goods']), perf_counter() - start)
+    return {'Status': True}
+
+
+def set_shops_status(shops, status):
+    # Switching the shops of a queryset on or off with one UPDATE, logging the catalog changes.
+    # Returns the number of shops whose status changed.
+    with transaction.atomic():
+        shop_ids = list(shops.select_for_update().exclude(status=status).values_list('id', flat=True))
+        if shop_ids:
+            Shop.objects.filter(id__in=shop_ids).update(status=status)
+            CatalogChange.write([CatalogChange(kind='shop', shop_id=shop_id, status=status) for shop_id in shop_ids])
+    return len(shop_ids)
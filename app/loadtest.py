@@ -0,0 +1,351 @@
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter, sleep
+
+import yaml
+from requests import Session, RequestException
+from rest_framework.authtoken.models import Token
+
+from app.models import Account
+
+SELLER_EMAIL = 'loadtest-seller@example.com'
+BUYER_EMAIL = 'loadtest-buyer-{}@example.com'
+PASSWORD = 'Load-test-password-1'
+CATEGORY_IDS = range(9000, 9010)
+
+
+def price_list(products, seed):
+    # Deterministic price list in the PartnerUpdateView yaml format
+    generator = random.Random(seed)
+    categories = [{'id': category, 'name': f'Load test category {category}'} for category in CATEGORY_IDS]
+    goods = [{
+        'name': f'Load test product {number}',
+        'category': generator.choice(categories)['id'],
+        'price': round(generator.lognormvariate(6, 1), 2),
+        'price_rrc': round(generator.lognormvariate(6.2, 1), 2),
+        'quantity': generator.randint(1, 500),
+        'parameters': {'color': generator.choice(['black', 'white', 'red']), 'size': generator.randint(1, 10)},
+    } for number in range(products)]
+    return yaml.dump({'shop': 'Load test shop', 'categories': categories, 'goods': goods}).encode()
+
+
+class FeedServer:
+    # Local http server giving the price list to the price import endpoint, after delay seconds
+    def __init__(self, content, delay=0):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                sleep(delay)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-yaml')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/price.yaml'
+
+    def __enter__(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+
+
+def seed_accounts(buyers):
+    # Active seller and buyer accounts with tokens, created directly in the database the server uses
+    def account(email, type_account):
+        user, created = Account.objects.get_or_create(email=email, defaults={
+            'type_account': type_account, 'is_active': True, 'first_name': 'Load', 'last_name': 'Test',
+            'surname': 'Test', 'position': 'Test'})
+        if created:
+            user.set_password(PASSWORD)
+            user.save()
+        return Token.objects.get_or_create(user=user)[0].key
+
+    return account(SELLER_EMAIL, 'seller'), [account(BUYER_EMAIL.format(number), 'buyer')
+                                             for number in range(buyers)]
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+class Stats:
+    # Throttled (429) responses are counted apart, they are neither served requests nor errors of the server
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.throttled = {}
+        self._lock = Lock()
+
+    def add(self, endpoint, latency, error):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + int(error)
+
+    def throttle(self, endpoint):
+        with self._lock:
+            self.throttled[endpoint] = self.throttled.get(endpoint, 0) + 1
+
+    def report(self, elapsed):
+        report = {}
+        for endpoint in sorted(set(self.latencies) | set(self.throttled)):
+            latencies = sorted(self.latencies.get(endpoint, []))
+            report[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(endpoint, 0),
+                'throttled': self.throttled.get(endpoint, 0),
+                'p50': percentile(latencies, 0.50) * 1000,
+                'p95': percentile(latencies, 0.95) * 1000,
+                'p99': percentile(latencies, 0.99) * 1000,
+                'rps': len(latencies) / elapsed,
+            }
+        return report
+
+
+class Client:
+    # requests session of one worker that times every call under an endpoint name
+    def __init__(self, base_url, stats):
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.session = Session()
+
+    def call(self, endpoint, method, path, token=None, **kwargs):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        start = perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+        except RequestException:
+            self.stats.add(endpoint, perf_counter() - start, True)
+            return None
+        if response.status_code == 429:
+            self.stats.throttle(endpoint)
+            return response
+        error = response.status_code >= 400 or (
+            response.headers.get('Content-Type', '').startswith('application/json')
+            and isinstance(response.json(), dict) and response.json().get('Status') is False)
+        self.stats.add(endpoint, perf_counter() - start, error)
+        return response
+
+
+class Context:
+    # Accounts and catalog size shared by the scenarios
+    def __init__(self, seller_token, buyer_tokens, feed_url, products):
+        self.seller_token = seller_token
+        self.buyer_tokens = buyer_tokens
+        self.feed_url = feed_url
+        self.products = products
+        self.registrations = 0
+        self._lock = Lock()
+
+    def next_email(self):
+        with self._lock:
+            self.registrations += 1
+            return f'loadtest-new-{random.getrandbits(32)}-{self.registrations}@example.com'
+
+
+def browse_catalog(client, context, buyer, generator):
+    client.call('GET api/v1/', 'get', '/api/v1/')
+    client.call('GET api/v1/shops/', 'get', '/api/v1/shops/')
+    client.call('GET api/v1/category/', 'get', '/api/v1/category/')
+    client.call('GET api/v1/products/', 'get', '/api/v1/products/', params={'limit': 30})
+    client.call('GET api/v1/products/?offset=', 'get', '/api/v1/products/',
+                params={'offset': generator.randrange(0, max(1, context.products - 30))})
+    client.call('GET api/v1/products/?category=', 'get', '/api/v1/products/',
+                params={'category': generator.choice(CATEGORY_IDS)})
+
+
+def edit_basket(client, context, buyer, generator):
+    # Offers are picked from the catalog page, the price import replaces their ids
+    response = client.call('GET api/v1/products/?offset=', 'get', '/api/v1/products/',
+                           params={'offset': generator.randrange(0, max(1, context.products - 30))})
+    offers = [offer['id'] for offer in response.json()['results']] if response is not None and response.ok else []
+    items = [{'product_info': product_info, 'quantity': generator.randint(1, 3)}
+             for product_info in generator.sample(offers, min(3, len(offers)))]
+    client.call('POST api/v1/basket', 'post', '/api/v1/basket', buyer, json={'items': items})
+    response = client.call('GET api/v1/basket', 'get', '/api/v1/basket', buyer)
+    baskets = response.json() if response is not None and response.ok else []
+    lines = [line['id'] for basket in baskets for line in basket['ordered_items']]
+    if lines:
+        client.call('PATCH api/v1/basket', 'patch', '/api/v1/basket', buyer,
+                    json={'items': [{'id': lines[0], 'quantity': generator.randint(1, 5)}]})
+        client.call('DELETE api/v1/basket', 'delete', '/api/v1/basket', buyer, json={'items': lines[-1:]})
+
+
+def checkout(client, context, buyer, generator):
+    edit_basket(client, context, buyer, generator)
+    response = client.call('GET api/v1/basket', 'get', '/api/v1/basket', buyer)
+    baskets = response.json() if response is not None and response.ok else []
+    if baskets:
+        client.call('PATCH api/v1/basket/update', 'patch', '/api/v1/basket/update', buyer,
+                    json={'id': baskets[0]['id']})
+    client.call('GET api/v1/basket/update', 'get', '/api/v1/basket/update', buyer)
+
+
+def buyer_account(client, context, buyer, generator):
+    client.call('GET api/v1/account/bayer', 'get', '/api/v1/account/bayer', buyer)
+    client.call('PATCH api/v1/account/bayer', 'patch', '/api/v1/account/bayer', buyer, json={'position': 'Buyer'})
+    client.call('GET api/v1/partner/contacts', 'get', '/api/v1/partner/contacts', buyer)
+    client.call('POST api/v1/partner/contacts', 'post', '/api/v1/partner/contacts', buyer,
+                json={'type': 'address', 'value': 'Load test street'})
+    response = client.call('GET api/v1/partner/contacts', 'get', '/api/v1/partner/contacts', buyer)
+    contacts = response.json() if response is not None and response.ok else []
+    addresses = [contact['id'] for contact in contacts if contact['type'] == 'address']
+    if addresses:
+        client.call('PATCH api/v1/partner/contacts', 'patch', '/api/v1/partner/contacts', buyer,
+                    json={'id': addresses[0], 'value': 'Load test avenue'})
+        client.call('DELETE api/v1/partner/contacts', 'delete', '/api/v1/partner/contacts', buyer,
+                    json={'id': addresses[0]})
+
+
+def partner_orders(client, context, buyer, generator):
+    seller = context.seller_token
+    client.call('GET api/v1/partner/shop', 'get', '/api/v1/partner/shop', seller)
+    client.call('PATCH api/v1/partner/shop', 'patch', '/api/v1/partner/shop', seller, json={'status': True})
+    client.call('GET api/v1/partner/delivery', 'get', '/api/v1/partner/delivery', seller)
+    response = client.call('GET api/v1/partner/orders', 'get', '/api/v1/partner/orders', seller,
+                           params={'status': 'new'})
+    orders = response.json()['results'] if response is not None and response.ok else []
+    if orders:
+        client.call('PATCH api/v1/partner/orders', 'patch', '/api/v1/partner/orders', seller,
+                    json={'ids': [order['id'] for order in orders[:10]], 'status': 'confirmed'})
+    client.call('GET api/v1/partner/orders/export', 'get', '/api/v1/partner/orders/export', seller,
+                params={'output': 'ndjson'})
+
+
+def price_import(client, context, buyer, generator):
+    client.call('POST api/v1/partner/delivery', 'post', '/api/v1/partner/delivery', context.seller_token,
+                json={'base_fee': '300.00', 'free_threshold': '10000.00',
+                      'tiers': [{'min_quantity': 10, 'fee': '150.00'}]})
+    client.call('POST api/v1/partner/update', 'post', '/api/v1/partner/update', context.seller_token,
+                json={'url': context.feed_url})
+
+
+def authentication(client, context, buyer, generator):
+    email = context.next_email()
+    client.call('POST api/v1/account/register', 'post', '/api/v1/account/register',
+                json={'email': email, 'password': PASSWORD, 'first_name': 'Load', 'last_name': 'Test',
+                      'surname': 'Test', 'position': 'Test'})
+    client.call('PATCH api/v1/account/confirm', 'patch', '/api/v1/account/confirm',
+                json={'email': email, 'token': 'invalid'})
+    # The logins are spread over the buyers, the auth_email throttle allows a few per minute for each
+    client.call('POST api/v1/account/login', 'post', '/api/v1/account/login',
+                json={'email': BUYER_EMAIL.format(generator.randrange(len(context.buyer_tokens))),
+                      'password': PASSWORD})
+    client.call('POST api/v1/account/password-reset', 'post', '/api/v1/account/password-reset',
+                json={'email': email})
+    client.call('POST api/v1/account/password_reset/confirm', 'post', '/api/v1/account/password_reset/confirm',
+                json={'token': 'invalid', 'password': PASSWORD})
+
+
+def catalog_copy(client, context, buyer, generator):
+    # Clients keeping a local copy of the catalog: snapshot download, change log polling and price history
+    client.call('GET api/v1/products/snapshot', 'get', '/api/v1/products/snapshot')
+    response = client.call('GET api/v1/products/changes', 'get', '/api/v1/products/changes',
+                           params={'since': 0, 'limit': 100})
+    if response is not None and response.ok and response.json()['more']:
+        client.call('GET api/v1/products/changes?since=', 'get', '/api/v1/products/changes',
+                    params={'since': response.json()['cursor'], 'limit': 100})
+    response = client.call('GET api/v1/products/?fields=', 'get', '/api/v1/products/', params={
+        'fields': 'shop,product', 'expand': '', 'offset': generator.randrange(0, max(1, context.products - 30))})
+    offers = response.json()['results'] if response is not None and response.ok else []
+    if offers:
+        offer = generator.choice(offers)
+        client.call('GET api/v1/products/{id}/prices', 'get', f'/api/v1/products/{offer["product"]}/prices')
+        client.call('GET api/v1/products/{id}/prices?shop=', 'get', f'/api/v1/products/{offer["product"]}/prices',
+                    params={'shop': offer['shop']})
+        client.call('GET api/v1/products/snapshot/{shop}', 'get', f'/api/v1/products/snapshot/{offer["shop"]}')
+
+
+def batch(client, context, buyer, generator):
+    # The reads of a buyer screen in one request
+    client.call('POST api/v1/batch', 'post', '/api/v1/batch', buyer, json={'requests': [
+        {'method': 'GET', 'path': '/api/v1/basket'},
+        {'method': 'GET', 'path': '/api/v1/partner/contacts'},
+        {'method': 'GET', 'path': '/api/v1/basket/update'},
+    ]})
+
+
+def monitoring(client, context, buyer, generator):
+    client.call('GET metrics', 'get', '/metrics')
+
+
+# Scenario name -> (function, relative weight in the traffic mix)
+SCENARIOS = {
+    'catalog': (browse_catalog, 10),
+    'basket': (edit_basket, 4),
+    'checkout': (checkout, 2),
+    'account': (buyer_account, 2),
+    'partner': (partner_orders, 2),
+    'import': (price_import, 0.2),
+    'auth': (authentication, 0.5),
+    'copy': (catalog_copy, 1),
+    'batch': (batch, 1),
+    'monitoring': (monitoring, 0.5),
+}
+
+
+def catalog_lists(client, context, buyer, generator):
+    # Reading the shop, category and product lists
+    for name in ('shops', 'category', 'products'):
+        client.call(f'GET {name}', 'get', f'/api/v1/{name}/')
+
+
+def feed_import(path):
+    # Scenario importing the price list through the endpoint at path
+    def scenario(client, context, buyer, generator):
+        client.call('POST partner/update', 'post', path, context.seller_token, json={'url': context.feed_url})
+    return scenario
+
+
+def run(base_url, context, scenarios, concurrency, duration, seed):
+    # Runs the weighted mix of (scenario, weight) pairs from concurrency workers for duration seconds
+    stats = Stats()
+    functions = [function for function, _ in scenarios]
+    weights = [weight for _, weight in scenarios]
+
+    def worker(number):
+        generator = random.Random(seed + number)
+        client = Client(base_url, stats)
+        buyer = context.buyer_tokens[number % len(context.buyer_tokens)]
+        deadline = perf_counter() + duration
+        while perf_counter() < deadline:
+            generator.choices(functions, weights)[0](client, context, buyer, generator)
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return stats.report(perf_counter() - start)
+
+
+def compare(report, baseline, tolerance):
+    # Endpoints whose p95 latency grew by more than tolerance against the baseline
+    regressions = []
+    for endpoint, result in report.items():
+        previous = baseline.get(endpoint)
+        if previous and previous['p95'] and result['p95'] > previous['p95'] * (1 + tolerance):
+            regressions.append((endpoint, previous['p95'], result['p95']))
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, report):
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Moves delivered and canceled orders older than ORDER_ARCHIVE_AFTER_DAYS to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Orders moved per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds between batches')
+
+    def handle(self, *args, **options):
+        archived = archive_orders(options['batch_size'], options['pause'])
+        self.stdout.write(f'Archived {archived} orders')
@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+from django.conf import settings
+
+from app import loadtest
+from app.management.commands.loadtest import Command as LoadTestCommand
+
+
+class Command(LoadTestCommand):
+    help = 'Compares concurrent-connection throughput of the catalog and price import under WSGI and ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50, help='Parallel connections')
+        parser.add_argument('--duration', type=float, default=15, help='Seconds of load per server')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes of each server')
+        parser.add_argument('--products', type=int, default=50, help='Offers in the imported price list')
+        parser.add_argument('--feed-delay', type=float, default=1.0,
+                            help='Seconds the price list server waits before answering, a slow partner')
+        parser.add_argument('--import-weight', type=float, default=1,
+                            help='Price imports per 10 catalog scenarios, 0 measures the catalog alone')
+        parser.add_argument('--wsgi-port', type=int, default=8101, help='Port of the gunicorn WSGI server')
+        parser.add_argument('--asgi-port', type=int, default=8102, help='Port of the uvicorn ASGI server')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the traffic')
+
+    def handle(self, *args, **options):
+        servers = [
+            # (name, command, port, price import path)
+            ('WSGI', ['gunicorn', 'DeliveryService.wsgi:application', '--workers', str(options['workers']),
+                      '--bind', f'127.0.0.1:{options["wsgi_port"]}'],
+             options['wsgi_port'], '/api/v1/partner/update'),
+            ('ASGI', ['uvicorn', 'DeliveryService.asgi:application', '--workers', str(options['workers']),
+                      '--port', str(options['asgi_port']), '--no-access-log'],
+             options['asgi_port'], '/api/v1/async/partner/update'),
+        ]
+        content = loadtest.price_list(options['products'], options['seed'])
+        totals = []
+        with loadtest.FeedServer(content, options['feed_delay']) as feed:
+            for name, command, port, import_path in servers:
+                base_url = f'http://127.0.0.1:{port}'
+                server = subprocess.Popen([sys.executable, '-m'] + command, cwd=settings.BASE_DIR,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    self.wait_for(base_url)
+                    context = self.seed(base_url, feed.url, options['concurrency'])
+                    scenarios = [(loadtest.catalog_lists, 10)]
+                    if options['import_weight']:
+                        scenarios.append((loadtest.feed_import(import_path), options['import_weight']))
+                    self.stdout.write(f'{name}: {options["concurrency"]} connections for '
+                                      f'{options["duration"]:.0f}s against {" ".join(command[:2])}')
+                    report = loadtest.run(base_url, context, scenarios, options['concurrency'],
+                                          options['duration'], options['seed'])
+                finally:
+                    server.terminate()
+                    server.wait()
+                self.write_report(report)
+                totals.append((name, sum(result['rps'] for result in report.values()),
+                               sum(result['errors'] for result in report.values())))
+        for name, rps, errors in totals:
+            self.stdout.write(f'{name}: {rps:.1f} req/s, {errors} errors')
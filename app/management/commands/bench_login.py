@@ -0,0 +1,32 @@
+from multiprocessing import Pool
+from time import perf_counter
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand
+
+
+def _check_passwords(args):
+    encoded, password, count = args
+    for _ in range(count):
+        check_password(password, encoded)
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Measures password checks (logins) per second with the configured PASSWORD_HASHERS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20, help='Password checks per process')
+        parser.add_argument('--processes', type=int, default=1, help='Processes checking passwords in parallel')
+
+    def handle(self, *args, **options):
+        password = 'benchmark-password'
+        encoded = make_password(password)
+        processes = options['processes']
+        start = perf_counter()
+        with Pool(processes) as pool:
+            checked = sum(pool.map(_check_passwords, [(encoded, password, options['count'])] * processes))
+        elapsed = perf_counter() - start
+        self.stdout.write(f'Hasher: {encoded.split("$", 2)[0]}, iterations: {encoded.split("$", 2)[1]}')
+        self.stdout.write(f'{checked} logins in {elapsed:.2f}s: {checked / elapsed:.1f} logins/sec, '
+                          f'{checked / elapsed / processes:.1f} logins/sec per core')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the gzip catalog snapshots of the shops changed since the last run and of the whole catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Serialize every active shop again')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            snapshots.rebuild_all()
+        else:
+            shop_ids = snapshots.rebuild_changed()
+            if shop_ids is not None:
+                self.stdout.write(f'Changed shops: {", ".join(map(str, shop_ids)) or "none"}')
+        for output in snapshots.formats():
+            path = snapshots.snapshot_path(output)
+            self.stdout.write(f'{path}: {path.stat().st_size} bytes')
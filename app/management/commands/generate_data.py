@@ -0,0 +1,94 @@
+from datetime import datetime
+from multiprocessing import get_context
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from app import datagen
+
+_plan = None
+_parameters = None
+
+
+def _init_worker(plan, parameters):
+    global _plan, _parameters
+    _plan, _parameters = plan, parameters
+    if connection.vendor == 'postgresql':
+        # Generated rows can be regenerated, waiting for the WAL flush on every chunk is not needed
+        with connection.cursor() as cursor:
+            cursor.execute('SET synchronous_commit TO OFF')
+
+
+def _products(chunk):
+    return datagen.generate_products(_plan, _parameters, *chunk)
+
+
+def _orders(chunk):
+    return datagen.generate_orders(_plan, *chunk)
+
+
+class Command(BaseCommand):
+    help = 'Generates a reproducible synthetic dataset, scale 1 is 100 shops, 1M offers and about 5M order lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=0.01, help='Scale factor of the dataset')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--until', default='2022-04-01',
+                            help='Date of the most recent generated order, YYYY-MM-DD')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Processes inserting chunks in parallel, SQLite always uses one')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Products or orders per chunk')
+        parser.add_argument('--password', default='password', help='Password of all generated accounts')
+
+    def handle(self, *args, **options):
+        try:
+            until = timezone.make_aware(datetime.strptime(options['until'], '%Y-%m-%d'))
+        except ValueError:
+            raise CommandError('--until must be a date in the YYYY-MM-DD format.')
+        workers = 1 if connection.vendor == 'sqlite' else max(1, options['workers'])
+        plan = datagen.plan_dataset(options['scale'], options['seed'], make_password(options['password']), until)
+        sizes = plan['counts']
+        self.stdout.write(', '.join(f'{count} {name}' for name, count in sizes.items()) +
+                          f', {sizes["products"] * datagen.OFFERS_PER_PRODUCT} offers')
+
+        start = perf_counter()
+        parameters = datagen.create_dimensions(plan)
+        self.stdout.write(f'Accounts, shops and categories: {perf_counter() - start:.1f}s')
+
+        chunk_size = options['chunk_size']
+        # Forked workers must not share the connection of the parent process
+        connections.close_all()
+        with get_context('fork').Pool(workers, _init_worker, (plan, parameters)) if workers > 1 else _Serial(
+                plan, parameters) as pool:
+            start = perf_counter()
+            pairs = set()
+            for chunk_pairs in pool.imap_unordered(_products, self.chunks(sizes['products'], chunk_size)):
+                pairs |= chunk_pairs
+            datagen.link_categories(pairs)
+            self.stdout.write(f'Products and offers: {perf_counter() - start:.1f}s')
+
+            start = perf_counter()
+            lines = sum(pool.imap_unordered(_orders, self.chunks(sizes['orders'], chunk_size)))
+            self.stdout.write(f'Orders with {lines} lines: {perf_counter() - start:.1f}s')
+        datagen.finish()
+
+    def chunks(self, total, size):
+        return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+class _Serial:
+    # Pool replacement running the chunks in the current process
+    def __init__(self, plan, parameters):
+        _init_worker(plan, parameters)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def imap_unordered(self, function, chunks):
+        return map(function, chunks)
@@ -0,0 +1,101 @@
+import subprocess
+import sys
+from time import sleep, monotonic
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from requests import post, get, RequestException
+
+from app import loadtest, snapshots
+
+
+class Command(BaseCommand):
+    help = 'Runs the API load test against a server and reports p50/p95/p99 latency and throughput per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server under test')
+        parser.add_argument('--start-server', action='store_true',
+                            help='Start "manage.py runserver" on the --base-url port for the run')
+        parser.add_argument('--concurrency', type=int, default=10, help='Parallel virtual users')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of load')
+        parser.add_argument('--scenarios', default=','.join(loadtest.SCENARIOS),
+                            help='Comma separated scenarios of the traffic mix')
+        parser.add_argument('--products', type=int, default=1000, help='Offers in the seeded price list')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data and the traffic')
+        parser.add_argument('--baseline', help='JSON file with the results to compare against')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results to --baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95 growth against the baseline, 0.2 is 20%%')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(loadtest.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}.')
+        base_url = options['base_url'].rstrip('/')
+        server = self.start_server(base_url) if options['start_server'] else None
+        try:
+            self.wait_for(base_url)
+            with loadtest.FeedServer(loadtest.price_list(options['products'], options['seed'])) as feed:
+                context = self.seed(base_url, feed.url, options['concurrency'])
+                self.stdout.write(f'Running {", ".join(scenarios)} with {options["concurrency"]} users '
+                                  f'for {options["duration"]:.0f}s against {base_url}')
+                report = loadtest.run(base_url, context, [loadtest.SCENARIOS[name] for name in scenarios],
+                                      options['concurrency'], options['duration'], options['seed'])
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+        self.write_report(report)
+        if options['baseline']:
+            if options['save_baseline']:
+                loadtest.save_baseline(options['baseline'], report)
+                self.stdout.write(f'Baseline saved to {options["baseline"]}')
+            else:
+                self.check_baseline(report, loadtest.load_baseline(options['baseline']), options['tolerance'])
+
+    def start_server(self, base_url):
+        address = base_url.split('://', 1)[-1]
+        return subprocess.Popen([sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runserver', '--noreload',
+                                 address], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_for(self, base_url, timeout=30):
+        deadline = monotonic() + timeout
+        while True:
+            try:
+                get(f'{base_url}/api/v1/', timeout=1)
+                return
+            except RequestException:
+                if monotonic() > deadline:
+                    raise CommandError(f'Server {base_url} is not available.')
+                sleep(0.2)
+
+    def seed(self, base_url, feed_url, users):
+        # Accounts come from the database, the catalog from a price import through the API. The snapshots are
+        # written to the CATALOG_SNAPSHOT_DIR the server reads.
+        seller_token, buyer_tokens = loadtest.seed_accounts(users)
+        response = post(f'{base_url}/api/v1/partner/update', json={'url': feed_url},
+                        headers={'Authorization': f'Token {seller_token}'})
+        if not response.ok or not response.json().get('Status'):
+            raise CommandError(f'Price import failed: {response.text}')
+        snapshots.rebuild_changed()
+        products = get(f'{base_url}/api/v1/products/', params={'limit': 1}).json()['count']
+        return loadtest.Context(seller_token, buyer_tokens, feed_url, products)
+
+    def write_report(self, report):
+        self.stdout.write(f'{"Endpoint":<45}{"Requests":>9}{"Errors":>8}{"Throttled":>10}{"p50 ms":>9}{"p95 ms":>9}'
+                          f'{"p99 ms":>9}{"req/s":>9}')
+        for endpoint, result in report.items():
+            self.stdout.write(f'{endpoint:<45}{result["requests"]:>9}{result["errors"]:>8}{result["throttled"]:>10}'
+                              f'{result["p50"]:>9.1f}{result["p95"]:>9.1f}{result["p99"]:>9.1f}{result["rps"]:>9.1f}')
+
+    def check_baseline(self, report, baseline, tolerance):
+        if not baseline:
+            self.stdout.write('No baseline to compare with, run with --save-baseline first.')
+            return
+        regressions = loadtest.compare(report, baseline, tolerance)
+        for endpoint, previous, current in regressions:
+            self.stderr.write(f'{endpoint}: p95 {previous:.1f}ms -> {current:.1f}ms')
+        if regressions:
+            raise CommandError(f'{len(regressions)} endpoints are slower than the baseline.')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,24 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from app.outbox import send_queued
+
+
+class Command(BaseCommand):
+    help = 'Sends queued e-mails from the outbox in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Messages sent over one connection')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Exit when there are no due messages')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = send_queued(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Processed {processed} messages')
+                continue
+            if options['once']:
+                break
+            sleep(options['interval'])
@@ -0,0 +1,23 @@
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.digests import queue_supplier_digests
+
+
+class Command(BaseCommand):
+    help = 'Queues order digest e-mails for suppliers every SUPPLIER_DIGEST_WINDOW seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=float, default=None, help='Seconds between digests')
+        parser.add_argument('--once', action='store_true', help='Queue a single round of digests and exit')
+
+    def handle(self, *args, **options):
+        window = options['window'] or settings.SUPPLIER_DIGEST_WINDOW
+        while True:
+            queued = queue_supplier_digests()
+            self.stdout.write(f'Queued {queued} digests')
+            if options['once']:
+                break
+            sleep(window)
@@ -0,0 +1,88 @@
+import os
+from time import perf_counter
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+# With the PROMETHEUS_MULTIPROC_DIR environment variable set before start, every worker writes its samples
+# to that directory and the metrics view aggregates them, so all gunicorn workers are reported together.
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency', ['route', 'method'])
+REQUEST_COUNT = Counter('http_requests_total', 'Requests by response status', ['route', 'method', 'status'])
+REQUEST_DB_TIME = Histogram('http_request_db_duration_seconds', 'Database time per request', ['route'])
+CACHE_REQUESTS = Counter('cache_requests_total', 'In-process cache lookups', ['cache', 'result'])
+IMPORT_DURATION = Histogram('price_import_duration_seconds', 'Price list import duration',
+                            buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf')))
+IMPORT_ROWS = Counter('price_import_rows_total', 'Imported price list rows')
+IMPORT_THROUGHPUT = Histogram('price_import_rows_per_second', 'Price list import throughput',
+                              buckets=(10, 50, 100, 500, 1000, 5000, 10000, 50000, float('inf')))
+DB_ROUTES = Counter('db_routes_total', 'Requests by database and routing decision', ['database', 'reason'])
+INSTRUMENTATION_OVERHEAD = Histogram('metrics_overhead_seconds', 'Time spent recording request metrics',
+                                     buckets=(0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, float('inf')))
+
+
+def route_name(request):
+    # Url pattern of the request, keeps the label cardinality bounded
+    if request.resolver_match is None:
+        return 'unmatched'
+    return request.resolver_match.route
+
+
+def observe_request(request, response, duration, db_duration):
+    start = perf_counter()
+    route = route_name(request)
+    REQUEST_LATENCY.labels(route, request.method).observe(duration)
+    REQUEST_COUNT.labels(route, request.method, str(response.status_code)).inc()
+    if db_duration is not None:
+        REQUEST_DB_TIME.labels(route).observe(db_duration)
+    INSTRUMENTATION_OVERHEAD.observe(perf_counter() - start)
+
+
+def observe_cache(cache, hits, misses):
+    if hits:
+        CACHE_REQUESTS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, 'miss').inc(misses)
+
+
+def observe_db_route(database, reason):
+    DB_ROUTES.labels(database, reason).inc()
+
+
+def observe_import(rows, duration):
+    IMPORT_DURATION.observe(duration)
+    IMPORT_ROWS.inc(rows)
+    if duration > 0:
+        IMPORT_THROUGHPUT.observe(rows / duration)
+
+
+class OutboxCollector:
+    # E-mail outbox backlog, read from the database at scrape time
+    def collect(self):
+        from app.models import OutgoingEmail
+
+        queued = OutgoingEmail.objects.filter(status__in=['queued', 'sending'])
+        backlog = GaugeMetricFamily('email_outbox_backlog', 'Queued e-mails')
+        backlog.add_metric([], queued.count())
+        yield backlog
+        oldest = queued.order_by('created').values_list('created', flat=True).first()
+        age = GaugeMetricFamily('email_outbox_oldest_age_seconds', 'Age of the oldest queued e-mail')
+        age.add_metric([], (timezone.now() - oldest).total_seconds() if oldest else 0)
+        yield age
+
+
+def metrics_view(request):
+    # Prometheus text format endpoint, available to METRICS_ALLOWED_IPS
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    registry = CollectorRegistry()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(REGISTRY)
+    registry.register(OutboxCollector())
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
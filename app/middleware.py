@@ -0,0 +1,193 @@
+import cProfile
+from asyncio import coroutines, iscoroutinefunction
+from contextlib import ExitStack
+from random import randrange
+from threading import get_ident
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import Resolver404, resolve
+
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+
+from app.authentication import CachedTokenAuthentication
+from app.metrics import observe_db_route, observe_request, route_name
+from app.profiling import StackSampler, profile_path, write_collapsed
+from app.routers import ReplicaSelector, client_key, read_alias, sticky_cache
+
+
+class QueryStats:
+    # Database execute wrapper counting the queries and their total time
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+
+    def track(self):
+        # Context manager installing the wrapper on every configured database
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class QueryCountMiddleware:
+    # Reports the number of SQL queries and the database time of a request in the response headers,
+    # enabled with the QUERY_COUNT_ENABLED setting
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_COUNT_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with stats.track():
+            response = self.get_response(request)
+        timing = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+        response['X-Query-Count'] = str(stats.count)
+        return response
+
+
+class MetricsMiddleware:
+    # Records latency, status and database time of every request for the metrics endpoint,
+    # enabled with the METRICS_ENABLED setting. Runs natively under ASGI, where the database time is not
+    # recorded because the ORM works in other threads.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            self._is_coroutine = coroutines._is_coroutine
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.async_call(request)
+        stats = QueryStats()
+        start = perf_counter()
+        with stats.track():
+            response = self.get_response(request)
+        observe_request(request, response, perf_counter() - start, stats.duration)
+        return response
+
+    async def async_call(self, request):
+        start = perf_counter()
+        response = await self.get_response(request)
+        observe_request(request, response, perf_counter() - start, None)
+        return response
+
+
+class ProfilingMiddleware:
+    # Writes cProfile dumps of requests sent by staff with the PROFILING['HEADER'] header or sampled 1 in
+    # PROFILING['SAMPLE_RATE'], and flamegraph stacks of requests slower than PROFILING['SLOW_THRESHOLD']
+    def __init__(self, get_response):
+        self.config = getattr(settings, 'PROFILING', {})
+        if not self.config.get('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = 'HTTP_' + self.config.get('HEADER', 'X-Profile').upper().replace('-', '_')
+        self.sample_rate = self.config.get('SAMPLE_RATE', 0)
+        self.threshold = self.config.get('SLOW_THRESHOLD')
+        self.directory = self.config['DIRECTORY']
+        self.sampler = StackSampler(self.config.get('INTERVAL', 0.005))
+
+    def __call__(self, request):
+        if self.wants_profile(request):
+            return self.profile(request)
+        if self.threshold is None:
+            return self.get_response(request)
+        stats = QueryStats()
+        thread_id = get_ident()
+        self.sampler.start(thread_id)
+        start = perf_counter()
+        try:
+            with stats.track():
+                response = self.get_response(request)
+        finally:
+            stacks = self.sampler.stop(thread_id)
+        duration = perf_counter() - start
+        if duration >= self.threshold and stacks:
+            path = profile_path(self.directory, route_name(request), duration, stats.count, 'collapsed')
+            write_collapsed(path, stacks)
+        return response
+
+    def profile(self, request):
+        stats = QueryStats()
+        profiler = cProfile.Profile()
+        start = perf_counter()
+        with stats.track():
+            response = profiler.runcall(self.get_response, request)
+        duration = perf_counter() - start
+        path = profile_path(self.directory, route_name(request), duration, stats.count, 'prof')
+        profiler.dump_stats(path)
+        response['X-Profile'] = path.name
+        return response
+
+    def wants_profile(self, request):
+        if self.sample_rate and randrange(self.sample_rate) == 0:
+            return True
+        return self.header in request.META and self.is_staff(request)
+
+    def is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return True
+        try:
+            credentials = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return credentials is not None and credentials[0].is_staff
+
+
+class ReplicaRoutingMiddleware:
+    # Sends safe requests to views with read_replica = True to one of DATABASE_REPLICAS, except for clients
+    # that wrote in the last REPLICA_STICKY_SECONDS, and reports the decision in the X-DB-Route header
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.selector = ReplicaSelector()
+
+    def __call__(self, request):
+        alias, reason = self.route(request)
+        token = read_alias.set(alias if alias != DEFAULT_DB_ALIAS else None)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        if request.method not in SAFE_METHODS:
+            sticky_cache().set(client_key(request), True, settings.REPLICA_STICKY_SECONDS)
+        response['X-DB-Route'] = f'{alias}; reason={reason}'
+        observe_db_route(alias, reason)
+        return response
+
+    def route(self, request):
+        if request.method not in SAFE_METHODS:
+            return DEFAULT_DB_ALIAS, 'write'
+        try:
+            view_class = getattr(resolve(request.path_info).func, 'cls', None)
+        except Resolver404:
+            view_class = None
+        if not getattr(view_class, 'read_replica', False):
+            return DEFAULT_DB_ALIAS, 'primary'
+        if sticky_cache().get(client_key(request)):
+            return DEFAULT_DB_ALIAS, 'sticky'
+        alias = self.selector.choose()
+        if alias is None:
+            return DEFAULT_DB_ALIAS, 'lagging'
+        return alias, 'replica'
@@ -0,0 +1,61 @@
+# Generated by Django 4.0.3 on 2026-10-19 16:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Set based backfill of the placed orders: one shop order per (order, shop) with the total of its lines,
+# then the lines are linked to the shop order of their shop in a single update
+SPLIT_PLACED_ORDERS = [
+    """
+    INSERT INTO app_shoporder (order_id, shop_id, status, dt, total_sum)
+    SELECT app_order.id, app_productinfo.shop_id, app_order.status, app_order.dt,
+           SUM(app_orderitem.quantity * app_productinfo.price)
+    FROM app_order
+    JOIN app_orderitem ON app_orderitem.order_id = app_order.id
+    JOIN app_productinfo ON app_productinfo.id = app_orderitem.product_info_id
+    WHERE app_order.status <> 'basket'
+    GROUP BY app_order.id, app_productinfo.shop_id, app_order.status, app_order.dt
+    """,
+    """
+    UPDATE app_orderitem SET shop_order_id = app_shoporder.id
+    FROM app_productinfo, app_shoporder
+    WHERE app_productinfo.id = app_orderitem.product_info_id
+      AND app_shoporder.order_id = app_orderitem.order_id AND app_shoporder.shop_id = app_productinfo.shop_id
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dt', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], default='new', max_length=100, verbose_name='Статус заказа')),
+                ('total_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Сумма')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='app.order', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='app.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Заказ магазина',
+                'verbose_name_plural': 'Заказы магазинов',
+                'ordering': ['dt'],
+            },
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ordered_items', to='app.shoporder', verbose_name='Заказ магазина'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['shop', 'status', 'dt'], name='shop_order_shop_status_dt'),
+        ),
+        migrations.RunSQL(SPLIT_PLACED_ORDERS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-19 16:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_shop_orders'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status', 'dt'], name='order_user_status_dt'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:01
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_order_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_fee', models.DecimalField(decimal_places=2, default=0, max_digits=20, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Базовая стоимость доставки')),
+                ('free_threshold', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Сумма бесплатной доставки')),
+                ('version', models.PositiveIntegerField(default=1, verbose_name='Версия')),
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_rate', to='app.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Тариф доставки',
+                'verbose_name_plural': 'Тарифы доставки',
+                'ordering': ['shop'],
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Стоимость доставки'),
+        ),
+        migrations.AddField(
+            model_name='shoporder',
+            name='delivery_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Стоимость доставки'),
+        ),
+        migrations.CreateModel(
+            name='DeliveryRateTier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_quantity', models.PositiveIntegerField(verbose_name='Количество от')),
+                ('fee', models.DecimalField(decimal_places=2, max_digits=20, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Надбавка')),
+                ('rate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tiers', to='app.deliveryrate', verbose_name='Тариф доставки')),
+            ],
+            options={
+                'verbose_name': 'Ступень тарифа доставки',
+                'verbose_name_plural': 'Ступени тарифа доставки',
+                'ordering': ['min_quantity'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='deliveryratetier',
+            constraint=models.UniqueConstraint(fields=('rate', 'min_quantity'), name='unique_delivery_rate_tier'),
+        ),
+    ]
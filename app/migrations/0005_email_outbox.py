@@ -0,0 +1,39 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_delivery_rates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Тема')),
+                ('message', models.TextField(blank=True, verbose_name='Текст')),
+                ('from_email', models.CharField(blank=True, max_length=254, verbose_name='Отправитель')),
+                ('recipient', models.EmailField(max_length=254, verbose_name='Получатель')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('sent', 'Отправлено'), ('failed', 'Ошибка отправки')], default='queued', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попытки отправки')),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+            ],
+            options={
+                'verbose_name': 'Исходящее письмо',
+                'verbose_name_plural': 'Исходящие письма',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(fields=['status', 'next_attempt'], name='outgoing_email_status_next'),
+        ),
+    ]
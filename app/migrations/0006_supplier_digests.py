@@ -0,0 +1,22 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoporder',
+            name='notified',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата уведомления поставщика'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(condition=models.Q(('notified__isnull', True)), fields=['status'], name='shop_order_not_notified'),
+        ),
+    ]
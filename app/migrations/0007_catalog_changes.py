@@ -0,0 +1,29 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_supplier_digests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('upsert', 'Предложение добавлено или изменено'), ('delete', 'Предложение удалено'), ('shop', 'Изменен статус магазина')], max_length=10, verbose_name='Тип изменения')),
+                ('shop_id', models.PositiveBigIntegerField(verbose_name='Магазин')),
+                ('product_info_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Информация о продукте')),
+                ('status', models.BooleanField(blank=True, null=True, verbose_name='статус получения заказов')),
+                ('dt', models.DateTimeField(auto_now_add=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение каталога',
+                'verbose_name_plural': 'Изменения каталога',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_catalog_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=20, verbose_name='Цена')),
+                ('price_rrc', models.DecimalField(decimal_places=2, max_digits=20, verbose_name='Рекомендуемая розничная цена')),
+                ('dt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата изменения')),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='app.product', verbose_name='Продукт')),
+                ('shop', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='app.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'История цен',
+                'verbose_name_plural': 'История цен',
+                'ordering': ['dt'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pricehistory',
+            index=models.Index(fields=['product', 'shop', 'dt'], name='price_history_product_shop_dt'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_price_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('dt', models.DateTimeField(verbose_name='Дата создания')),
+                ('status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=100, verbose_name='Статус заказа')),
+                ('delivery_cost', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Стоимость доставки')),
+                ('total_sum', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True, verbose_name='Сумма')),
+                ('archived', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ',
+                'verbose_name_plural': 'Архивные заказы',
+                'ordering': ['dt'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedShopOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('dt', models.DateTimeField(verbose_name='Дата создания')),
+                ('status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=100, verbose_name='Статус заказа')),
+                ('total_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Сумма')),
+                ('delivery_cost', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Стоимость доставки')),
+                ('notified', models.DateTimeField(blank=True, null=True, verbose_name='Дата уведомления поставщика')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='app.archivedorder', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_shop_orders', to='app.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ магазина',
+                'verbose_name_plural': 'Архивные заказы магазинов',
+                'ordering': ['dt'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ordered_items', to='app.archivedorder', verbose_name='Заказ')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_items', to='app.productinfo', verbose_name='Продукт')),
+                ('shop_order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ordered_items', to='app.archivedshoporder', verbose_name='Заказ магазина')),
+            ],
+            options={
+                'verbose_name': 'Архивная позиция в заказе',
+                'verbose_name_plural': 'Архивные позиции в заказе',
+                'ordering': ['order'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedshoporder',
+            index=models.Index(fields=['shop', 'status', 'dt'], name='archived_shop_order_status_dt'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'status', 'dt'], name='archived_order_user_status_dt'),
+        ),
+    ]
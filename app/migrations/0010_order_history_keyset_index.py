@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'dt', 'id'], name='order_user_dt_id'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_order_history_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['shop', 'dt', 'id'], name='shop_order_shop_dt_id'),
+        ),
+    ]
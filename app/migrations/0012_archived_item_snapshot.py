@@ -0,0 +1,57 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_snapshot(apps, schema_editor):
+    # Lines archived before the snapshot columns take the name and price of their offer
+    ArchivedOrderItem = apps.get_model('app', 'ArchivedOrderItem')
+    ProductInfo = apps.get_model('app', 'ProductInfo')
+    for item in ArchivedOrderItem.objects.all().iterator():
+        offer = ProductInfo.objects.filter(id=item.product_info_id).values_list('product__name', 'price').first()
+        if offer:
+            item.product_name, item.price = offer
+            item.save(update_fields=['product_name', 'price'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_shop_order_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedorder',
+            name='archived_order_user_status_dt',
+        ),
+        migrations.RemoveIndex(
+            model_name='archivedshoporder',
+            name='archived_shop_order_status_dt',
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Цена'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='product_name',
+            field=models.CharField(default='', max_length=128, verbose_name='Название продукта'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='product_info',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_items', to='app.productinfo', verbose_name='Продукт'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'dt', 'id'], name='archived_order_user_dt_id'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedshoporder',
+            index=models.Index(fields=['shop', 'dt', 'id'], name='archived_shop_order_shop_dt_id'),
+        ),
+        migrations.RunPython(fill_snapshot, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.3 on 2026-10-19 17:57
+
+from django.db import migrations, models
+
+
+def create_lock(apps, schema_editor):
+    apps.get_model('app', 'CatalogChangeLock').objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_archived_item_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChangeLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Блокировка журнала каталога',
+                'verbose_name_plural': 'Блокировка журнала каталога',
+            },
+        ),
+        migrations.RunPython(create_lock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_catalog_change_lock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outgoingemail',
+            name='status',
+            field=models.CharField(choices=[('queued', 'В очереди'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка отправки')], default='queued', max_length=10, verbose_name='Статус'),
+        ),
+    ]
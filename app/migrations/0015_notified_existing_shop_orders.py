@@ -0,0 +1,20 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def mark_notified(apps, schema_editor):
+    # Shop orders placed before the digests existed are old news for the suppliers,
+    # the first digest must not list the whole order history
+    ShopOrder = apps.get_model('app', 'ShopOrder')
+    ShopOrder.objects.filter(notified__isnull=True, status__in=['new', 'confirmed']).update(notified=F('dt'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_outgoing_email_sending'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_notified, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,7 @@ from django.contrib.auth.base_user import AbstractBaseUser
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models import Sum, F
 from django.contrib.auth.models import PermissionsMixin
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -144,27 +145,95 @@ class Order(models.Model):
         ('delivered', 'Доставлен'),
         ('canceled', 'Отменен'),
     )
+    STATUS_TRANSITIONS = {
+        'new': ('confirmed', 'canceled'),
+        'confirmed': ('assembled', 'canceled'),
+        'assembled': ('sent', 'canceled'),
+        'sent': ('delivered',),
+    }
 
     user = models.ForeignKey(Account, verbose_name='Пользователь', on_delete=models.CASCADE,
                              null=False, blank=False, related_name='orders')
     dt = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
     status = models.CharField(verbose_name='Статус заказа', max_length=100, choices=CHOICES_STATUS, default='new')
+    delivery_cost = models.DecimalField(verbose_name='Стоимость доставки', decimal_places=2, max_digits=20,
+                                        default=0)
 
 
     class Meta:
         verbose_name = "Контакт"
         verbose_name_plural = "Контакты"
         ordering = ["dt"]
+        indexes = [
+            models.Index(fields=['user', 'status', 'dt'], name='order_user_status_dt'),
+            # Keyset order of the unfiltered history
+            models.Index(fields=['user', 'dt', 'id'], name='order_user_dt_id'),
+        ]
 
     def __str__(self):
         return f"{self.dt}, {self.status}"
 
+    @classmethod
+    def source_statuses(cls, status):
+        # Statuses from which an order can be moved to the given status
+        return [source for source, targets in cls.STATUS_TRANSITIONS.items() if status in targets]
+
+    def split_by_shop(self):
+        # Splitting the order into per-shop sub-orders and locking in their delivery cost
+        from app.delivery import get_rate_tables
+
+        totals = list(self.ordered_items.values('product_info__shop_id').annotate(
+            total_quantity=Sum('quantity'),
+            total_sum=Sum(F('quantity') * F('product_info__price'))).order_by())
+        rate_tables = get_rate_tables([item['product_info__shop_id'] for item in totals])
+        shop_orders = ShopOrder.objects.bulk_create([
+            ShopOrder(order_id=self.id, shop_id=item['product_info__shop_id'], status=self.status,
+                      total_sum=item['total_sum'],
+                      delivery_cost=rate_tables[item['product_info__shop_id']].cost(item['total_quantity'],
+                                                                                     item['total_sum']))
+            for item in totals])
+        for shop_order in shop_orders:
+            self.ordered_items.filter(product_info__shop_id=shop_order.shop_id).update(shop_order=shop_order)
+        self.delivery_cost = sum(shop_order.delivery_cost for shop_order in shop_orders)
+        self.save(update_fields=['delivery_cost'])
+        return shop_orders
+
+
+class ShopOrder(models.Model):
+    order = models.ForeignKey(Order, verbose_name='Заказ', on_delete=models.CASCADE, null=False, blank=False,
+                              related_name='shop_orders')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, null=False, blank=False,
+                             related_name='shop_orders')
+    dt = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+    status = models.CharField(verbose_name='Статус заказа', max_length=100, choices=Order.CHOICES_STATUS,
+                              default='new')
+    total_sum = models.DecimalField(verbose_name='Сумма', decimal_places=2, max_digits=20, default=0)
+    delivery_cost = models.DecimalField(verbose_name='Стоимость доставки', decimal_places=2, max_digits=20,
+                                        default=0)
+    notified = models.DateTimeField(verbose_name='Дата уведомления поставщика', null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Заказ магазина"
+        verbose_name_plural = "Заказы магазинов"
+        ordering = ["dt"]
+        indexes = [
+            models.Index(fields=['shop', 'status', 'dt'], name='shop_order_shop_status_dt'),
+            # Keyset order of the unfiltered partner history
+            models.Index(fields=['shop', 'dt', 'id'], name='shop_order_shop_dt_id'),
+            models.Index(fields=['status'], condition=models.Q(notified__isnull=True), name='shop_order_not_notified'),
+        ]
+
+    def __str__(self):
+        return f"{self.shop_id}, {self.dt}, {self.status}"
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, verbose_name='Заказ', on_delete=models.CASCADE, null=False, blank=False,
                               related_name='ordered_items')
     product_info = models.ForeignKey(ProductInfo, verbose_name='Продукт', on_delete=models.CASCADE,
                                      null=False, blank=False, related_name='ordered_items')
+    shop_order = models.ForeignKey(ShopOrder, verbose_name='Заказ магазина', on_delete=models.SET_NULL,
+                                   null=True, blank=True, related_name='ordered_items')
     quantity = models.PositiveIntegerField(verbose_name='Количество', null=False, blank=False, )
 
     class Meta:
@@ -175,6 +244,40 @@ class OrderItem(models.Model):
 
 
 
+class DeliveryRate(models.Model):
+    shop = models.OneToOneField(Shop, verbose_name='Магазин', on_delete=models.CASCADE, null=False, blank=False,
+                                related_name='delivery_rate')
+    base_fee = models.DecimalField(verbose_name='Базовая стоимость доставки', decimal_places=2, max_digits=20,
+                                   default=0, validators=[MinValueValidator(0)])
+    free_threshold = models.DecimalField(verbose_name='Сумма бесплатной доставки', decimal_places=2, max_digits=20,
+                                         null=True, blank=True, validators=[MinValueValidator(0)])
+    version = models.PositiveIntegerField(verbose_name='Версия', default=1)
+
+    class Meta:
+        verbose_name = "Тариф доставки"
+        verbose_name_plural = "Тарифы доставки"
+        ordering = ["shop"]
+
+    def __str__(self):
+        return f"{self.shop_id}, {self.base_fee}"
+
+
+class DeliveryRateTier(models.Model):
+    rate = models.ForeignKey(DeliveryRate, verbose_name='Тариф доставки', on_delete=models.CASCADE,
+                             null=False, blank=False, related_name='tiers')
+    min_quantity = models.PositiveIntegerField(verbose_name='Количество от', null=False, blank=False)
+    fee = models.DecimalField(verbose_name='Надбавка', decimal_places=2, max_digits=20,
+                              validators=[MinValueValidator(0)])
+
+    class Meta:
+        verbose_name = "Ступень тарифа доставки"
+        verbose_name_plural = "Ступени тарифа доставки"
+        ordering = ["min_quantity"]
+        constraints = [
+            models.UniqueConstraint(fields=['rate', 'min_quantity'], name='unique_delivery_rate_tier'),
+        ]
+
+
 class Contact(models.Model):
     CHOICES_CONTACT = (
         ('address', 'Адрес'),
@@ -196,3 +299,165 @@ class Contact(models.Model):
     def __str__(self):
         return f"{self.type}, {self.value}"
 
+
+class OutgoingEmail(models.Model):
+    CHOICES_STATUS = (
+        ('queued', 'В очереди'),
+        ('sending', 'Отправляется'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Ошибка отправки'),
+    )
+
+    subject = models.CharField(verbose_name='Тема', max_length=255, null=False, blank=False)
+    message = models.TextField(verbose_name='Текст', null=False, blank=True)
+    from_email = models.CharField(verbose_name='Отправитель', max_length=254, null=False, blank=True)
+    recipient = models.EmailField(verbose_name='Получатель', null=False, blank=False)
+    status = models.CharField(verbose_name='Статус', max_length=10, choices=CHOICES_STATUS, default='queued')
+    attempts = models.PositiveIntegerField(verbose_name='Попытки отправки', default=0)
+    next_attempt = models.DateTimeField(verbose_name='Следующая попытка', default=timezone.now)
+    last_error = models.TextField(verbose_name='Последняя ошибка', null=False, blank=True)
+    created = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+    sent = models.DateTimeField(verbose_name='Дата отправки', null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Исходящее письмо"
+        verbose_name_plural = "Исходящие письма"
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='outgoing_email_status_next'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient}, {self.subject}"
+
+
+class CatalogChange(models.Model):
+    # Append-only log of the catalog changes for clients keeping a local copy, read in id order.
+    # Plain ids instead of foreign keys, the log outlives the deleted offers.
+    CHOICES_KIND = (
+        ('upsert', 'Предложение добавлено или изменено'),
+        ('delete', 'Предложение удалено'),
+        ('shop', 'Изменен статус магазина'),
+    )
+
+    kind = models.CharField(verbose_name='Тип изменения', max_length=10, choices=CHOICES_KIND)
+    shop_id = models.PositiveBigIntegerField(verbose_name='Магазин')
+    product_info_id = models.PositiveBigIntegerField(verbose_name='Информация о продукте', null=True, blank=True)
+    status = models.BooleanField(verbose_name='статус получения заказов', null=True, blank=True)
+    dt = models.DateTimeField(verbose_name='Дата изменения', auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Изменение каталога"
+        verbose_name_plural = "Изменения каталога"
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"{self.kind}, {self.shop_id}, {self.product_info_id}"
+
+    @classmethod
+    def write(cls, changes):
+        # Last statement of the writing transaction: the lock is held until the commit, so the ids are allocated
+        # in commit order and a reader never sees an id before the lower ones are committed
+        if changes:
+            CatalogChangeLock.objects.select_for_update().get_or_create(id=1)
+            cls.objects.bulk_create(changes)
+
+
+class CatalogChangeLock(models.Model):
+    # Single row locked by the transactions writing to the catalog change log
+
+    class Meta:
+        verbose_name = "Блокировка журнала каталога"
+        verbose_name_plural = "Блокировка журнала каталога"
+
+
+class PriceHistory(models.Model):
+    # Append-only offer prices, a row is written only when an import changes the price of an offer.
+    # The single (product, shop, dt) index serves the time range queries of a product.
+    product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE, db_index=False,
+                                related_name='price_history')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, db_index=False,
+                             related_name='price_history')
+    price = models.DecimalField(verbose_name='Цена', decimal_places=2, max_digits=20)
+    price_rrc = models.DecimalField(verbose_name='Рекомендуемая розничная цена', decimal_places=2, max_digits=20)
+    dt = models.DateTimeField(verbose_name='Дата изменения', default=timezone.now)
+
+    class Meta:
+        verbose_name = "История цен"
+        verbose_name_plural = "История цен"
+        ordering = ["dt"]
+        indexes = [
+            models.Index(fields=['product', 'shop', 'dt'], name='price_history_product_shop_dt'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}, {self.shop_id}, {self.price}"
+
+
+class ArchivedOrder(models.Model):
+    # Delivered and canceled orders moved out of Order by app.archive, with their original ids.
+    # The total, product names and prices are frozen at archiving, the lines outlive the offers removed by imports.
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(Account, verbose_name='Пользователь', on_delete=models.CASCADE, db_index=False,
+                             related_name='archived_orders')
+    dt = models.DateTimeField(verbose_name='Дата создания')
+    status = models.CharField(verbose_name='Статус заказа', max_length=100, choices=Order.CHOICES_STATUS)
+    delivery_cost = models.DecimalField(verbose_name='Стоимость доставки', decimal_places=2, max_digits=20,
+                                        default=0)
+    total_sum = models.DecimalField(verbose_name='Сумма', decimal_places=2, max_digits=20, null=True, blank=True)
+    archived = models.DateTimeField(verbose_name='Дата архивации', auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Архивный заказ"
+        verbose_name_plural = "Архивные заказы"
+        ordering = ["dt"]
+        indexes = [
+            models.Index(fields=['user', 'dt', 'id'], name='archived_order_user_dt_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.dt}, {self.status}"
+
+
+class ArchivedShopOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, verbose_name='Заказ', on_delete=models.CASCADE,
+                              related_name='shop_orders')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, db_index=False,
+                             related_name='archived_shop_orders')
+    dt = models.DateTimeField(verbose_name='Дата создания')
+    status = models.CharField(verbose_name='Статус заказа', max_length=100, choices=Order.CHOICES_STATUS)
+    total_sum = models.DecimalField(verbose_name='Сумма', decimal_places=2, max_digits=20, default=0)
+    delivery_cost = models.DecimalField(verbose_name='Стоимость доставки', decimal_places=2, max_digits=20,
+                                        default=0)
+    notified = models.DateTimeField(verbose_name='Дата уведомления поставщика', null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Архивный заказ магазина"
+        verbose_name_plural = "Архивные заказы магазинов"
+        ordering = ["dt"]
+        indexes = [
+            models.Index(fields=['shop', 'dt', 'id'], name='archived_shop_order_shop_dt_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.shop_id}, {self.dt}, {self.status}"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, verbose_name='Заказ', on_delete=models.CASCADE,
+                              related_name='ordered_items')
+    # No constraint: the offer may be deleted by a later import, the line keeps its id, name and price
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Продукт', on_delete=models.DO_NOTHING,
+                                     db_constraint=False, related_name='archived_items')
+    shop_order = models.ForeignKey(ArchivedShopOrder, verbose_name='Заказ магазина', on_delete=models.SET_NULL,
+                                   null=True, blank=True, related_name='ordered_items')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    product_name = models.CharField(verbose_name='Название продукта', max_length=128)
+    price = models.DecimalField(verbose_name='Цена', decimal_places=2, max_digits=20)
+
+    class Meta:
+        verbose_name = "Архивная позиция в заказе"
+        verbose_name_plural = "Архивные позиции в заказе"
+        ordering = ["order"]
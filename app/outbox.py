@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import OutgoingEmail
+
+
+def enqueue_mail(subject, message, from_email, recipient_list):
+    # Putting a message into the outbox, one row per recipient
+    enqueue_mass_mail([(subject, message, from_email, recipient_list)])
+
+
+def enqueue_mass_mail(datatuple):
+    # Putting a batch of (subject, message, from_email, recipient_list) messages into the outbox with one INSERT
+    OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(subject=subject, message=message, from_email=from_email or '', recipient=recipient)
+        for subject, message, from_email, recipient_list in datatuple
+        for recipient in recipient_list
+    ])
+
+
+def claim(batch_size, now):
+    # Marking a batch of due messages as sending in a short transaction, other workers skip the locked rows.
+    # Messages of a worker that died while sending are due again after EMAIL_OUTBOX_SENDING_TIMEOUT.
+    with transaction.atomic():
+        emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True).filter(
+            status__in=['queued', 'sending'], next_attempt__lte=now).order_by('next_attempt')[:batch_size])
+        for email in emails:
+            email.status = 'sending'
+            email.next_attempt = now + timedelta(seconds=settings.EMAIL_OUTBOX_SENDING_TIMEOUT)
+        OutgoingEmail.objects.bulk_update(emails, ['status', 'next_attempt'])
+    return emails
+
+
+def send_queued(batch_size=None):
+    # Sending one batch of due messages over a single SMTP connection, returns the number of processed rows.
+    # No transaction is open during the SMTP session.
+    now = timezone.now()
+    emails = claim(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE, now)
+    if not emails:
+        return 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        for email in emails:
+            _failed(email, error, now)
+    else:
+        try:
+            for email in emails:
+                try:
+                    EmailMessage(email.subject, email.message, email.from_email or None, [email.recipient],
+                                 connection=connection).send()
+                except Exception as error:
+                    _failed(email, error, now)
+                else:
+                    email.status = 'sent'
+                    email.sent = timezone.now()
+                    email.attempts += 1
+        finally:
+            connection.close()
+    OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt', 'last_error', 'sent'])
+    return len(emails)
+
+
+def _failed(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.status = 'queued'
+        email.next_attempt = now + timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1))
@@ -0,0 +1,175 @@
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class DateCursorPagination(BasePagination):
+    # Keyset pagination over (dt, id), newest records first
+    page_size = 30
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None, archive=None, archived_before=None):
+        # archive holds rows created before archived_before with ids distinct from the queryset ones, it is
+        # read only when the live rows do not fill the page with newer records
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        page = self.fetch(queryset, position)
+        if archive is not None and (len(page) <= self.page_size or page[-1].dt < archived_before):
+            page = sorted(page + self.fetch(archive, position), key=lambda instance: (instance.dt, instance.id),
+                          reverse=True)[:self.page_size + 1]
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def fetch(self, queryset, position):
+        queryset = queryset.order_by('-dt', '-id')
+        if position:
+            dt, pk = position
+            queryset = queryset.filter(Q(dt__lt=dt) | Q(dt=dt, id__lt=pk))
+        return list(queryset[:self.page_size + 1])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            dt, pk = b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            dt, pk = parse_datetime(dt), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        # Ids past the bigint range fail in the database instead of matching nothing
+        if dt is None or not 0 < pk < 2 ** 63:
+            raise NotFound(self.invalid_cursor_message)
+        return dt, pk
+
+    def encode_cursor(self, instance):
+        position = f'{instance.dt.isoformat()}|{instance.id}'
+        return b64encode(position.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+def estimated_count(queryset):
+    # Planner row estimate of a queryset on PostgreSQL, None on databases without one
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    # Admin changelist paginator using the planner estimate instead of COUNT(*) when it is above
+    # ESTIMATED_COUNT_THRESHOLD rows, the last pages of an overestimated list are empty
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is None or estimate < settings.ESTIMATED_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+
+class EstimatedCountPagination(LimitOffsetPagination):
+    # Limit/offset pagination that stops counting big lists: above count_threshold rows (default
+    # ESTIMATED_COUNT_THRESHOLD) the count is the planner estimate on PostgreSQL, or an exact count cached for
+    # count_cache_timeout seconds elsewhere. ?count=exact always counts. With an estimated count the page is read
+    # with one extra row to know whether a next page exists.
+    count_threshold = None
+    count_cache = 'default'
+    count_cache_timeout = 60
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = self.get_count(queryset)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        if not self.estimated:
+            if self.count == 0 or self.offset > self.count:
+                return []
+            return list(queryset[self.offset:self.offset + self.limit])
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+        return page[:self.limit]
+
+    def get_count(self, queryset):
+        self.estimated = False
+        if self.request.query_params.get(self.count_query_param) == 'exact':
+            return super().get_count(queryset)
+        threshold = self.count_threshold or settings.ESTIMATED_COUNT_THRESHOLD
+        estimate = estimated_count(queryset)
+        if estimate is not None:
+            self.estimated = estimate >= threshold
+            return estimate if self.estimated else super().get_count(queryset)
+        sql, params = queryset.order_by().query.sql_with_params()
+        key = f'count:{sha256(repr((sql, params)).encode()).hexdigest()}'
+        count = caches[self.count_cache].get(key)
+        if count is not None:
+            self.estimated = True
+            return count
+        count = super().get_count(queryset)
+        if count >= threshold:
+            caches[self.count_cache].set(key, count, self.count_cache_timeout)
+        return count
+
+    def get_next_link(self):
+        if not self.estimated:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('count_estimated', self.estimated),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,61 @@
+import re
+import sys
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from threading import Lock, Thread
+from time import sleep
+
+
+class StackSampler:
+    # Background thread sampling the stacks of the threads serving tracked requests
+    def __init__(self, interval):
+        self.interval = interval
+        self._stacks = {}
+        self._lock = Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+
+def collapse_stack(frame):
+    # Stack in the flamegraph collapsed format, outermost frame first
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'.replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def profile_path(directory, route, duration, queries, suffix):
+    # File name tagged with the route, duration and query count of the request
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f'{datetime.now():%Y%m%d-%H%M%S-%f}-{slug}-{duration * 1000:.0f}ms-{queries}q.{suffix}'
+
+
+def write_collapsed(path, stacks):
+    with open(path, 'w') as file:
+        for stack, count in stacks.most_common():
+            file.write(f'{stack} {count}\n')
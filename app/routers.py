@@ -0,0 +1,82 @@
+from contextvars import ContextVar
+from hashlib import sha256
+from itertools import count
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Database alias the reads of the current request go to, None keeps them on the primary
+read_alias = ContextVar('read_alias', default=None)
+
+LAG_QUERIES = {
+    'postgresql': 'SELECT CASE WHEN pg_is_in_recovery() '
+                  'THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END',
+}
+
+
+class ReplicaRouter:
+    # Sends reads to the replica chosen by ReplicaRoutingMiddleware for the request, everything else to the primary
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+def replica_lag(alias):
+    # Replication delay of a replica in seconds, None when it does not answer
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_QUERIES.get(connection.vendor, 'SELECT 0'))
+            return float(cursor.fetchone()[0])
+    except Exception:
+        connection.close()
+        return None
+
+
+class ReplicaSelector:
+    # Picks one of the replicas within REPLICA_MAX_LAG in turn (REPLICA_SELECTION = 'round_robin') or the one
+    # with the smallest lag ('least_lag'), lags are measured at most every REPLICA_LAG_CHECK_INTERVAL seconds
+    def __init__(self):
+        self._turn = count()
+        self._lags = {}
+        self._checked = None
+        self._lock = Lock()
+
+    def choose(self):
+        lags = self.lags()
+        healthy = [alias for alias in settings.DATABASE_REPLICAS
+                   if lags.get(alias) is not None and lags[alias] <= getattr(settings, 'REPLICA_MAX_LAG', 10)]
+        if not healthy:
+            return None
+        if getattr(settings, 'REPLICA_SELECTION', 'round_robin') != 'least_lag':
+            return healthy[next(self._turn) % len(healthy)]
+        return min(healthy, key=lags.get)
+
+    def lags(self):
+        with self._lock:
+            if self._checked is None or monotonic() - self._checked > getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL',
+                                                                              1):
+                self._lags = {alias: replica_lag(alias) for alias in settings.DATABASE_REPLICAS}
+                self._checked = monotonic()
+            return self._lags
+
+
+def client_key(request):
+    # Token, session or address of the client, hashed for the sticky primary cache
+    identity = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME) \
+        or request.META.get('REMOTE_ADDR', '')
+    return f'db-sticky:{sha256(identity.encode()).hexdigest()}'
+
+
+def sticky_cache():
+    return caches[getattr(settings, 'REPLICA_STICKY_CACHE', 'default')]
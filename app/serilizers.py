@@ -3,12 +3,83 @@ from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
 
 from app.models import Account, Shop, Category, Product, ProductInfo, \
-    ProductParameter, Order, OrderItem, Contact
+    ProductParameter, Order, OrderItem, Contact, ShopOrder, DeliveryRate, DeliveryRateTier, \
+    CatalogChange, ArchivedOrderItem
+from django.db import transaction
 from rest_framework.serializers import ModelSerializer
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError as PasswordValidationErrror
 
 
+def query_paths(request, name):
+    # Comma separated dotted paths of a query parameter, None when it is missing
+    value = getattr(request, 'query_params', request.GET).get(name)
+    if value is None:
+        return None
+    return {path.strip() for path in value.split(',') if path.strip()}
+
+
+class DynamicFieldsMixin:
+    # Serializer pruned by the ?fields= and ?expand= parameters of GET requests, dotted paths from the top-level
+    # serializer. "fields" keeps the listed fields with everything below them and the fields on the way to them.
+    # With "expand", the nested serializers not listed (or on the way to a listed one) render primary keys.
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return fields
+        # An empty ?fields= keeps every field, an empty ?expand= renders all nested serializers as primary keys
+        only, expand = query_paths(request, 'fields') or None, query_paths(request, 'expand')
+        prefix = self.path_prefix()
+        for name, field in list(fields.items()):
+            path = prefix + name
+            if only is not None and not (path in only or any(selected.startswith(f'{path}.') for selected in only)
+                                         or any(path.startswith(f'{selected}.') for selected in only)):
+                del fields[name]
+            elif expand is not None and isinstance(getattr(field, 'child', field), serializers.BaseSerializer) \
+                    and not (path in expand or any(expanded.startswith(f'{path}.') for expanded in expand)):
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=isinstance(field, serializers.ListSerializer),
+                    **({'source': field.source} if field.source else {}))
+        return fields
+
+    def path_prefix(self):
+        names, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return ''.join(f'{name}.' for name in reversed(names))
+
+
+def rendered_paths(serializer, prefix=''):
+    # Dotted paths of the fields a serializer renders, a nested serializer rendered in full adds "<path>.*"
+    serializer = getattr(serializer, 'child', serializer)
+    paths = set()
+    for name, field in serializer.fields.items():
+        paths.add(prefix + name)
+        nested = getattr(field, 'child', field)
+        if isinstance(nested, serializers.BaseSerializer):
+            paths |= {f'{prefix}{name}.*'} | rendered_paths(nested, f'{prefix}{name}.')
+    return paths
+
+
+def select_rendered(queryset, serializer, related):
+    # Adds the select_related and prefetch_related lookups of the related paths the serializer renders,
+    # related maps a path to its (select_related lookups, prefetch_related lookups)
+    paths = rendered_paths(serializer)
+    select, prefetch = [], {}
+    for path, (select_lookups, prefetch_lookups) in related.items():
+        if path in paths:
+            select += select_lookups
+            for lookup in prefetch_lookups:
+                prefetch[getattr(lookup, 'prefetch_to', lookup)] = lookup
+    if select:
+        queryset = queryset.select_related(*select)
+    return queryset.prefetch_related(*prefetch.values())
+
+
 class RegistrationSerializer(ModelSerializer):
     class Meta:
         model = Account
@@ -55,7 +126,7 @@ class CustomAuthTokenSerializer(serializers.Serializer):
         return data
 
 
-class ContactSerializer(serializers.ModelSerializer):
+class ContactSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Contact
         fields = ['id', 'type', 'value', 'user']
@@ -93,21 +164,21 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'type_account']
 
 
-class ShopSerializer(ModelSerializer):
+class ShopSerializer(DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = Shop
         fields = ['id', 'name', 'status']
         read_only_fields = ['id']
         extra_kwargs = {"user": {"write_only": True}}
 
-class CategorySerializer(ModelSerializer):
+class CategorySerializer(DynamicFieldsMixin, ModelSerializer):
     shops = ShopSerializer(many=True)
     class Meta:
         model = Category
         fields = ['id', 'shops', 'name']
         read_only_fields = ['id']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     category = serializers.StringRelatedField()
 
     class Meta:
@@ -115,7 +186,7 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['name', 'category']
 
 
-class ProductParameterSerializer(serializers.ModelSerializer):
+class ProductParameterSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     parameter = serializers.StringRelatedField()
 
     class Meta:
@@ -123,7 +194,7 @@ class ProductParameterSerializer(serializers.ModelSerializer):
         fields = ['parameter', 'value']
 
 
-class ProductInfoSerializer(serializers.ModelSerializer):
+class ProductInfoSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_parameters = ProductParameterSerializer(read_only=True, many=True)
 
@@ -143,11 +214,31 @@ class OrderItemSerializer(serializers.ModelSerializer):
         }
 
 
-class OrderItemCreateSerializer(OrderItemSerializer):
+class FrozenProductSerializer(serializers.Serializer):
+    name = serializers.CharField(source='product_name')
+
+
+class FrozenProductInfoSerializer(serializers.Serializer):
+    # Offer of an archived line whose offer is deleted, from the id, name and price kept on the line
+    id = serializers.IntegerField(source='product_info_id')
+    price = serializers.DecimalField(max_digits=20, decimal_places=2)
+    product = FrozenProductSerializer(source='*')
+
+
+class OrderItemCreateSerializer(DynamicFieldsMixin, OrderItemSerializer):
     product_info = ProductInfoSerializer(read_only=True)
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if isinstance(instance, ArchivedOrderItem) and 'product_info' in data and data['product_info'] is None:
+            # Only the fields the offer serializer renders after ?fields= pruning
+            rendered = self.fields['product_info'].fields
+            data['product_info'] = {name: value for name, value in
+                                    FrozenProductInfoSerializer(instance).data.items() if name in rendered}
+        return data
+
 
-class UserContactOrderSerializer(serializers.ModelSerializer):
+class UserContactOrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     contacts = ContactSerializer(read_only=True, many=True)
 
     class Meta:
@@ -156,25 +247,24 @@ class UserContactOrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class OrderPartnerSerializer(serializers.ModelSerializer):
+class OrderPartnerSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
-    total_sum = serializers.IntegerField()
-    user = UserContactOrderSerializer(read_only=True)
+    user = UserContactOrderSerializer(source='order.user', read_only=True)
 
     class Meta:
-        model = Order
-        fields = ['id', 'ordered_items', 'status', 'dt', 'total_sum', 'user', ]
-        read_only_fields = ['id']
+        model = ShopOrder
+        fields = ['id', 'order', 'shop', 'ordered_items', 'status', 'dt', 'total_sum', 'delivery_cost', 'user', ]
+        read_only_fields = ['id', 'delivery_cost']
 
 
-class OrderUserSerializer(serializers.ModelSerializer):
+class OrderUserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
     total_sum = serializers.IntegerField()
 
     class Meta:
         model = Order
-        fields = ['id', 'ordered_items', 'status', 'dt', 'total_sum']
-        read_only_fields = ['id']
+        fields = ['id', 'ordered_items', 'status', 'dt', 'total_sum', 'delivery_cost']
+        read_only_fields = ['id', 'delivery_cost']
 
 
 class UpdateBusketSerializer(serializers.Serializer):
@@ -185,3 +275,65 @@ class UpdateBusketSerializer(serializers.Serializer):
 class UpdateContactSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     value = serializers.CharField()
+
+
+class DeliveryRateTierSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeliveryRateTier
+        fields = ['min_quantity', 'fee']
+
+
+class DeliveryRateSerializer(serializers.ModelSerializer):
+    tiers = DeliveryRateTierSerializer(many=True, required=False)
+
+    class Meta:
+        model = DeliveryRate
+        fields = ['shop', 'base_fee', 'free_threshold', 'version', 'tiers']
+        read_only_fields = ['shop', 'version']
+
+    def validate_tiers(self, tiers):
+        min_quantities = [tier['min_quantity'] for tier in tiers]
+        if len(set(min_quantities)) != len(min_quantities):
+            raise serializers.ValidationError('Tier quantities must be unique.')
+        return sorted(tiers, key=lambda tier: tier['min_quantity'])
+
+    def create(self, validated_data):
+        tiers = validated_data.pop('tiers', [])
+        with transaction.atomic():
+            rate = DeliveryRate.objects.create(**validated_data)
+            DeliveryRateTier.objects.bulk_create([DeliveryRateTier(rate=rate, **tier) for tier in tiers])
+        return rate
+
+    def update(self, instance, validated_data):
+        tiers = validated_data.pop('tiers', None)
+        with transaction.atomic():
+            for field, value in validated_data.items():
+                setattr(instance, field, value)
+            instance.version += 1
+            instance.save()
+            if tiers is not None:
+                instance.tiers.all().delete()
+                DeliveryRateTier.objects.bulk_create([DeliveryRateTier(rate=instance, **tier) for tier in tiers])
+        return instance
+
+
+class CatalogChangeSerializer(serializers.ModelSerializer):
+    # Upserts carry the current offer from the offers context (id -> serialized offer), None once it is deleted
+    offer = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CatalogChange
+        fields = ['id', 'kind', 'shop_id', 'product_info_id', 'status', 'dt', 'offer']
+
+    def get_offer(self, change):
+        if change.kind != 'upsert':
+            return None
+        return self.context['offers'].get(change.product_info_id)
+
+
+class PriceHistoryDaySerializer(serializers.Serializer):
+    shop = serializers.IntegerField(source='shop_id')
+    day = serializers.DateField()
+    min = serializers.DecimalField(max_digits=20, decimal_places=2, source='min_price')
+    max = serializers.DecimalField(max_digits=20, decimal_places=2, source='max_price')
+    last = serializers.DecimalField(max_digits=20, decimal_places=2, source='last_price')
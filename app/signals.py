@@ -1,20 +1,28 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver, Signal
 from django.urls import reverse
 from django_rest_passwordreset.signals import reset_password_token_created
-from django.core.mail import send_mail
+from rest_framework.authtoken.models import Token
 from DeliveryService import settings
-from app.models import Account
+from app import delivery
+from app.authentication import invalidate_token, invalidate_user
+from app.models import Account, Order, DeliveryRate, DeliveryRateTier
+from app.outbox import enqueue_mail, enqueue_mass_mail
 from django.contrib.auth.tokens import default_token_generator
 
 new_order = Signal()
 confirm_email = Signal()
+order_status_changed = Signal()
 
 @receiver(reset_password_token_created)
 def password_reset_token_created(sender, instance, reset_password_token, *args, **kwargs):
 
     email_plaintext_message = f'{reverse("reset-password-request")}?token={reset_password_token.key}'
 
-    send_mail(
+    enqueue_mail(
         # title:
         'Website title. Password Reset.',
         # message:
@@ -26,11 +34,9 @@ def password_reset_token_created(sender, instance, reset_password_token, *args,
     )
 
 @receiver(new_order)
-def new_order_signal(user_id, **kwargs):
+def new_order_signal(user, **kwargs):
     # send an e-mail to the user
-    user = Account.objects.get(id=user_id)
-
-    send_mail(
+    enqueue_mail(
         # title:
         f'Обновление статуса заказа',
         # message:
@@ -43,11 +49,10 @@ def new_order_signal(user_id, **kwargs):
 
 
 @receiver(confirm_email)
-def confirm_email_signal(user_id, **kwargs):
-    user = Account.objects.get(id=user_id)
+def confirm_email_signal(user, **kwargs):
     confirmation_token = default_token_generator.make_token(user)
 
-    send_mail(
+    enqueue_mail(
         # title:
         f'Подтверждение регистрации',
         # message:
@@ -56,4 +61,49 @@ def confirm_email_signal(user_id, **kwargs):
         settings.EMAIL_HOST_USER,
         # to:
         [user.email]
-    )
\ No newline at end of file
+    )
+
+
+@receiver(order_status_changed)
+def order_status_changed_signal(changes, status, **kwargs):
+    # queue one e-mail per buyer for the whole batch of changed orders
+    orders_by_email = {}
+    for email, order_id in changes:
+        orders_by_email.setdefault(email, []).append(order_id)
+    status_name = dict(Order.CHOICES_STATUS)[status]
+    messages = [
+        (
+            # title:
+            'Обновление статуса заказа',
+            # message:
+            '\n'.join(f'Заказ {order_id}: {status_name}' for order_id in order_ids),
+            # from:
+            settings.EMAIL_HOST_USER,
+            # to:
+            [email]
+        )
+        for email, order_ids in orders_by_email.items()
+    ]
+    enqueue_mass_mail(messages)
+
+
+@receiver([post_save, post_delete], sender=DeliveryRate)
+def delivery_rate_changed(instance, **kwargs):
+    transaction.on_commit(partial(delivery.invalidate, instance.shop_id))
+
+
+@receiver([post_save, post_delete], sender=DeliveryRateTier)
+def delivery_rate_tier_changed(instance, **kwargs):
+    transaction.on_commit(partial(delivery.invalidate_rate, instance.rate_id))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    transaction.on_commit(partial(invalidate_token, instance.key))
+
+
+@receiver(post_save, sender=Account)
+def account_changed(instance, created, **kwargs):
+    # password changes and deactivation must not be served from the token cache
+    if not created:
+        transaction.on_commit(partial(invalidate_user, instance.id))
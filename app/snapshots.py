@@ -0,0 +1,167 @@
+import gzip
+import json
+import os
+import re
+import shutil
+from contextlib import ExitStack
+from pathlib import Path
+from threading import get_ident
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from django.db.models import Max
+
+from app.models import Shop, ProductInfo, CatalogChange
+from app.serilizers import ProductInfoSerializer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Format -> file extension. Every file is a gzip stream of records in the ProductInfoSerializer
+# representation, the catalog file concatenates the gzip members of the active shops.
+FORMATS = {
+    'ndjson': 'ndjson.gz',
+    'msgpack': 'msgpack.gz',
+}
+CHUNK_SIZE = 2000
+
+
+def formats():
+    configured = getattr(settings, 'CATALOG_SNAPSHOT_FORMATS', ['ndjson'])
+    if 'msgpack' in configured and msgpack is None:
+        raise ImproperlyConfigured('The msgpack snapshot format requires the msgpack package.')
+    return configured
+
+
+def directory():
+    return Path(settings.CATALOG_SNAPSHOT_DIR)
+
+
+def snapshot_path(output, shop_id=None):
+    name = f'shop-{shop_id}' if shop_id is not None else 'catalog'
+    return directory() / f'{name}.{FORMATS[output]}'
+
+
+def offers(shop_id):
+    # Serialized offers of a shop, read in primary key chunks so the prefetches stay bounded
+    queryset = ProductInfo.objects.filter(shop_id=shop_id).select_related('product__category').prefetch_related(
+        'product_parameters__parameter').order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:CHUNK_SIZE])
+        if not chunk:
+            return
+        yield from ProductInfoSerializer(chunk, many=True).data
+        last_id = chunk[-1].id
+
+
+def encode(output, record):
+    if output == 'msgpack':
+        return msgpack.packb(record)
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+def _temporary(path):
+    # Files are written next to the target and renamed, readers never see a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.with_name(f'.{path.name}.{os.getpid()}.{get_ident()}')
+
+
+def write_shop(shop_id):
+    # One pass over the offers of the shop, encoding every record into each configured format
+    targets = {output: snapshot_path(output, shop_id) for output in formats()}
+    temporary = {output: _temporary(path) for output, path in targets.items()}
+    try:
+        with ExitStack() as stack:
+            # No name and time in the gzip headers, unchanged offers give identical bytes
+            files = {output: stack.enter_context(gzip.GzipFile('', 'wb', fileobj=stack.enter_context(
+                open(path, 'wb')), mtime=0)) for output, path in temporary.items()}
+            for record in offers(shop_id):
+                for output, file in files.items():
+                    file.write(encode(output, record))
+        for output, path in temporary.items():
+            os.replace(path, targets[output])
+    finally:
+        for path in temporary.values():
+            if path.exists():
+                path.unlink()
+
+
+def active_shops():
+    return list(Shop.objects.filter(status=True).order_by('id').values_list('id', flat=True))
+
+
+def write_catalog():
+    # The catalog file is the byte concatenation of the shop files, a valid multi-member gzip stream.
+    # Files of deleted or switched off shops are removed, missing files of active shops are written.
+    shop_ids = active_shops()
+    for path in directory().glob('shop-*'):
+        match = re.match(r'shop-(\d+)\.', path.name)
+        if match and int(match.group(1)) not in shop_ids:
+            path.unlink(missing_ok=True)
+    for shop_id in shop_ids:
+        if not all(snapshot_path(output, shop_id).exists() for output in formats()):
+            write_shop(shop_id)
+    for output in formats():
+        path = _temporary(snapshot_path(output))
+        try:
+            with open(path, 'wb') as file:
+                for shop_id in shop_ids:
+                    with open(snapshot_path(output, shop_id), 'rb') as shop_file:
+                        shutil.copyfileobj(shop_file, file)
+            os.replace(path, snapshot_path(output))
+        finally:
+            if path.exists():
+                path.unlink()
+
+
+def position_path():
+    # Last catalog change id the snapshots include
+    return directory() / 'position'
+
+
+def read_position():
+    try:
+        return int(position_path().read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_position(change_id):
+    path = _temporary(position_path())
+    path.write_text(str(change_id))
+    os.replace(path, position_path())
+
+
+def last_change_id():
+    return CatalogChange.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+
+def rebuild_all():
+    # Read before the offers, changes committed during the rebuild are picked up by the next one
+    change_id = last_change_id()
+    for shop_id in active_shops():
+        write_shop(shop_id)
+    write_catalog()
+    write_position(change_id)
+
+
+def rebuild_changed():
+    # Serializes again only the shops with catalog changes since the last rebuild and concatenates the catalog.
+    # Returns the ids of the changed shops, None when there was no position yet and everything was rebuilt.
+    position = read_position()
+    if position is None:
+        rebuild_all()
+        return None
+    change_id = last_change_id()
+    shop_ids = set(CatalogChange.objects.filter(id__gt=position, id__lte=change_id).order_by().values_list(
+        'shop_id', flat=True).distinct())
+    if shop_ids:
+        for shop_id in sorted(shop_ids & set(active_shops())):
+            write_shop(shop_id)
+        write_catalog()
+    write_position(change_id)
+    return sorted(shop_ids)
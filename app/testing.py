@@ -0,0 +1,138 @@
+import json
+import os
+import re
+from contextlib import contextmanager
+from difflib import unified_diff
+from pathlib import Path
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    # TestCase mixin failing when a block runs more SQL queries than its budget
+
+    @contextmanager
+    def assertQueryBudget(self, budget, label='Block', using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(f'{number}. {query["sql"]}'
+                                for number, query in enumerate(context.captured_queries, start=1))
+            self.fail(f'{label} executed {executed} queries, the budget is {budget}:\n{queries}')
+
+
+def explain(connection, sql, params):
+    # Plan of a query as (indented lines, fully scanned tables, fully sorted tables, spilled nodes), without costs
+    # or timings. A full scan of an index counts as a scan unless a LIMIT stops it before anything consumes all its
+    # rows. A sort or grouping counts for the tables whose whole range it reads: not the rows looked up by primary
+    # key or by a list of keys, as the prefetches of a page do.
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # With sequential scans disabled the planner falls back to them, or to a full index scan,
+            # only when no index fits the query
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}', params)
+            root = cursor.fetchone()[0]
+            root = (json.loads(root) if isinstance(root, str) else root)[0]['Plan']
+            cursor.execute('RESET enable_seqscan')
+            lines, scans, sorts, spills = [], [], [], []
+
+            def walk(node, depth, limited, sorting):
+                name = ' '.join(filter(None, [node['Node Type'], node.get('Relation Name'), node.get('Index Name')]))
+                lines.append('  ' * depth + name)
+                if node['Node Type'] == 'Seq Scan' or (
+                        node['Node Type'] in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in node
+                        and not limited):
+                    scans.append(node['Relation Name'])
+                if sorting and 'Relation Name' in node and '= ANY' not in node.get('Index Cond', ''):
+                    sorts.append(node['Relation Name'])
+                if node.get('Sort Space Type') == 'Disk' or node.get('Hash Batches', 1) > 1:
+                    spills.append(name)
+                if node['Node Type'] == 'Limit':
+                    limited = True
+                elif node['Node Type'] in ('Sort', 'Aggregate', 'Hash', 'Materialize', 'Unique'):
+                    limited = False
+                if node['Node Type'] == 'Sort' or (node['Node Type'] == 'Aggregate'
+                                                   and node.get('Strategy') in ('Hashed', 'Mixed')):
+                    sorting = True
+                for number, child in enumerate(node.get('Plans', [])):
+                    # The inner side of a nested loop is looked up once per outer row
+                    walk(child, depth + 1, limited,
+                         sorting and not (node['Node Type'] == 'Nested Loop' and number == 1))
+
+            walk(root, 0, False, False)
+            return lines, scans, sorts, spills
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            rows = cursor.fetchall()
+            limited = ' LIMIT ' in sql and not any(detail.startswith('USE TEMP B-TREE') for *_, detail in rows)
+            # Tables filtered by a list of keys, e.g. WHERE "app_orderitem"."order_id" IN (...)
+            keyed = set(re.findall(r'"(\w+)"\."(?:id|\w+_id)" IN \(', sql))
+            depths, lines, scans, ranges = {0: -1}, [], [], []
+            sorted_ = False
+            for node_id, parent, _, detail in rows:
+                depths[node_id] = depths.get(parent, -1) + 1
+                lines.append('  ' * depths[node_id] + detail)
+                match = re.match(r'SCAN (?:TABLE )?(\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX)?', detail)
+                if match and not (match.group(2) and limited):
+                    scans.append(match.group(1))
+                match = re.match(r'(?:SCAN|SEARCH) (?:TABLE )?(\w+)', detail)
+                if match and 'PRIMARY KEY' not in detail and match.group(1) not in keyed:
+                    ranges.append(match.group(1))
+                # A sort of the right part of the ORDER BY only orders the rows sharing the index prefix
+                if detail.startswith('USE TEMP B-TREE FOR ') and 'RIGHT PART' not in detail \
+                        and 'LAST TERM' not in detail:
+                    sorted_ = True
+            # SQLite plans do not tell whether a sort spills, the sorts of whole ranges are the check there
+            return lines, scans, ranges if sorted_ else [], []
+    raise NotImplementedError(f'Query plans of {connection.vendor} are not supported.')
+
+
+class QueryPlanMixin:
+    # TestCase mixin checking the plans of the SELECT queries of a block: no sequential scans and no sorts of
+    # whole ranges on large_tables, no sorts or hashes spilled to disk, and the same plans as the snapshot in
+    # plan_snapshots/<vendor>/.
+    # Missing snapshots are written, UPDATE_PLAN_SNAPSHOTS=1 rewrites the changed ones.
+    large_tables = ()
+    snapshot_directory = Path(__file__).resolve().parent / 'plan_snapshots'
+
+    @contextmanager
+    def assertQueryPlans(self, label, allow_scans=(), allow_sorts=(), using=DEFAULT_DB_ALIAS):
+        connection = connections[using]
+        queries = []
+
+        def capture(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('SELECT'):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            yield queries
+        snapshot = []
+        for number, (sql, params) in enumerate(queries, start=1):
+            lines, scans, sorts, spills = explain(connection, sql, params)
+            snapshot += [f'-- {number}. {sql}'] + lines
+            scans = sorted(set(scans) & set(self.large_tables) - set(allow_scans))
+            if scans:
+                self.fail(f'{label}: query {number} scans {", ".join(scans)}:\n{sql}\n' + '\n'.join(lines))
+            sorts = sorted(set(sorts) & set(self.large_tables) - set(allow_sorts))
+            if sorts:
+                self.fail(f'{label}: query {number} sorts all rows of {", ".join(sorts)}:\n{sql}\n' + '\n'.join(lines))
+            if spills:
+                self.fail(f'{label}: query {number} spills {", ".join(spills)} to disk:\n{sql}\n' + '\n'.join(lines))
+        self.assertPlanSnapshot(label, snapshot, connection.vendor)
+
+    def assertPlanSnapshot(self, label, snapshot, vendor):
+        path = self.snapshot_directory / vendor / f'{re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")}.txt'
+        content = '\n'.join(snapshot) + '\n'
+        if not path.exists() or os.environ.get('UPDATE_PLAN_SNAPSHOTS') == '1':
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+            return
+        expected = path.read_text()
+        if content != expected:
+            diff = ''.join(unified_diff(expected.splitlines(True), content.splitlines(True), str(path), label))
+            self.fail(f'{label}: query plans differ from the snapshot, run with UPDATE_PLAN_SNAPSHOTS=1 '
+                      f'if the change is intended:\n{diff}')
@@ -1,3 +1,1368 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import pstats
+import re
+from base64 import b64encode
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import perf_counter, sleep, time
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import httpx
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, resolve, reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from app import datagen, delivery, outbox, snapshots
+from app.archive import archive_orders
+from app.authentication import TokenCache, get_snapshot, local_cache
+from app.digests import queue_supplier_digests
+from app.importer import import_price_list
+from app.middleware import MetricsMiddleware, ProfilingMiddleware
+from app.models import Account, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, \
+    OrderItem, Contact, DeliveryRate, DeliveryRateTier, ShopOrder, CatalogChange, \
+    PriceHistory, ArchivedOrder, ArchivedShopOrder, ArchivedOrderItem, OutgoingEmail
+from app.routers import ReplicaRouter, ReplicaSelector, read_alias, sticky_cache
+from app.testing import QueryBudgetMixin, QueryPlanMixin
+
+PRICE_LIST = b"""
+shop: Shop
+categories:
+  - id: 1
+    name: Phones
+goods:
+  - name: Phone
+    category: 1
+    price: 100
+    price_rrc: 120
+    quantity: 5
+    parameters:
+      color: black
+      memory: 64
+  - name: Case
+    category: 1
+    price: 10
+    price_rrc: 12
+    quantity: 50
+    parameters:
+      color: red
+"""
+
+
+def url_callbacks(patterns, prefix=''):
+    # All views reachable from the url patterns, except the admin site
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if route.startswith('admin/'):
+            continue
+        if isinstance(pattern, URLResolver):
+            yield from url_callbacks(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern):
+            yield route, pattern.callback
+
+
+class DataMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = Account.objects.create(email='seller@example.com', type_account='seller', is_active=True)
+        cls.buyer = Account.objects.create(email='buyer@example.com', type_account='buyer', is_active=True)
+        cls.buyer.set_password('Old-password-123')
+        cls.buyer.save()
+        cls.shop = Shop.objects.create(name='Shop', url='http://example.com/shop.yaml', user=cls.seller)
+        rate = DeliveryRate.objects.create(shop=cls.shop, base_fee=5, free_threshold=1000)
+        DeliveryRateTier.objects.create(rate=rate, min_quantity=10, fee=3)
+        category = Category.objects.create(name='Phones')
+        category.shops.add(cls.shop)
+        color = Parameter.objects.create(name='color')
+        cls.product_infos = []
+        for number in range(3):
+            product = Product.objects.create(name=f'Phone {number}', category=category)
+            product_info = ProductInfo.objects.create(product=product, shop=cls.shop, price=100 + number,
+                                                      price_rrc=120, quantity=10)
+            ProductParameter.objects.create(product_info=product_info, parameter=color, value='black')
+            cls.product_infos.append(product_info)
+        cls.contact = Contact.objects.create(user=cls.buyer, type='phone', value='+70000000000')
+        for status in ('new', 'basket'):
+            order = Order.objects.create(user=cls.buyer, status=status)
+            for product_info in cls.product_infos:
+                OrderItem.objects.create(order=order, product_info=product_info, quantity=2)
+            if status == 'new':
+                order.split_by_shop()
+                cls.order = order
+            else:
+                cls.basket = order
+
+    def setUp(self):
+        local_cache.clear()
+        delivery.invalidate()
+        caches['throttle'].clear()
+
+    def client_for(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+        return client
+
+
+class QueryBudgetTests(DataMixin, QueryBudgetMixin, TestCase):
+    # Upper bounds for the SQL queries of every route in DeliveryService/urls.py
+
+    def budgets(self):
+        basket_items = list(self.basket.ordered_items.values_list('id', flat=True))
+        shop_order = self.order.shop_orders.get()
+        return [
+            # (user, method, path, data, query budget)
+            (None, 'get', '/api/v1/', None, 0),
+            (None, 'get', '/api/v1/shops/', None, 2),
+            (None, 'get', '/api/v1/category/', None, 3),
+            (None, 'get', '/api/v1/products/', None, 4),
+            (None, 'post', '/api/v1/account/register',
+             {'email': 'new@example.com', 'password': 'Strong-password-123', 'first_name': 'Ivan',
+              'last_name': 'Ivanov', 'surname': 'Ivanovich', 'position': 'Manager'}, 8),
+            (None, 'patch', '/api/v1/account/confirm', {'email': 'buyer@example.com', 'token': 'wrong'}, 1),
+            (None, 'post', '/api/v1/account/login',
+             {'email': 'buyer@example.com', 'password': 'Old-password-123'}, 5),
+            (self.buyer, 'get', '/api/v1/account/bayer', None, 2),
+            (self.buyer, 'patch', '/api/v1/account/bayer',
+             {'old_password': 'Old-password-123', 'password': 'New-password-456'}, 5),
+            (self.buyer, 'get', '/api/v1/basket', None, 10),
+            (self.buyer, 'post', '/api/v1/basket',
+             {'items': [{'product_info': self.product_infos[0].id, 'quantity': 1}]}, 5),
+            (self.buyer, 'patch', '/api/v1/basket', {'items': [{'id': basket_items[0], 'quantity': 3}]}, 4),
+            (self.buyer, 'delete', '/api/v1/basket', {'items': basket_items[:1]}, 4),
+            (self.buyer, 'get', '/api/v1/basket/update', None, 9),
+            (self.buyer, 'patch', '/api/v1/basket/update', {'id': self.basket.id}, 11),
+            (self.seller, 'get', '/api/v1/partner/orders', None, 12),
+            (self.seller, 'patch', '/api/v1/partner/orders', {'ids': [shop_order.id], 'status': 'confirmed'}, 7),
+            (self.seller, 'get', '/api/v1/partner/orders/export', None, 3),
+            (None, 'post', '/api/v1/account/password-reset', {'email': 'buyer@example.com'}, 5),
+            (None, 'post', '/api/v1/account/password_reset/confirm',
+             {'token': 'wrong', 'password': 'New-password-456'}, 1),
+            (self.seller, 'get', '/api/v1/partner/shop', None, 2),
+            (self.seller, 'patch', '/api/v1/partner/shop', {'status': True}, 4),
+            (self.seller, 'get', '/api/v1/partner/delivery', None, 3),
+            (self.seller, 'post', '/api/v1/partner/delivery', {'base_fee': '7.00', 'tiers': []}, 8),
+            (self.buyer, 'get', '/api/v1/partner/contacts', None, 2),
+            (self.buyer, 'post', '/api/v1/partner/contacts', {'type': 'address', 'value': 'Moscow'}, 5),
+            (self.buyer, 'patch', '/api/v1/partner/contacts', {'id': self.contact.id, 'value': '+71111111111'}, 3),
+            (self.buyer, 'delete', '/api/v1/partner/contacts', {'id': self.contact.id}, 3),
+            (self.seller, 'post', '/api/v1/partner/update', {'url': 'http://example.com/shop.yaml'}, 34),
+            (self.seller, 'post', '/api/v1/async/partner/update', {'url': 'wrong'}, 1),
+            (None, 'get', '/api/v1/products/changes', None, 3),
+            (None, 'get', f'/api/v1/products/{self.product_infos[0].product_id}/prices', None, 2),
+            (None, 'get', '/api/v1/products/snapshot', None, 0),
+            (None, 'get', f'/api/v1/products/snapshot/{self.shop.id}', None, 0),
+            (self.buyer, 'post', '/api/v1/batch', {'requests': [
+                {'method': 'GET', 'path': '/api/v1/partner/contacts'},
+                {'method': 'GET', 'path': '/api/v1/basket'}]}, 12),
+            (None, 'get', '/metrics', None, 2),
+        ]
+
+    def test_every_route_has_a_budget(self):
+        budgeted = {resolve(path).func for _, _, path, _, _ in self.budgets()}
+        for route, callback in url_callbacks(get_resolver().url_patterns):
+            with self.subTest(route=route):
+                self.assertIn(callback, budgeted, f'Route {route} has no query budget.')
+
+    @mock.patch('app.views.get')
+    def test_query_budgets(self, get):
+        get.return_value.content = PRICE_LIST
+        for user, method, path, data, budget in self.budgets():
+            with self.subTest(method=method, path=path), transaction.atomic():
+                client = self.client_for(user)
+                try:
+                    with self.assertQueryBudget(budget, f'{method.upper()} {path}'):
+                        response = getattr(client, method)(path, data, format='json')
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                    self.assertLess(response.status_code, 500)
+                finally:
+                    transaction.set_rollback(True)
+        get.assert_called_once_with('http://example.com/shop.yaml', timeout=settings.PRICE_LIST_TIMEOUT)
+
+    @override_settings(QUERY_COUNT_ENABLED=True)
+    def test_query_count_headers(self):
+        response = self.client_for(self.buyer).get('/api/v1/basket')
+        self.assertEqual(response['X-Query-Count'], '10')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=\d+\.\d;desc="10 queries"$')
+
+
+class MetricsTests(DataMixin, TestCase):
+    def test_metrics_endpoint(self):
+        self.client_for(self.buyer).get('/api/v1/basket')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('http_requests_total{method="GET",route="api/v1/basket",status="200"}', content)
+        self.assertIn('cache_requests_total{cache="token_auth",result="miss"}', content)
+        self.assertIn('email_outbox_backlog 0.0', content)
+
+    def test_metrics_endpoint_is_restricted(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_instrumentation_overhead(self):
+        request = RequestFactory().get('/api/v1/shops/')
+        request.resolver_match = resolve('/api/v1/shops/')
+        response = HttpResponse()
+        plain, instrumented = (lambda request: response), MetricsMiddleware(lambda request: response)
+        timings = []
+        for handler in (plain, instrumented):
+            start = perf_counter()
+            for _ in range(1000):
+                handler(request)
+            timings.append((perf_counter() - start) / 1000)
+        self.assertLess(timings[1] - timings[0], settings.METRICS_OVERHEAD_BUDGET)
+
+
+class ProfilingTests(DataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        # Test clients load the middleware on their first request, after the override
+        config = {'ENABLED': True, 'HEADER': 'X-Profile', 'SAMPLE_RATE': 0, 'SLOW_THRESHOLD': None,
+                  'INTERVAL': 0.001, 'DIRECTORY': self.directory}
+        override = override_settings(PROFILING=config)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_staff_header_writes_profile(self):
+        Account.objects.filter(id=self.seller.id).update(is_staff=True)
+        response = self.client_for(self.seller).get('/api/v1/shops/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        dump = self.directory / response['X-Profile']
+        self.assertEqual(list(self.directory.iterdir()), [dump])
+        self.assertRegex(dump.name, r'-api_v1_shops-\d+ms-\d+q\.prof$')
+        self.assertTrue(pstats.Stats(str(dump)).total_calls)
+
+    def test_header_needs_staff(self):
+        for client in (self.client_for(self.buyer), self.client_for()):
+            response = client.get('/api/v1/shops/', HTTP_X_PROFILE='1')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_slow_requests_write_stacks(self):
+        request = RequestFactory().get('/api/v1/shops/')
+        request.resolver_match = resolve('/api/v1/shops/')
+
+        def slow_view(request):
+            sleep(0.05)
+            return HttpResponse()
+
+        with override_settings(PROFILING={**settings.PROFILING, 'SLOW_THRESHOLD': 0.04}):
+            ProfilingMiddleware(lambda request: HttpResponse())(request)
+            self.assertEqual(list(self.directory.iterdir()), [])
+            ProfilingMiddleware(slow_view)(request)
+        [stacks] = self.directory.iterdir()
+        self.assertRegex(stacks.name, r'-api_v1_shops-\d+ms-0q\.collapsed$')
+        lines = stacks.read_text().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(re.fullmatch(r'\S.* \d+', line) for line in lines))
+        self.assertTrue(any('slow_view' in line.rsplit(';', 1)[-1] for line in lines))
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # The replica is a second connection to the test database, set up like a TEST MIRROR alias once the test
+    # databases exist. The mirror does not see uncommitted rows, so the data is committed, not rolled back.
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connections.settings['replica'] = {**connections['default'].settings_dict, 'TEST': {'MIRROR': 'default'}}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        super().tearDownClass()
+
+    def setUp(self):
+        sticky_cache().clear()
+        local_cache.clear()
+        seller = Account.objects.create(email='seller@example.com', type_account='seller', is_active=True)
+        Shop.objects.create(name='Shop', url='http://example.com/shop.yaml', user=seller)
+        self.buyer = Account.objects.create(email='buyer@example.com', type_account='buyer', is_active=True)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+        return client
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Shop))
+        token = read_alias.set('replica')
+        try:
+            self.assertEqual(router.db_for_read(Shop), 'replica')
+            self.assertEqual(router.db_for_write(Shop), 'default')
+        finally:
+            read_alias.reset(token)
+
+    @override_settings(DATABASE_REPLICAS=['first', 'second', 'third'], REPLICA_MAX_LAG=10)
+    def test_selector_skips_lagging_replicas(self):
+        lags = {'first': 2, 'second': 30, 'third': 1}
+        with mock.patch('app.routers.replica_lag', side_effect=lags.get):
+            with override_settings(REPLICA_SELECTION='round_robin'):
+                selector = ReplicaSelector()
+                self.assertEqual([selector.choose() for _ in range(4)], ['first', 'third', 'first', 'third'])
+            with override_settings(REPLICA_SELECTION='least_lag'):
+                self.assertEqual(ReplicaSelector().choose(), 'third')
+        with mock.patch('app.routers.replica_lag', return_value=None):
+            self.assertIsNone(ReplicaSelector().choose())
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_reads_go_to_the_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = APIClient().get('/api/v1/shops/')
+        self.assertEqual(response['X-DB-Route'], 'replica; reason=replica')
+        self.assertEqual(response.json()['count'], 1)
+        self.assertTrue(replica_queries.captured_queries)
+        response = self.client_for(self.buyer).get('/api/v1/basket')
+        self.assertEqual(response['X-DB-Route'], 'default; reason=primary')
+        for selection in ('round_robin', 'least_lag'):
+            with self.subTest(selection), override_settings(REPLICA_SELECTION=selection), \
+                    mock.patch('app.routers.replica_lag', return_value=60):
+                self.assertEqual(APIClient().get('/api/v1/shops/')['X-DB-Route'], 'default; reason=lagging')
+
+    @override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=5)
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        client = self.client_for(self.buyer)
+        self.assertEqual(client.post('/api/v1/basket', {}, format='json')['X-DB-Route'], 'default; reason=write')
+        self.assertEqual(client.get('/api/v1/shops/')['X-DB-Route'], 'default; reason=sticky')
+        self.assertEqual(APIClient().get('/api/v1/shops/')['X-DB-Route'], 'replica; reason=replica')
+        with mock.patch('django.core.cache.backends.locmem.time') as clock:
+            clock.time.return_value = time() + 6
+            self.assertEqual(client.get('/api/v1/shops/')['X-DB-Route'], 'replica; reason=replica')
+
+
+class TokenCacheTests(DataMixin, TestCase):
+    def test_lru_size(self):
+        cache = TokenCache(max_size=2, ttl=300)
+        cache.set('first', {'id': 1})
+        cache.set('second', {'id': 2})
+        self.assertEqual(cache.get('first'), {'id': 1})
+        # The least recently used entry is evicted
+        cache.set('third', {'id': 3})
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual((cache.get('first'), cache.get('third')), ({'id': 1}, {'id': 3}))
+
+    def test_ttl(self):
+        cache = TokenCache(max_size=10, ttl=300)
+        with mock.patch('app.authentication.monotonic', return_value=1000):
+            cache.set('key', {'id': 1})
+        with mock.patch('app.authentication.monotonic', return_value=1299):
+            self.assertEqual(cache.get('key'), {'id': 1})
+        with mock.patch('app.authentication.monotonic', return_value=1301):
+            self.assertIsNone(cache.get('key'))
+
+    def test_password_change_drops_cached_token(self):
+        client = self.client_for(self.buyer)
+        key = Token.objects.get(user=self.buyer).key
+        self.assertEqual(client.get('/api/v1/account/bayer').status_code, 200)
+        self.assertIsNotNone(get_snapshot(key))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch('/api/v1/account/bayer', {'old_password': 'Old-password-123',
+                                                              'password': 'New-password-456'}, format='json')
+        self.assertEqual(response.json()['Status'], True)
+        self.assertIsNone(get_snapshot(key))
+        client.get('/api/v1/account/bayer')
+        self.assertTrue(Account(**get_snapshot(key)).check_password('New-password-456'))
+
+    def test_stale_snapshot_is_not_saved(self):
+        client = self.client_for(self.buyer)
+        key = Token.objects.get(user=self.buyer).key
+        client.get('/api/v1/account/bayer')
+        # Another worker changes the password, this process still holds the old snapshot
+        self.buyer.set_password('New-password-456')
+        Account.objects.filter(id=self.buyer.id).update(password=self.buyer.password)
+        self.assertIsNotNone(get_snapshot(key))
+        response = client.patch('/api/v1/account/bayer', {'first_name': 'Renamed'}, format='json')
+        self.assertEqual(response.json()['Status'], True)
+        response = client.patch('/api/v1/account/bayer', {'old_password': 'Old-password-123',
+                                                          'password': 'Third-password-789'}, format='json')
+        self.assertEqual(response.json()['Status'], False)
+        buyer = Account.objects.get(id=self.buyer.id)
+        self.assertEqual(buyer.first_name, 'Renamed')
+        self.assertTrue(buyer.check_password('New-password-456'))
+        # A deactivation is not undone either
+        Account.objects.filter(id=self.buyer.id).update(is_active=False)
+        response = client.patch('/api/v1/account/bayer', {'first_name': 'Again'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(Account.objects.filter(id=self.buyer.id).values_list('is_active', 'first_name').get(),
+                         (False, 'Renamed'))
+
+    def test_token_deletion_drops_cached_token(self):
+        self.addCleanup(caches['default'].clear)
+        for backend in (None, 'default'):
+            with self.subTest(backend=backend), override_settings(TOKEN_AUTH_CACHE={'BACKEND': backend}):
+                client = self.client_for(self.buyer)
+                key = Token.objects.get(user=self.buyer).key
+                self.assertEqual(client.get('/api/v1/account/bayer').status_code, 200)
+                self.assertIsNotNone(get_snapshot(key))
+                with self.captureOnCommitCallbacks(execute=True):
+                    Token.objects.filter(key=key).delete()
+                self.assertIsNone(get_snapshot(key))
+                self.assertEqual(client.get('/api/v1/account/bayer').status_code, 401)
+
+
+class AuthThrottleTests(DataMixin, TestCase):
+    def login(self, password, address='127.0.0.1'):
+        return self.client.post('/api/v1/account/login', {'email': 'Buyer@example.com ', 'password': password},
+                                content_type='application/json', REMOTE_ADDR=address)
+
+    def test_email_throttle(self):
+        rate = settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['auth_email']
+        for number in range(int(rate.split('/')[0])):
+            self.assertNotEqual(self.login('wrong', f'10.0.0.{number}').status_code, 429)
+        # The email is throttled from any address, even with the right password
+        self.assertEqual(self.login('Old-password-123', '10.0.1.1').status_code, 429)
+        response = self.client.post('/api/v1/account/login', ['buyer@example.com'], content_type='application/json')
+        self.assertNotIn(response.status_code, (429, 500))
+
+    def test_ip_throttle_ignores_forwarded_for(self):
+        rate = int(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['auth_ip'].split('/')[0])
+        for number in range(rate):
+            response = self.client.post('/api/v1/account/login', {'email': f'user{number}@example.com',
+                                                                  'password': 'wrong'},
+                                        HTTP_X_FORWARDED_FOR=f'10.1.{number}.1', REMOTE_ADDR='192.0.2.1')
+            self.assertNotEqual(response.status_code, 429)
+        response = self.client.post('/api/v1/account/login', {'email': 'other@example.com', 'password': 'wrong'},
+                                    HTTP_X_FORWARDED_FOR='10.2.0.1', REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(response.status_code, 429)
+        # Behind a proxy only the address it appended counts
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            response = self.client.post('/api/v1/account/login', {'email': 'other@example.com', 'password': 'wrong'},
+                                        HTTP_X_FORWARDED_FOR='10.3.0.1, 192.0.2.1', REMOTE_ADDR='10.0.0.254')
+            self.assertEqual(response.status_code, 429)
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_login_upgrades_the_password_hash(self):
+        self.assertFalse(Account.objects.get(id=self.buyer.id).password.startswith('pbkdf2_sha256$1000$'))
+        response = self.client.post('/api/v1/account/login',
+                                    {'email': 'buyer@example.com', 'password': 'Old-password-123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('token', response.json())
+        self.assertTrue(Account.objects.get(id=self.buyer.id).password.startswith('pbkdf2_sha256$1000$'))
+        response = self.client.post('/api/v1/account/login',
+                                    {'email': 'buyer@example.com', 'password': 'Old-password-123'})
+        self.assertEqual(response.status_code, 200)
+
+
+class CatalogChangeTests(DataMixin, TestCase):
+    def changes(self, since=0):
+        return self.client.get('/api/v1/products/changes', {'since': since}).json()
+
+    def test_import_logs_only_changed_offers(self):
+        seller = Account.objects.create(email='feed@example.com', type_account='seller', is_active=True)
+        category = Category.objects.get()
+        price_list = PRICE_LIST.replace(b'Shop', b'Feed').replace(b'id: 1', f'id: {category.id}'.encode()).replace(
+            b'category: 1', f'category: {category.id}'.encode())
+        self.assertEqual(import_price_list(seller.id, price_list), {'Status': True})
+        page = self.changes()
+        self.assertEqual([(change['kind'], change['offer']['price']) for change in page['results']],
+                         [('upsert', '100.00'), ('upsert', '10.00')])
+        phone = page['results'][0]['product_info_id']
+        # Unchanged offers keep their ids and are not logged again
+        import_price_list(seller.id, price_list)
+        self.assertEqual(self.changes(page['cursor'])['results'], [])
+        import_price_list(seller.id, price_list.replace(b'price: 100', b'price: 90').split(b'  - name: Case')[0])
+        page = self.changes(page['cursor'])
+        self.assertEqual([(change['kind'], change['product_info_id'], change['offer'] and change['offer']['price'])
+                          for change in page['results']],
+                         [('upsert', phone, '90.00'), ('delete', page['results'][1]['product_info_id'], None)])
+        self.assertEqual(ProductInfo.objects.filter(shop__name='Feed').get().id, phone)
+
+    def test_async_import(self):
+        category = Category.objects.get()
+        price_list = PRICE_LIST.replace(b'id: 1', f'id: {category.id}'.encode()).replace(
+            b'category: 1', f'category: {category.id}'.encode())
+        fetched = []
+
+        def feed(request):
+            fetched.append(str(request.url))
+            if request.url.path == '/missing.yaml':
+                return httpx.Response(404)
+            return httpx.Response(200, content=price_list)
+
+        client = self.client_for(self.seller)
+        transport = httpx.MockTransport(feed)
+        with mock.patch('app.async_views.httpx.AsyncClient', partial(httpx.AsyncClient, transport=transport)):
+            response = client.post('/api/v1/async/partner/update', {'url': 'http://example.com/missing.yaml'},
+                                   format='json')
+            self.assertEqual(response.json()['Status'], False)
+            self.assertEqual(self.changes()['results'], [])
+            response = client.post('/api/v1/async/partner/update', {'url': 'http://example.com/shop.yaml'},
+                                   format='json')
+        self.assertEqual(response.json(), {'Status': True})
+        self.assertEqual(fetched, ['http://example.com/missing.yaml', 'http://example.com/shop.yaml'])
+        # The price list replaces the offers of the shop, as the sync import does
+        self.assertEqual(sorted(ProductInfo.objects.filter(shop=self.shop).values_list('product__name', 'price')),
+                         [('Case', 10), ('Phone', 100)])
+        changes = self.changes()['results']
+        self.assertEqual(sorted((change['kind'], change['offer'] and change['offer']['price']) for change in changes),
+                         [('delete', None)] * 3 + [('upsert', '10.00'), ('upsert', '100.00')])
+        self.assertEqual({change['product_info_id'] for change in changes if change['kind'] == 'delete'},
+                         {product_info.id for product_info in self.product_infos})
+
+    def test_shop_status_toggle(self):
+        client = self.client_for(self.seller)
+        client.patch('/api/v1/partner/shop', {'status': False}, format='json')
+        client.patch('/api/v1/partner/shop', {'status': False}, format='json')
+        changes = self.changes()['results']
+        self.assertEqual([(change['kind'], change['shop_id'], change['status']) for change in changes],
+                         [('shop', self.shop.id, False)])
+
+    def test_changes_are_paged(self):
+        CatalogChange.objects.bulk_create([CatalogChange(kind='delete', shop_id=self.shop.id, product_info_id=number)
+                                           for number in range(3)])
+        page = self.client.get('/api/v1/products/changes', {'limit': 2}).json()
+        self.assertTrue(page['more'])
+        page = self.changes(page['cursor'])
+        self.assertEqual(([change['product_info_id'] for change in page['results']], page['more']), ([2], False))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite serializes the writing transactions by itself')
+class CatalogChangeOrderTests(TransactionTestCase):
+    def write(self, started=None, release=None):
+        try:
+            with transaction.atomic():
+                CatalogChange.write([CatalogChange(kind='shop', shop_id=1, status=False)])
+                if started is not None:
+                    started.set()
+                    release.wait(10)
+        finally:
+            connection.close()
+
+    def test_ids_are_committed_in_order(self):
+        started, release = Event(), Event()
+        first = Thread(target=self.write, args=(started, release))
+        first.start()
+        started.wait(10)
+        second = Thread(target=self.write)
+        second.start()
+        # The second writer waits for the first commit, its id cannot be listed before the first one
+        second.join(0.5)
+        self.assertTrue(second.is_alive())
+        self.assertEqual(self.client.get('/api/v1/products/changes').json()['results'], [])
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(len(self.client.get('/api/v1/products/changes').json()['results']), 2)
+
+
+class PartnerOrderStatusTests(DataMixin, TestCase):
+    def place_order(self, *product_infos):
+        order = Order.objects.create(user=self.buyer, status='new')
+        for product_info in product_infos:
+            OrderItem.objects.create(order=order, product_info=product_info, quantity=1)
+        order.split_by_shop()
+        return order
+
+    def patch(self, ids, status):
+        return self.client_for(self.seller).patch('/api/v1/partner/orders', {'ids': ids, 'status': status},
+                                                  format='json').json()
+
+    def test_batch_update(self):
+        other_shop = Shop.objects.create(name='Other', user=Account.objects.create(
+            email='other@example.com', type_account='seller', is_active=True))
+        other_offer = ProductInfo.objects.create(product=self.product_infos[0].product, shop=other_shop, price=90,
+                                                 price_rrc=120, quantity=1)
+        first = self.order.shop_orders.get()
+        second = self.place_order(self.product_infos[0], other_offer)
+        second_own, second_other = second.shop_orders.get(shop=self.shop), second.shop_orders.get(shop=other_shop)
+        sent = self.place_order(self.product_infos[1]).shop_orders.get()
+        ShopOrder.objects.filter(id=sent.id).update(status='sent')
+        emails = OutgoingEmail.objects.count()
+        result = self.patch([first.id, second_own.id, sent.id, second_other.id], 'confirmed')
+        self.assertEqual((result['Status'], result['Updated objects']), (True, '2'))
+        self.assertEqual(result['Results'], {
+            str(first.id): 'Updated',
+            str(second_own.id): 'Updated',
+            str(sent.id): 'Status "sent" cannot be changed to "confirmed".',
+            str(second_other.id): 'There are no matches in the database.',
+        })
+        self.assertEqual(ShopOrder.objects.get(id=sent.id).status, 'sent')
+        self.assertEqual(ShopOrder.objects.get(id=second_other.id).status, 'new')
+        # An order moves with its last shop order only
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 'confirmed')
+        self.assertEqual(Order.objects.get(id=second.id).status, 'new')
+        # One e-mail for the buyer lists every changed order
+        self.assertEqual(OutgoingEmail.objects.count(), emails + 1)
+        self.assertEqual(OutgoingEmail.objects.last().message.splitlines(),
+                         [f'Заказ {self.order.id}: Подтвержден', f'Заказ {second.id}: Подтвержден'])
+
+    def test_rejected_requests(self):
+        shop_order = self.order.shop_orders.get()
+        self.assertEqual(self.patch([shop_order.id], 'basket'),
+                         {'Status': False, 'Errors': 'Status "basket" cannot be set.'})
+        self.assertEqual(self.patch(str(shop_order.id), 'confirmed'),
+                         {'Status': False, 'Errors': 'Wrong request format'})
+        self.assertEqual(ShopOrder.objects.get(id=shop_order.id).status, 'new')
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        outbox.enqueue_mass_mail([('Subject', 'Message', 'shop@example.com', [f'buyer{number}@example.com'])
+                           for number in range(3)])
+
+    @override_settings(EMAIL_OUTBOX_BATCH_SIZE=2)
+    def test_batches_share_a_connection(self):
+        with mock.patch('app.outbox.get_connection', wraps=get_connection) as connections_opened:
+            self.assertEqual([outbox.send_queued() for _ in range(3)], [2, 1, 0])
+        self.assertEqual(connections_opened.call_count, 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['buyer0@example.com', 'buyer1@example.com', 'buyer2@example.com'])
+        self.assertEqual(set(OutgoingEmail.objects.values_list('status', 'attempts')), {('sent', 1)})
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=3, EMAIL_OUTBOX_RETRY_DELAY=60)
+    def test_failures_back_off(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=OSError('refused')):
+            for attempt, delay in ((1, 60), (2, 120)):
+                start = timezone.now()
+                self.assertEqual(outbox.send_queued(), 3)
+                email = OutgoingEmail.objects.first()
+                self.assertEqual((email.status, email.attempts, email.last_error), ('queued', attempt, 'refused'))
+                self.assertGreaterEqual(email.next_attempt, start + timedelta(seconds=delay))
+                self.assertLessEqual(email.next_attempt, timezone.now() + timedelta(seconds=delay))
+                # Not due before the delay
+                self.assertEqual(outbox.send_queued(), 0)
+                OutgoingEmail.objects.update(next_attempt=timezone.now())
+            self.assertEqual(outbox.send_queued(), 3)
+        self.assertEqual(set(OutgoingEmail.objects.values_list('status', 'attempts')), {('failed', 3)})
+        self.assertEqual(outbox.send_queued(), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_claimed_messages_wait_for_the_sending_timeout(self):
+        self.assertEqual(len(outbox.claim(2, timezone.now())), 2)
+        self.assertEqual(OutgoingEmail.objects.filter(status='sending').count(), 2)
+        # Another worker only gets the unclaimed message
+        self.assertEqual(outbox.send_queued(), 1)
+        self.assertEqual(outbox.send_queued(), 0)
+        # The claiming worker stopped, its messages are sent once the claim expires
+        OutgoingEmail.objects.filter(status='sending').update(
+            next_attempt=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.send_queued(), 2)
+        self.assertEqual(len(mail.outbox), 3)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SKIP LOCKED needs row locks')
+class OutboxLockingTests(TransactionTestCase):
+    def hold(self, email_id, locked, release):
+        try:
+            with transaction.atomic():
+                list(OutgoingEmail.objects.select_for_update().filter(id=email_id))
+                locked.set()
+                release.wait(10)
+        finally:
+            connection.close()
+
+    def test_locked_messages_are_skipped(self):
+        outbox.enqueue_mass_mail([('Subject', 'Message', '', ['first@example.com', 'second@example.com'])])
+        first = OutgoingEmail.objects.get(recipient='first@example.com')
+        locked, release = Event(), Event()
+        holder = Thread(target=self.hold, args=(first.id, locked, release))
+        holder.start()
+        locked.wait(10)
+        try:
+            self.assertEqual(outbox.send_queued(), 1)
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual([message.to for message in mail.outbox], [['second@example.com']])
+        self.assertEqual(outbox.send_queued(), 1)
+
+
+class SupplierDigestTests(DataMixin, TestCase):
+    def place_order(self, product_info, status='new'):
+        order = Order.objects.create(user=self.buyer, status=status)
+        OrderItem.objects.create(order=order, product_info=product_info, quantity=1)
+        order.split_by_shop()
+        return order
+
+    def test_one_digest_per_supplier(self):
+        other_seller = Account.objects.create(email='other@example.com', type_account='seller', is_active=True)
+        other_offer = ProductInfo.objects.create(product=self.product_infos[0].product, shop=Shop.objects.create(
+            name='Other', user=other_seller), price=90, price_rrc=120, quantity=1)
+        second = self.place_order(self.product_infos[1])
+        self.place_order(other_offer)
+        self.place_order(self.product_infos[2], status='canceled')
+        self.assertEqual(queue_supplier_digests(), 2)
+        digests = dict(OutgoingEmail.objects.values_list('recipient', 'message'))
+        self.assertEqual(set(digests), {'seller@example.com', 'other@example.com'})
+        self.assertEqual(len(digests['seller@example.com'].splitlines()), 4)
+        self.assertIn(f'Заказ {second.id} (Shop, Новый): Phone 1 x 1 по 101.00', digests['seller@example.com'])
+        self.assertNotIn('Phone 2 x 1', digests['seller@example.com'])
+        self.assertEqual(digests['other@example.com'].count('Заказ'), 1)
+        # Already notified orders are not repeated
+        self.assertEqual(queue_supplier_digests(), 0)
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+        self.place_order(self.product_infos[0])
+        self.assertEqual(queue_supplier_digests(), 1)
+        self.assertEqual(OutgoingEmail.objects.filter(recipient='seller@example.com').count(), 2)
+
+    def test_existing_orders_are_marked_notified(self):
+        import_module('app.migrations.0015_notified_existing_shop_orders').mark_notified(django_apps, None)
+        self.assertEqual(ShopOrder.objects.get(order=self.order).notified, ShopOrder.objects.get(order=self.order).dt)
+        self.assertEqual(queue_supplier_digests(), 0)
+
+
+class PriceHistoryTests(DataMixin, TestCase):
+    def test_only_changed_prices_are_recorded(self):
+        price_list = PRICE_LIST.replace(b'id: 1', f'id: {self.product_infos[0].product.category_id}'.encode()).replace(
+            b'category: 1', f'category: {self.product_infos[0].product.category_id}'.encode())
+        import_price_list(self.seller.id, price_list)
+        import_price_list(self.seller.id, price_list.replace(b'quantity: 5', b'quantity: 4'))
+        import_price_list(self.seller.id, price_list.replace(b'price: 100', b'price: 90'))
+        phone = Product.objects.get(name='Phone')
+        self.assertEqual(list(PriceHistory.objects.filter(product=phone).values_list('price', flat=True)), [100, 90])
+        import_price_list(self.seller.id, price_list.replace(b'price: 100', b'price: 95'))
+        results = self.client.get(f'/api/v1/products/{phone.id}/prices').json()['results']
+        self.assertEqual(results, [{'shop': self.shop.id, 'day': str(timezone.localdate()), 'min': '90.00',
+                                    'max': '100.00', 'last': '95.00'}])
+
+    def test_time_range(self):
+        product = self.product_infos[0].product
+        for days, price in ((400, 10), (2, 20), (2, 15), (1, 30)):
+            PriceHistory.objects.create(product=product, shop=self.shop, price=price, price_rrc=price,
+                                        dt=timezone.now() - timedelta(days=days))
+        response = self.client.get(f'/api/v1/products/{product.id}/prices',
+                                   {'until': str(timezone.localdate() - timedelta(days=2))})
+        self.assertEqual([(day['min'], day['max'], day['last']) for day in response.json()['results']],
+                         [('15.00', '20.00', '15.00')])
+        response = self.client.get(f'/api/v1/products/{product.id}/prices', {'since': 'yesterday'})
+        self.assertEqual(response.json(), {'Status': False, 'Errors': 'Wrong request format.'})
+
+
+class OrderListTests(DataMixin, TestCase):
+    def place_orders(self, *dates):
+        # Placed orders of the buyer with one shop order each, at the given dates
+        orders = []
+        for dt in dates:
+            order = Order.objects.create(user=self.buyer, status='new')
+            OrderItem.objects.create(order=order, product_info=self.product_infos[0], quantity=1)
+            order.split_by_shop()
+            Order.objects.filter(id=order.id).update(dt=dt)
+            ShopOrder.objects.filter(order=order).update(dt=dt)
+            orders.append(order.id)
+        return orders
+
+    def pages(self, client, path, **params):
+        # Ids of every page of a list, following the cursors
+        ids, params = [], {'limit': 2, **params}
+        while True:
+            page = client.get(path, params).json()
+            ids.append([result['order'] if 'order' in result else result['id'] for result in page['results']])
+            if page['next'] is None:
+                return ids
+            params['cursor'] = parse_qs(urlparse(page['next']).query)['cursor'][0]
+
+    def test_date_range(self):
+        day = timezone.now().replace(microsecond=0) - timedelta(days=10)
+        first, second, third = self.place_orders(day, day + timedelta(days=1), day + timedelta(days=2))
+        params = {'date_from': (day + timedelta(hours=1)).isoformat(), 'date_to': (day + timedelta(days=2)).isoformat()}
+        for user, path in ((self.buyer, '/api/v1/basket/update'), (self.seller, '/api/v1/partner/orders')):
+            with self.subTest(path=path):
+                self.assertEqual(self.pages(self.client_for(user), path, **params), [[third, second]])
+                self.assertEqual(self.pages(self.client_for(user), path, date_to=day.isoformat()), [[first]])
+                response = self.client_for(user).get(path, {'date_from': 'yesterday'})
+                self.assertEqual(response.json()['Status'], False)
+
+    def test_equal_dates_are_ordered_by_id(self):
+        dt = timezone.now() - timedelta(days=10)
+        orders = self.place_orders(*[dt] * 5)
+        for user, path in ((self.buyer, '/api/v1/basket/update'), (self.seller, '/api/v1/partner/orders')):
+            with self.subTest(path=path):
+                pages = self.pages(self.client_for(user), path, date_to=dt.isoformat())
+                self.assertEqual(pages, [orders[:2:-1], orders[2:0:-1], orders[:1]])
+
+    def test_malformed_cursor(self):
+        cursors = ['%%%', 'bm90IGEgY3Vyc29y', b64encode(b'2026-01-01T00:00:00+00:00|x').decode(),
+                   b64encode(b'2026-13-45T00:00:00+00:00|1').decode(), b64encode(b'yesterday|1').decode(),
+                   b64encode(b'2026-01-01T00:00:00+00:00|1|2').decode(),
+                   b64encode(b'2026-01-01T00:00:00+00:00|99999999999999999999999').decode(), 'курсор']
+        for user, path in ((self.buyer, '/api/v1/basket/update'), (self.seller, '/api/v1/partner/orders')):
+            for cursor in cursors:
+                with self.subTest(path=path, cursor=cursor):
+                    response = self.client_for(user).get(path, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404)
+
+
+class DeliveryTests(DataMixin, TestCase):
+    def test_tier_cost(self):
+        table = delivery.RateTable(1, Decimal('5'), Decimal('1000'), [(10, Decimal('3')), (20, Decimal('1'))])
+        self.assertEqual(table.cost(9, Decimal('500')), Decimal('5'))
+        self.assertEqual(table.cost(10, Decimal('500')), Decimal('8'))
+        self.assertEqual(table.cost(25, Decimal('500')), Decimal('6'))
+        self.assertEqual(table.cost(25, Decimal('1000')), Decimal('0'))
+        self.assertEqual(delivery.RateTable().cost(100, Decimal('10000')), Decimal('0'))
+
+    def test_checkout_locks_in_cost(self):
+        # 6 items for 606 are under the tier and the free threshold
+        self.assertEqual(self.order.delivery_cost, Decimal('5'))
+        self.assertEqual(list(self.order.shop_orders.values_list('delivery_cost', flat=True)), [Decimal('5')])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.seller).post('/api/v1/partner/delivery', {
+                'base_fee': '7.00', 'tiers': [{'min_quantity': 5, 'fee': '2.00'}]}, format='json')
+        self.assertEqual(response.json()['Status'], True)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.delivery_cost, Decimal('5'))
+        self.assertEqual(list(self.order.shop_orders.values_list('delivery_cost', flat=True)), [Decimal('5')])
+        self.assertEqual(delivery.get_rate_tables([self.shop.id])[self.shop.id].cost(6, Decimal('606')),
+                         Decimal('9'))
+
+    def test_split_by_shop(self):
+        other = Shop.objects.create(name='Other', user=self.seller)
+        rate = DeliveryRate.objects.create(shop=other, base_fee=4, free_threshold=None)
+        DeliveryRateTier.objects.create(rate=rate, min_quantity=3, fee=2)
+        # A shop without a rate delivers for free
+        third = Shop.objects.create(name='Third', user=self.seller)
+        product = self.product_infos[0].product
+        cheap = [ProductInfo.objects.create(product=product, shop=other, price=price, price_rrc=price, quantity=10)
+                 for price in (10, 15)]
+        free = ProductInfo.objects.create(product=product, shop=third, price=50, price_rrc=50, quantity=10)
+        order = Order.objects.create(user=self.buyer, status='new')
+        for product_info, quantity in ((self.product_infos[0], 1), (self.product_infos[1], 2), (cheap[0], 2),
+                                       (cheap[1], 1), (free, 3)):
+            OrderItem.objects.create(order=order, product_info=product_info, quantity=quantity)
+        shop_orders = order.split_by_shop()
+        self.assertEqual(sorted((shop_order.shop_id, shop_order.status, shop_order.total_sum, shop_order.delivery_cost)
+                                for shop_order in shop_orders),
+                         [(self.shop.id, 'new', Decimal('302'), Decimal('5')),
+                          (other.id, 'new', Decimal('35'), Decimal('6')),
+                          (third.id, 'new', Decimal('150'), Decimal('0'))])
+        self.assertEqual(Order.objects.get(id=order.id).delivery_cost, Decimal('11'))
+        # Every line belongs to the shop order of its shop
+        self.assertEqual(sorted(order.ordered_items.values_list('product_info__shop_id', 'shop_order__shop_id')),
+                         sorted([(self.shop.id, self.shop.id)] * 2 + [(other.id, other.id)] * 2 + [(third.id, third.id)]))
+
+    def test_cached_tables_follow_version(self):
+        self.assertEqual(delivery.get_rate_tables([self.shop.id])[self.shop.id].base_fee, Decimal('5'))
+        with self.assertNumQueries(1):
+            delivery.get_rate_tables([self.shop.id])
+        # an edit committed by another worker, no signal reaches this process
+        DeliveryRate.objects.filter(shop=self.shop).update(base_fee=9, version=F('version') + 1)
+        with self.assertNumQueries(3):
+            self.assertEqual(delivery.get_rate_tables([self.shop.id])[self.shop.id].base_fee, Decimal('9'))
+
+    def test_tier_change_invalidates_its_shop(self):
+        other = Shop.objects.create(name='Other', user=self.seller)
+        delivery.get_rate_tables([self.shop.id, other.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            tier = DeliveryRateTier.objects.get(rate__shop=self.shop)
+            tier.fee = 4
+            tier.save()
+        self.assertNotIn(self.shop.id, delivery._rate_tables)
+        self.assertIn(other.id, delivery._rate_tables)
+        self.assertEqual(delivery.get_rate_tables([self.shop.id])[self.shop.id].tiers, ((10, Decimal('4')),))
+
+
+class AdminTests(DataMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        admin_user = Account.objects.create(email='admin@example.com', is_staff=True, is_superuser=True,
+                                            is_active=True)
+        self.client.force_login(admin_user)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        # Session, user, page, count and the foreign keys joined or listed by the filters
+        for model in admin.site._registry:
+            url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+            with self.subTest(url=url), self.assertQueryBudget(6, url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_numeric_search_uses_ids(self):
+        response = self.client.get(reverse('admin:app_orderitem_changelist'), {'q': self.order.id})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_cancel_orders(self):
+        shop_order = self.order.shop_orders.get()
+        self.client.post(reverse('admin:app_shoporder_changelist'),
+                         {'action': 'cancel', '_selected_action': [shop_order.id]})
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 'canceled')
+        self.assertEqual(ShopOrder.objects.get(id=shop_order.id).status, 'canceled')
+
+    def test_orders_with_sent_shop_orders_are_not_canceled(self):
+        other_shop = Shop.objects.create(name='Other', user=Account.objects.create(
+            email='other@example.com', type_account='seller', is_active=True))
+        OrderItem.objects.create(order=self.basket, product_info=ProductInfo.objects.create(
+            product=self.product_infos[0].product, shop=other_shop, price=90, price_rrc=120, quantity=1), quantity=1)
+        self.basket.status = 'new'
+        self.basket.save(update_fields=['status'])
+        self.basket.split_by_shop()
+        # One shop already sent its part of the second order
+        ShopOrder.objects.filter(order=self.basket, shop=other_shop).update(status='sent')
+        response = self.client.post(reverse('admin:app_order_changelist'),
+                                    {'action': 'cancel', '_selected_action': [self.order.id, self.basket.id]},
+                                    follow=True)
+        self.assertIn('1 orders canceled, 1 orders can no longer be canceled.',
+                      [str(message) for message in response.context['messages']])
+        self.assertEqual(set(ShopOrder.objects.filter(order=self.order).values_list('status', flat=True)),
+                         {'canceled'})
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 'canceled')
+        self.assertEqual(Order.objects.get(id=self.basket.id).status, 'new')
+        self.assertEqual(set(ShopOrder.objects.filter(order=self.basket).values_list('shop__name', 'status')),
+                         {('Shop', 'new'), ('Other', 'sent')})
+
+    def test_deactivation_drops_cached_tokens(self):
+        client = self.client_for(self.buyer)
+        self.assertEqual(client.get('/api/v1/account/bayer').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:app_account_changelist'),
+                             {'action': 'deactivate', '_selected_action': [self.buyer.id]})
+        self.assertEqual(client.get('/api/v1/account/bayer').status_code, 401)
+
+
+@override_settings(ESTIMATED_COUNT_THRESHOLD=2)
+class EstimatedCountPaginationTests(DataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+
+    def test_cached_count_above_threshold(self):
+        first = self.client.get('/api/v1/products/', {'limit': 2}).json()
+        self.assertEqual((first['count'], first['count_estimated']), (3, False))
+        ProductInfo.objects.filter(id=self.product_infos[0].id).delete()
+        with self.assertNumQueries(3):
+            cached = self.client.get('/api/v1/products/', {'limit': 2}).json()
+        # The stale total is reported, the next link follows the rows actually read
+        self.assertEqual((cached['count'], cached['count_estimated'], cached['next']), (3, True, None))
+        exact = self.client.get('/api/v1/products/', {'limit': 2, 'count': 'exact'}).json()
+        self.assertEqual((exact['count'], exact['count_estimated']), (2, False))
+
+    def test_estimated_count_keeps_later_pages(self):
+        self.client.get('/api/v1/products/', {'limit': 1})
+        ProductInfo.objects.create(product=self.product_infos[0].product, shop=Shop.objects.create(
+            name='Second', user=self.buyer), price=1, price_rrc=1, quantity=1)
+        page = self.client.get('/api/v1/products/', {'limit': 1, 'offset': 3}).json()
+        self.assertEqual((page['count'], len(page['results']), page['next']), (3, 1, None))
+        page = self.client.get('/api/v1/products/', {'limit': 1, 'offset': 2}).json()
+        self.assertIn('offset=3', page['next'])
+
+
+class SparseFieldsTests(DataMixin, TestCase):
+    def test_products_fields(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/products/', {'fields': 'id,price,product.name', 'limit': 1})
+        self.assertEqual(response.json()['results'], [{'id': self.product_infos[0].id, 'price': '100.00',
+                                                       'product': {'name': 'Phone 0'}}])
+
+    def test_products_expand(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/products/', {'expand': 'product', 'limit': 1})
+        result = response.json()['results'][0]
+        parameter = self.product_infos[0].product_parameters.get()
+        self.assertEqual((result['product'], result['product_parameters']),
+                         ({'name': 'Phone 0', 'category': 'Phones'}, [parameter.id]))
+
+    def test_partner_orders_without_lines_and_contacts(self):
+        client = self.client_for(self.seller)
+        full = client.get('/api/v1/partner/orders').json()['results'][0]
+        # The shops, the shop orders page, the line ids and the archive behind the short page, the token is cached
+        # by the first request
+        with self.assertNumQueries(4):
+            response = client.get('/api/v1/partner/orders', {'fields': 'id,total_sum,user,ordered_items',
+                                                              'expand': ''})
+        lean = response.json()['results'][0]
+        self.assertEqual(lean, {'id': full['id'], 'total_sum': full['total_sum'], 'user': full['user']['id'],
+                                'ordered_items': [item['id'] for item in full['ordered_items']]})
+
+    def test_buyer_orders_lines_without_product_infos(self):
+        response = self.client_for(self.buyer).get('/api/v1/basket/update', {'expand': 'ordered_items'})
+        self.assertEqual({item['product_info'] for item in response.json()['results'][0]['ordered_items']},
+                         {product_info.id for product_info in self.product_infos})
+
+
+class SnapshotTests(DataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(CATALOG_SNAPSHOT_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_catalog_snapshot(self):
+        second_shop = Shop.objects.create(name='Second', user=Account.objects.create(
+            email='second@example.com', type_account='seller', is_active=True))
+        ProductInfo.objects.create(product=self.product_infos[0].product, shop=second_shop, price=90,
+                                   price_rrc=120, quantity=1)
+        snapshots.rebuild_all()
+        response = self.client.get('/api/v1/products/snapshot')
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        records = [json.loads(line) for line in gzip.decompress(content).splitlines()]
+        self.assertEqual([record['price'] for record in records], ['100.00', '101.00', '102.00', '90.00'])
+        # The catalog is the concatenation of the shop files
+        shop_response = self.client.get(f'/api/v1/products/snapshot/{self.shop.id}')
+        self.assertTrue(content.startswith(b''.join(shop_response.streaming_content)))
+
+    def test_snapshot_ranges(self):
+        snapshots.rebuild_all()
+        content = b''.join(self.client.get('/api/v1/products/snapshot').streaming_content)
+        response = self.client.get('/api/v1/products/snapshot', HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-{len(content) - 1}/{len(content)}')
+        self.assertEqual(b''.join(response.streaming_content), content[10:])
+        response = self.client.get('/api/v1/products/snapshot', HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), content[-5:])
+        response = self.client.get('/api/v1/products/snapshot', HTTP_RANGE=f'bytes={len(content)}-')
+        self.assertEqual(response.status_code, 416)
+        response = self.client.get('/api/v1/products/snapshot', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_changed_shops_are_rebuilt(self):
+        second_shop = Shop.objects.create(name='Second', user=Account.objects.create(
+            email='second@example.com', type_account='seller', is_active=True))
+        ProductInfo.objects.create(product=self.product_infos[0].product, shop=second_shop, price=90,
+                                   price_rrc=120, quantity=1)
+        snapshots.rebuild_all()
+        catalog = b''.join(self.client.get('/api/v1/products/snapshot').streaming_content)
+        category_id = self.product_infos[0].product.category_id
+        price_list = PRICE_LIST.replace(b'id: 1', f'id: {category_id}'.encode()).replace(
+            b'category: 1', f'category: {category_id}'.encode())
+        # The import only logs the changes, the snapshots are rebuilt by the command
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(import_price_list(self.seller.id, price_list)['Status'])
+        self.assertEqual(b''.join(self.client.get('/api/v1/products/snapshot').streaming_content), catalog)
+        with mock.patch('app.snapshots.write_shop', wraps=snapshots.write_shop) as write_shop:
+            self.assertEqual(snapshots.rebuild_changed(), [self.shop.id])
+            self.assertEqual(snapshots.rebuild_changed(), [])
+        write_shop.assert_called_once_with(self.shop.id)
+        content = b''.join(self.client.get('/api/v1/products/snapshot').streaming_content)
+        self.assertEqual([json.loads(line)['price'] for line in gzip.decompress(content).splitlines()],
+                         ['100.00', '10.00', '90.00'])
+
+    def test_switched_off_shop_leaves_the_catalog(self):
+        snapshots.rebuild_all()
+        Shop.objects.filter(id=self.shop.id).update(status=False)
+        snapshots.write_catalog()
+        self.assertEqual(self.client.get(f'/api/v1/products/snapshot/{self.shop.id}').status_code, 404)
+        content = b''.join(self.client.get('/api/v1/products/snapshot').streaming_content)
+        self.assertEqual(gzip.decompress(content), b'')
+
+
+class BatchTests(DataMixin, TestCase):
+    def batch(self, requests, **options):
+        return self.client_for(self.buyer).post('/api/v1/batch', {'requests': requests, **options},
+                                                format='json').json()
+
+    def test_responses_in_order(self):
+        result = self.batch([
+            {'method': 'POST', 'path': '/api/v1/partner/contacts', 'body': {'type': 'address', 'value': 'Moscow'}},
+            {'method': 'GET', 'path': '/api/v1/partner/contacts'},
+            {'method': 'GET', 'path': '/api/v1/products/?limit=1&fields=id'},
+            {'method': 'GET', 'path': '/api/v1/missing'},
+        ])
+        self.assertTrue(result['Status'])
+        statuses = [response['status'] for response in result['Responses']]
+        self.assertEqual(statuses, [200, 200, 200, 404])
+        self.assertEqual(result['Responses'][0]['body'], {'Status': True})
+        self.assertEqual({contact['value'] for contact in result['Responses'][1]['body']}, {'+70000000000', 'Moscow'})
+        self.assertEqual(list(result['Responses'][2]['body']['results'][0]), ['id'])
+
+    def test_failing_sub_request(self):
+        with mock.patch('app.views.ContactView.get', side_effect=RuntimeError('broken')), \
+                self.assertLogs('app.views', 'ERROR'):
+            result = self.batch([
+                {'method': 'GET', 'path': '/api/v1/partner/contacts'},
+                {'method': 'GET', 'path': '/api/v1/basket'},
+            ])
+        self.assertTrue(result['Status'])
+        self.assertEqual(result['Responses'][0], {'status': 500,
+                                                  'body': {'Status': False, 'Errors': 'Internal server error.'}})
+        self.assertEqual(result['Responses'][1]['status'], 200)
+
+    def test_sub_requests_use_the_batch_credentials(self):
+        # The token is looked up for the batch only, the sub-requests run as its user
+        client = self.client_for(self.buyer)
+        with CaptureQueriesContext(connection) as queries:
+            result = client.post('/api/v1/batch', {'requests': [{'path': '/api/v1/partner/contacts'}] * 2},
+                                 format='json').json()
+        self.assertEqual([[contact['value'] for contact in response['body']] for response in result['Responses']],
+                         [['+70000000000']] * 2)
+        self.assertEqual(sum('authtoken_token' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_atomic_batch_rolls_back(self):
+        result = self.batch([
+            {'method': 'POST', 'path': '/api/v1/partner/contacts', 'body': {'type': 'address', 'value': 'Moscow'}},
+            {'method': 'PATCH', 'path': '/api/v1/partner/contacts', 'body': {'id': 0, 'value': 'Kazan'}},
+            {'method': 'DELETE', 'path': '/api/v1/partner/contacts', 'body': {'id': self.contact.id}},
+        ], atomic=True)
+        self.assertFalse(result['Status'])
+        self.assertEqual(len(result['Responses']), 2)
+        self.assertEqual(list(Contact.objects.values_list('value', flat=True)), ['+70000000000'])
+
+    def test_rejected_requests(self):
+        result = self.batch([
+            {'method': 'POST', 'path': '/api/v1/batch', 'body': {'requests': []}},
+            {'method': 'POST', 'path': '/api/v1/async/partner/update', 'body': {'url': 'wrong'}},
+            {'method': 'OPTIONS', 'path': '/api/v1/basket'},
+        ])
+        self.assertEqual([response['status'] for response in result['Responses']], [400, 400, 405])
+        with override_settings(BATCH_MAX_REQUESTS=1):
+            self.assertFalse(self.batch([{'path': '/api/v1/basket'}] * 2)['Status'])
+        response = APIClient().post('/api/v1/batch', {'requests': [{'path': '/api/v1/basket'}]}, format='json')
+        self.assertFalse(response.json()['Status'])
+
+
+class OrderArchiveTests(DataMixin, TestCase):
+    def finish(self, order, status, days):
+        dt = timezone.now() - timedelta(days=days)
+        Order.objects.filter(id=order.id).update(status=status, dt=dt)
+        ShopOrder.objects.filter(order_id=order.id).update(status=status, dt=dt)
+
+    def test_only_old_finished_orders_are_moved(self):
+        self.finish(self.order, 'delivered', settings.ORDER_ARCHIVE_AFTER_DAYS + 1)
+        recent = Order.objects.create(user=self.buyer, status='canceled')
+        unfinished = Order.objects.create(user=self.buyer, status='new')
+        OrderItem.objects.create(order=unfinished, product_info=self.product_infos[0], quantity=1)
+        unfinished.split_by_shop()
+        self.finish(unfinished, 'sent', settings.ORDER_ARCHIVE_AFTER_DAYS + 1)
+        self.assertEqual(archive_orders(batch_size=1), 1)
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {self.basket.id, recent.id, unfinished.id})
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.id, archived.status, archived.total_sum), (self.order.id, 'delivered', 606))
+        self.assertEqual(ArchivedShopOrder.objects.get().order_id, self.order.id)
+        self.assertEqual(ArchivedOrderItem.objects.filter(order=archived, shop_order__isnull=False).count(), 3)
+        self.assertEqual(archive_orders(), 0)
+
+    def test_history_reads_archived_orders(self):
+        self.finish(self.order, 'delivered', settings.ORDER_ARCHIVE_AFTER_DAYS + 1)
+        archive_orders()
+        recent = [Order.objects.create(user=self.buyer, status='new') for _ in range(2)]
+        client = self.client_for(self.buyer)
+        # A page filled with orders newer than the archive age does not touch the archive
+        with CaptureQueriesContext(connection) as queries:
+            page = client.get('/api/v1/basket/update', {'limit': 1}).json()
+        self.assertEqual([order['id'] for order in page['results']], [recent[1].id])
+        self.assertFalse([query for query in queries if 'archived' in query['sql']])
+        page = client.get(page['next']).json()
+        self.assertEqual([order['id'] for order in page['results']], [recent[0].id])
+        page = client.get(page['next']).json()
+        self.assertEqual([(order['id'], order['total_sum'], len(order['ordered_items'])) for order in page['results']],
+                         [(self.order.id, 606, 3)])
+        self.assertIsNone(page['next'])
+        self.assertEqual(len(client.get('/api/v1/basket/update', {'status': 'new'}).json()['results']), 2)
+
+    def test_partner_history_reads_archived_orders(self):
+        self.finish(self.order, 'canceled', settings.ORDER_ARCHIVE_AFTER_DAYS + 1)
+        archive_orders()
+        client = self.client_for(self.seller)
+        page = client.get('/api/v1/partner/orders', {'expand': 'user'}).json()
+        self.assertEqual([(order['order'], order['status'], order['user']['id']) for order in page['results']],
+                         [(self.order.id, 'canceled', self.buyer.id)])
+        response = client.get('/api/v1/partner/orders/export', {'output': 'ndjson'})
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(line['order'], line['status']) for line in lines], [(self.order.id, 'canceled')] * 3)
+
+    def test_csv_export(self):
+        days = settings.ORDER_ARCHIVE_AFTER_DAYS
+        self.finish(self.order, 'delivered', days + 1)
+        archive_orders()
+        # An unfinished order older than the archived one and a new one, the export interleaves them by date
+        older, newer = [Order.objects.create(user=self.buyer, status='new') for _ in range(2)]
+        for order, product_infos in ((older, self.product_infos[:2]), (newer, self.product_infos[2:])):
+            for product_info in product_infos:
+                OrderItem.objects.create(order=order, product_info=product_info, quantity=1)
+            order.split_by_shop()
+        self.finish(older, 'sent', days + 5)
+        client = self.client_for(self.seller)
+
+        def export(**params):
+            response = client.get('/api/v1/partner/orders/export', params)
+            self.assertEqual(response['Content-Type'], 'text/csv')
+            return list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+        rows = export()
+        self.assertEqual(rows[0], ['shop_order', 'order', 'status', 'dt', 'product_info', 'product', 'quantity',
+                                   'price'])
+        self.assertEqual([(int(row[1]), row[2], row[5], int(row[6]), row[7]) for row in rows[1:]], [
+            (older.id, 'sent', 'Phone 0', 1, '100.00'), (older.id, 'sent', 'Phone 1', 1, '101.00'),
+            (self.order.id, 'delivered', 'Phone 0', 2, '100.00'), (self.order.id, 'delivered', 'Phone 1', 2, '101.00'),
+            (self.order.id, 'delivered', 'Phone 2', 2, '102.00'), (newer.id, 'new', 'Phone 2', 1, '102.00')])
+        # The bounds apply to the live and the archived lines
+        bounds = {'date_from': (timezone.now() - timedelta(days=days + 2)).isoformat(),
+                  'date_to': (timezone.now() - timedelta(days=1)).isoformat()}
+        self.assertEqual({int(row[1]) for row in export(**bounds)[1:]}, {self.order.id})
+        self.assertEqual({int(row[1]) for row in export(date_from=bounds['date_to'])[1:]}, {newer.id})
+        self.assertEqual({int(row[1]) for row in export(date_to=bounds['date_from'])[1:]}, {older.id})
+
+    def test_archived_lines_outlive_deleted_offers(self):
+        self.finish(self.order, 'delivered', settings.ORDER_ARCHIVE_AFTER_DAYS + 1)
+        archive_orders()
+        # The new price list of the shop drops the archived offers
+        import_price_list(self.seller.id, PRICE_LIST)
+        self.assertFalse(ProductInfo.objects.filter(id__in=[offer.id for offer in self.product_infos]).exists())
+        self.assertEqual(sorted(ArchivedOrderItem.objects.values_list('product_name', 'price')),
+                         [('Phone 0', 100), ('Phone 1', 101), ('Phone 2', 102)])
+        page = self.client_for(self.buyer).get('/api/v1/basket/update').json()
+        self.assertEqual(sorted((item['product_info']['id'], item['product_info']['product']['name'],
+                                 item['product_info']['price']) for item in page['results'][0]['ordered_items']),
+                         [(offer.id, f'Phone {number}', f'{100 + number}.00')
+                          for number, offer in enumerate(self.product_infos)])
+        page = self.client_for(self.buyer).get('/api/v1/basket/update',
+                                               {'fields': 'ordered_items.product_info.price'}).json()
+        self.assertEqual(sorted(list(item['product_info'].items()) for item in page['results'][0]['ordered_items']),
+                         [[('price', '100.00')], [('price', '101.00')], [('price', '102.00')]])
+        response = self.client_for(self.seller).get('/api/v1/partner/orders/export', {'output': 'ndjson'})
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted((line['product'], line['price']) for line in lines),
+                         [('Phone 0', '100.00'), ('Phone 1', '101.00'), ('Phone 2', '102.00')])
+
+
+class LoadTestSmokeTests(LiveServerTestCase):
+    def setUp(self):
+        local_cache.clear()
+        caches['throttle'].clear()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(CATALOG_SNAPSHOT_DIR=str(self.directory / 'snapshots'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_tiny_run(self):
+        baseline, output = self.directory / 'baseline.json', StringIO()
+        call_command('loadtest', base_url=self.live_server_url, concurrency=2, duration=0.5, scenarios='catalog',
+                     products=20, baseline=str(baseline), save_baseline=True, stdout=output)
+        report = json.loads(baseline.read_text())
+        self.assertEqual(set(report), {'GET api/v1/', 'GET api/v1/shops/', 'GET api/v1/category/',
+                                       'GET api/v1/products/', 'GET api/v1/products/?offset=',
+                                       'GET api/v1/products/?category='})
+        for endpoint, result in report.items():
+            with self.subTest(endpoint=endpoint):
+                self.assertGreater(result['requests'], 0)
+                self.assertEqual((result['errors'], result['throttled']), (0, 0))
+                self.assertTrue(0 < result['p50'] <= result['p95'] <= result['p99'])
+                self.assertGreater(result['rps'], 0)
+        # The printed table holds the same figures
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), ['Endpoint', 'Requests', 'Errors', 'Throttled', 'p50', 'ms', 'p95', 'ms',
+                                            'p99', 'ms', 'req/s'])
+        table = {line[:45].strip(): line[45:].split() for line in lines[2:2 + len(report)]}
+        self.assertEqual(table, {endpoint: [str(result['requests']), '0', '0', f'{result["p50"]:.1f}',
+                                            f'{result["p95"]:.1f}', f'{result["p99"]:.1f}', f'{result["rps"]:.1f}']
+                                 for endpoint, result in report.items()})
+        # The summary is the baseline the next run is compared against
+        call_command('loadtest', base_url=self.live_server_url, concurrency=1, duration=0.2, scenarios='catalog',
+                     products=20, baseline=str(baseline), tolerance=1000, stdout=output)
+        self.assertIn('No regressions against the baseline.', output.getvalue())
+
+
+class DataGenerationTests(TestCase):
+    def test_generated_orders(self):
+        plan = datagen.plan_dataset(0, 1, make_password(None), timezone.now())
+        parameters = datagen.create_dimensions(plan)
+        datagen.link_categories(datagen.generate_products(plan, parameters, 0, plan['counts']['products']))
+        with CaptureQueriesContext(connection) as context:
+            lines = datagen.generate_orders(plan, 0, plan['counts']['orders'])
+        # The dates are written by the inserts, the rows are never updated
+        self.assertFalse([query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')])
+        # The history is spread over the past days, shop orders share the date of their order
+        self.assertEqual(Order.objects.count(), plan['counts']['orders'])
+        self.assertTrue(Order.objects.filter(dt__lt=timezone.now() - timedelta(days=1)).exists())
+        self.assertFalse(ShopOrder.objects.exclude(dt=F('order__dt')).exists())
+        self.assertTrue(Order._meta.get_field('dt').auto_now_add)
+        # Lines of placed orders belong to the shop order of their shop
+        self.assertEqual(OrderItem.objects.count(), lines)
+        self.assertFalse(OrderItem.objects.exclude(order__status='basket').exclude(
+            shop_order__shop_id=F('product_info__shop_id'), shop_order__order_id=F('order_id')).exists())
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    # Plans of the hot endpoints against a generated dataset, PLAN_TEST_SCALE sets its size
+    large_tables = [model._meta.db_table for model in (Account, Contact, Product, ProductInfo, ProductParameter,
+                                                       Order, ShopOrder, OrderItem, PriceHistory, ArchivedOrder,
+                                                       ArchivedShopOrder, ArchivedOrderItem)]
+    # Sorts of whole ranges the plans accept: the catalog is ordered by product name over all matching offers, the
+    # price history groups the changes of a product by day and the export streams the whole shop history
+    allowed_sorts = {
+        'products': (Product, ProductInfo),
+        'products by category': (Product, ProductInfo),
+        'partner export': (ShopOrder, OrderItem, ArchivedShopOrder, ArchivedOrderItem),
+        'price history': (PriceHistory,),
+        'shop price history': (PriceHistory,),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        plan = datagen.plan_dataset(float(os.environ.get('PLAN_TEST_SCALE', 0.002)), 1, make_password(None),
+                                    timezone.now())
+        parameters = datagen.create_dimensions(plan)
+        datagen.link_categories(datagen.generate_products(plan, parameters, 0, plan['counts']['products']))
+        datagen.generate_orders(plan, 0, plan['counts']['orders'])
+        datagen.finish()
+        cls.buyer = Order.objects.filter(status='basket').order_by('id').first().user
+        cls.seller = ShopOrder.objects.filter(status='new').order_by('id').first().shop.user
+        cls.category = Product.objects.order_by('id').first().category_id
+        cls.product = ProductInfo.objects.order_by('id').first()
+
+    def setUp(self):
+        local_cache.clear()
+        delivery.invalidate()
+
+    def cases(self):
+        return [
+            # (label, user, path)
+            ('products', None, '/api/v1/products/'),
+            ('products by category', None, f'/api/v1/products/?category={self.category}'),
+            ('basket', self.buyer, '/api/v1/basket'),
+            ('buyer orders', self.buyer, '/api/v1/basket/update'),
+            ('buyer new orders', self.buyer, '/api/v1/basket/update?status=new'),
+            ('partner orders', self.seller, '/api/v1/partner/orders'),
+            ('partner new orders', self.seller, '/api/v1/partner/orders?status=new'),
+            ('partner export', self.seller, '/api/v1/partner/orders/export'),
+            ('price history', None, f'/api/v1/products/{self.product.product_id}/prices'),
+            ('shop price history', None,
+             f'/api/v1/products/{self.product.product_id}/prices?shop={self.product.shop_id}'),
+        ]
+
+    def test_query_plans(self):
+        for label, user, path in self.cases():
+            with self.subTest(label):
+                client = APIClient()
+                if user is not None:
+                    client.force_authenticate(user)
+                with self.assertQueryPlans(label, allow_sorts=[model._meta.db_table
+                                                              for model in self.allowed_sorts.get(label, ())]):
+                    response = client.get(path)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertEqual(response.status_code, 200)
+
+    def test_full_range_sorts_fail(self):
+        # The join with the shops keeps their order only, the page is sorted from the whole shop history
+        shop_orders = ShopOrder.objects.filter(shop__user=self.seller).order_by('-dt', '-id')[:30]
+        with self.assertRaisesMessage(AssertionError, 'sorts all rows of app_shoporder'):
+            with self.assertQueryPlans('shop orders joined with the shops'):
+                list(shop_orders)
@@ -0,0 +1,33 @@
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class AuthRateThrottle(SimpleRateThrottle):
+    # Sliding window throttle for the login and registration endpoints.
+    # Runs before the serializer, so rejected attempts never reach password hashing.
+
+    def __init__(self):
+        self.cache = caches[settings.AUTH_THROTTLE_CACHE]
+        super().__init__()
+
+
+class AuthIPRateThrottle(AuthRateThrottle):
+    scope = 'auth_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class AuthEmailRateThrottle(AuthRateThrottle):
+    scope = 'auth_email'
+
+    def get_cache_key(self, request, view):
+        # A json body can be a list or a scalar, only the ip throttle applies then
+        email = request.data.get('email') if isinstance(request.data, dict) else None
+        if not email or not isinstance(email, str):
+            return None
+        ident = sha256(email.strip().lower().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
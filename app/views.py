@@ -1,37 +1,90 @@
+import asyncio
+import csv
+import heapq
+import json
+import logging
+import os
+import re
+from contextlib import nullcontext
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.tokens import default_token_generator
 from django.core.exceptions import ValidationError as DjangoValidationErrror
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import URLValidator
-from django.db.models import Sum, F
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Sum, F, Prefetch, Min, Max, OuterRef, Subquery
+from django.db.models.functions import TruncDate
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.mixins import ListModelMixin
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from app.filters import ProductFilterSet
-from app.models import Account, Category, Shop, ProductInfo, Product, \
-    ProductParameter, Parameter, Order, OrderItem, Contact
+from app import snapshots
+from app.archive import horizon
+from app.authentication import BatchAuthentication
+from app.delivery import quote_order
+from app.filters import ProductFilterSet, OrderFilterSet, ShopOrderFilterSet, PartnerOrderItemFilterSet
+from app.models import Account, Category, Shop, ProductInfo, \
+    Order, OrderItem, Contact, ShopOrder, DeliveryRate, CatalogChange, PriceHistory, ArchivedOrder, \
+    ArchivedShopOrder, ArchivedOrderItem
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.serializers import ValidationError
 
+from app.importer import import_price_list, set_shops_status
+from app.pagination import DateCursorPagination, EstimatedCountPagination
 from app.permissions import IsNotAuthenticated, IsBuyerOnly, IsShopOnly
+from app.throttling import AuthIPRateThrottle, AuthEmailRateThrottle
 from app.serilizers import CategorySerializer, RegistrationSerializer, CustomAuthTokenSerializer, \
     ShopSerializer, ProductInfoSerializer, OrderItemSerializer, ContactSerializer, OrderUserSerializer, \
-    OrderPartnerSerializer, UpdateBusketSerializer, UpdateContactSerializer, UserSerializer
+    OrderPartnerSerializer, UpdateBusketSerializer, UpdateContactSerializer, UserSerializer, \
+    DeliveryRateSerializer, CatalogChangeSerializer, PriceHistoryDaySerializer, select_rendered
 from django.db import IntegrityError
-from yaml import load as load_yaml, Loader
-from requests import get
-from app.signals import new_order, confirm_email
+from requests import get, RequestException
+from app.signals import new_order, confirm_email, order_status_changed
+
+logger = logging.getLogger(__name__)
+
+
+def order_items_related(prefix=''):
+    # Related lookups of the order lines rendered by OrderItemCreateSerializer under ordered_items
+    lookup = prefix.replace('.', '__') + 'ordered_items'
+    path = prefix + 'ordered_items'
+    return {
+        path: ([], [lookup]),
+        f'{path}.product_info.*': ([], [f'{lookup}__product_info']),
+        f'{path}.product_info.product.*': ([], [f'{lookup}__product_info__product']),
+        f'{path}.product_info.product.category': ([], [f'{lookup}__product_info__product__category']),
+        f'{path}.product_info.product_parameters': ([], [f'{lookup}__product_info__product_parameters']),
+        f'{path}.product_info.product_parameters.parameter': (
+            [], [f'{lookup}__product_info__product_parameters__parameter']),
+    }
+
+
+def order_total():
+    # Total of the outer order, a correlated subquery evaluated only for the orders of the page
+    return Subquery(OrderItem.objects.filter(order_id=OuterRef('id')).order_by().values('order_id').annotate(
+        total=Sum(F('quantity') * F('product_info__price'))).values('total'))
 
 
 class RegisterView(APIView):
     # User registration
     permission_classes = [IsNotAuthenticated]
+    throttle_classes = [AuthIPRateThrottle, AuthEmailRateThrottle]
 
     def post(self, request):
         try:
@@ -43,7 +96,7 @@ class RegisterView(APIView):
                 data["message"] = 'User registered successfully'
                 data["email"] = account.email
                 data["token"] = token
-                confirm_email.send(sender=self.__class__, user_id=account.id)
+                confirm_email.send(sender=self.__class__, user=account)
                 return JsonResponse({'Status': True, 'Data': data})
             else:
                 return JsonResponse({'Status': False, 'Errors': serializer.errors})
@@ -78,56 +131,206 @@ class AccountView(APIView):
         return Response(serializer.data)
 
     def patch(self, request, *args, **kwargs):
-        if {'password', 'old_password'}.issubset(request.data):
-            password = request.data['password']
-            check_pw = request.user.check_password(request.data['old_password'])
-            if not check_pw:
-                return JsonResponse({'Status': False, 'Errors': 'Old password is not correct.'})
-            try:
-                validate_password(password)
-                request.user.set_password(password)
-            except DjangoValidationErrror as error:
-                return JsonResponse({'Status': False, 'Errors': f'{error}'})
-        serializer = UserSerializer(request.user, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return JsonResponse({'Status': True})
-        else:
-            return JsonResponse({'Status': False, 'Errors': serializer.errors})
+        with transaction.atomic():
+            # request.user may be a cached token snapshot, the changes are made on the locked row
+            user = Account.objects.select_for_update().get(pk=request.user.pk)
+            if not user.is_active:
+                raise AuthenticationFailed('User inactive or deleted.')
+            if {'password', 'old_password'}.issubset(request.data):
+                password = request.data['password']
+                check_pw = user.check_password(request.data['old_password'])
+                if not check_pw:
+                    return JsonResponse({'Status': False, 'Errors': 'Old password is not correct.'})
+                try:
+                    validate_password(password)
+                    user.set_password(password)
+                except DjangoValidationErrror as error:
+                    return JsonResponse({'Status': False, 'Errors': f'{error}'})
+            serializer = UserSerializer(user, data=request.data)
+            if serializer.is_valid():
+                serializer.save()
+                return JsonResponse({'Status': True})
+            else:
+                return JsonResponse({'Status': False, 'Errors': serializer.errors})
 
 
 class LoginView(ObtainAuthToken):
     # Login user
     permission_classes = [IsNotAuthenticated]
+    throttle_classes = [AuthIPRateThrottle, AuthEmailRateThrottle]
     serializer_class = CustomAuthTokenSerializer
 
 
 class ShopView(ListModelMixin, GenericViewSet):
     # Displaying a list of shops
     permission_classes = [AllowAny]
+    read_replica = True
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = EstimatedCountPagination
 
 
 class CategoryView(ListModelMixin, GenericViewSet):
     # Displaying a list of categories
     permission_classes = [AllowAny]
-    queryset = Category.objects.prefetch_related('shops').all()
+    read_replica = True
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = EstimatedCountPagination
+    related = {'shops': ([], ['shops'])}
+
+    def get_queryset(self):
+        return select_rendered(super().get_queryset(), self.get_serializer(), self.related)
 
 
 class ProductView(ListModelMixin, GenericViewSet):
     # Displaying a list of products
     permission_classes = [AllowAny]
+    read_replica = True
     serializer_class = ProductInfoSerializer
-    queryset = ProductInfo.objects.filter(shop__status=True).select_related(
-        'shop', 'product__category').prefetch_related(
-        'product_parameters__parameter').distinct()
+    pagination_class = EstimatedCountPagination
+    queryset = ProductInfo.objects.filter(shop__status=True)
+    related = {
+        'product.*': (['product'], []),
+        'product.category': (['product__category'], []),
+        'product_parameters': ([], ['product_parameters']),
+        'product_parameters.parameter': ([], ['product_parameters__parameter']),
+    }
     filter_backends = [DjangoFilterBackend]
     filter_class = ProductFilterSet
 
+    def get_queryset(self):
+        return select_rendered(super().get_queryset(), self.get_serializer(), self.related)
+
+
+class CatalogChangesView(APIView):
+    # Catalog changes after the "since" cursor in log order, the returned cursor is the "since" of the next poll
+    permission_classes = [AllowAny]
+    page_size = 500
+    max_page_size = 1000
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', self.page_size)), self.max_page_size)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
+        if since < 0 or limit <= 0:
+            return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
+        # CatalogChange.write commits the ids in order, no lower id can appear after the cursor
+        changes = list(CatalogChange.objects.filter(id__gt=since).order_by('id')[:limit + 1])
+        more = len(changes) > limit
+        changes = changes[:limit]
+        offers = ProductInfo.objects.filter(
+            id__in={change.product_info_id for change in changes if change.kind == 'upsert'}).select_related(
+            'product__category').prefetch_related('product_parameters__parameter')
+        offers = {offer['id']: offer for offer in ProductInfoSerializer(offers, many=True).data}
+        serializer = CatalogChangeSerializer(changes, many=True, context={'offers': offers})
+        return Response({'cursor': changes[-1].id if changes else since, 'more': more,
+                         'results': serializer.data})
+
+
+class PriceHistoryView(APIView):
+    # Daily min, max and last price of a product per shop from "since" (default a year ago) to "until" dates.
+    # Days without price changes are left out, the last price of the previous day still applies.
+    permission_classes = [AllowAny]
+    read_replica = True
+    default_days = 365
+
+    def get(self, request, product_id, *args, **kwargs):
+        try:
+            since, until = (self.parse_day(request.query_params.get(name)) for name in ('since', 'until'))
+            shop = int(request.query_params['shop']) if 'shop' in request.query_params else None
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
+        history = PriceHistory.objects.filter(product_id=product_id)
+        if shop is not None:
+            history = history.filter(shop_id=shop)
+        if until is not None:
+            history = history.filter(dt__lt=timezone.make_aware(datetime.combine(until + timedelta(days=1), time())))
+        since = since or (until or timezone.localdate()) - timedelta(days=self.default_days)
+        history = history.filter(dt__gte=timezone.make_aware(datetime.combine(since, time())))
+        # One pass over the index range, the last price of a day is the price of its newest row
+        days = list(history.annotate(day=TruncDate('dt')).values('shop_id', 'day').annotate(
+            min_price=Min('price'), max_price=Max('price'), last_id=Max('id')).order_by('shop_id', 'day'))
+        last_prices = dict(PriceHistory.objects.filter(id__in=[day['last_id'] for day in days]).values_list(
+            'id', 'price'))
+        for day in days:
+            day['last_price'] = last_prices[day['last_id']]
+        return Response({'product': product_id, 'results': PriceHistoryDaySerializer(days, many=True).data})
+
+    @staticmethod
+    def parse_day(value):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        return day
+
+
+class CatalogSnapshotView(APIView):
+    # Gzip snapshot of the active offers of the whole catalog or of one shop, rebuilt by
+    # manage.py build_catalog_snapshots. A single byte range can be requested to resume an interrupted download.
+    permission_classes = [AllowAny]
+    chunk_size = 64 * 1024
+
+    def get(self, request, shop_id=None, *args, **kwargs):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in snapshots.formats():
+            return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
+        try:
+            file = open(snapshots.snapshot_path(output, shop_id), 'rb')
+        except FileNotFoundError:
+            return JsonResponse({'Status': False, 'Errors': 'Snapshot not found.'}, status=404)
+        # The open file keeps its content even if a rebuild replaces the snapshot meanwhile
+        stat = os.fstat(file.fileno())
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        if request.headers.get('If-None-Match') == etag:
+            file.close()
+            return HttpResponseNotModified(headers={'ETag': etag})
+        start, end, status = 0, size - 1, 200
+        if 'Range' in request.headers and request.headers.get('If-Range', etag) == etag:
+            byte_range = self.parse_range(request.headers['Range'], size)
+            if byte_range == ():
+                file.close()
+                return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}'})
+            if byte_range:
+                (start, end), status = byte_range, 206
+        response = StreamingHttpResponse(self.stream(file, start, end - start + 1), status=status,
+                                         content_type='application/gzip')
+        response['Content-Length'] = end - start + 1
+        if status == 206:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="{snapshots.snapshot_path(output, shop_id).name}"'
+        return response
+
+    @staticmethod
+    def parse_range(header, size):
+        # (start, end) of a single "bytes=" range, None to ignore the header, () when it is not satisfiable
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+            return (start, end) if int(last) and size else ()
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+        return (start, end) if start < size and start <= end else ()
+
+    def stream(self, file, start, length):
+        with file:
+            file.seek(start)
+            while length > 0:
+                chunk = file.read(min(self.chunk_size, length))
+                if not chunk:
+                    return
+                length -= len(chunk)
+                yield chunk
+
 
 class PartnerUpdateView(APIView):
     # Loading shop data in yaml format
@@ -141,33 +344,12 @@ class PartnerUpdateView(APIView):
             URLValidator(url)
         except ValidationError as e:
             return JsonResponse({'Status': False, 'Error': str(e)})
-        stream = get(url).content
-
-        data = load_yaml(stream, Loader=Loader)
         try:
-            shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
-
-            for category in data['categories']:
-                category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                category_object.shops.add(shop.id)
-                category_object.save()
-            ProductInfo.objects.filter(shop_id=shop.id).delete()
-            for item in data['goods']:
-                product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-                product_info = ProductInfo.objects.create(product_id=product.id,
-                                                          price=item['price'],
-                                                          price_rrc=item['price_rrc'],
-                                                          quantity=item['quantity'],
-                                                          shop_id=shop.id)
-                for name, value in item['parameters'].items():
-                    parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                    ProductParameter.objects.create(product_info_id=product_info.id,
-                                                    parameter_id=parameter_object.id,
-                                                    value=value)
-        except KeyError as error:
-            return JsonResponse({'Status': False,
-                                 'Error': f'Field {str(error)} missing. Check the file for errors.'})
-        return JsonResponse({'Status': True})
+            response = get(url, timeout=settings.PRICE_LIST_TIMEOUT)
+            response.raise_for_status()
+        except RequestException as e:
+            return JsonResponse({'Status': False, 'Error': f'Price list download failed: {e}'})
+        return JsonResponse(import_price_list(request.user.id, response.content))
 
 
 class BasketView(APIView):
@@ -175,12 +357,15 @@ class BasketView(APIView):
     permission_classes = [IsAuthenticated, IsBuyerOnly]
 
     def get(self, request, *args, **kwargs):
-        queryset = Order.objects.filter(
-            user_id=request.user.id, status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderUserSerializer(queryset, many=True)
+        serializer = OrderUserSerializer(many=True, context={'request': request})
+        # The delivery quote reads the lines and their product infos in any case
+        queryset = select_rendered(Order.objects.filter(
+            user_id=request.user.id, status='basket').prefetch_related('ordered_items__product_info').annotate(
+            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))),
+            serializer, order_items_related())
+        for order in queryset:
+            order.delivery_cost = sum(quote_order(order).values(), Decimal('0'))
+        serializer = OrderUserSerializer(queryset, many=True, context={'request': request})
         return Response(serializer.data)
 
     def post(self, request, *args, **kwargs):
@@ -189,9 +374,9 @@ class BasketView(APIView):
         if not input_data or not isinstance(input_data, data_type):
             return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
         objects_created = 0
+        basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
         for index, items in enumerate(input_data):
             serializer = OrderItemSerializer(data=items)
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
             items.update({'order': basket.id})
             if serializer.is_valid():
                 try:
@@ -258,24 +443,164 @@ class PartnerView(APIView):
     def patch(self, request, *args, **kwargs):
         input_data = request.data.get('status')
         data_type = bool
-        if not input_data or not isinstance(input_data, data_type):
+        if not isinstance(input_data, data_type):
             return JsonResponse({'Status': False, 'Errors': 'Wrong request format'})
-        Shop.objects.filter(user_id=request.user.id).update(status=input_data)
+        set_shops_status(Shop.objects.filter(user_id=request.user.id), input_data)
+        return JsonResponse({'Status': True})
+
+
+class PartnerDeliveryView(APIView):
+    # Show and change the partner shop delivery rate
+    permission_classes = [IsAuthenticated, IsShopOnly]
+
+    def get(self, request, *args, **kwargs):
+        rate = DeliveryRate.objects.filter(shop__user_id=request.user.id).prefetch_related('tiers').first()
+        if not rate:
+            return JsonResponse({'Status': False, 'Errors': 'Delivery rate is not set.'})
+        serializer = DeliveryRateSerializer(rate)
+        return Response(serializer.data)
+
+    def post(self, request, *args, **kwargs):
+        shop = Shop.objects.get(user_id=request.user.id)
+        rate = DeliveryRate.objects.filter(shop_id=shop.id).first()
+        serializer = DeliveryRateSerializer(rate, data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({'Status': False, 'Errors': serializer.errors})
+        serializer.save(shop=shop)
         return JsonResponse({'Status': True})
 
 
 class PartnerOrdersView(APIView):
     # Displaying the shop data and changing the work status
     permission_classes = [IsAuthenticated, IsShopOnly]
+    max_batch_size = 500
+    # Without the default orderings the buyers and contacts are read by primary and foreign keys
+    buyers = Prefetch('order__user', queryset=Account.objects.order_by())
+    related = {
+        'user': (['order'], []),
+        'user.*': ([], [buyers]),
+        'user.contacts': ([], [buyers, Prefetch('order__user__contacts', queryset=Contact.objects.order_by())]),
+        **order_items_related(),
+    }
 
     def get(self, request, *args, **kwargs):
-        order = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=request.user.id).exclude(status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderPartnerSerializer(order, many=True)
-        return Response(serializer.data)
+        # The shops are read first: a single shop id is an equality and the (shop, dt, id) index gives the page
+        # in cursor order, a join with the shops would sort the whole history
+        shop_ids = list(Shop.objects.filter(user_id=request.user.id).order_by().values_list('id', flat=True))
+        shop_orders = select_rendered(ShopOrder.objects.filter(shop_id__in=shop_ids),
+                                      OrderPartnerSerializer(many=True, context={'request': request}), self.related)
+        filterset = ShopOrderFilterSet(request.query_params, queryset=shop_orders)
+        if not filterset.is_valid():
+            return JsonResponse({'Status': False, 'Errors': filterset.errors})
+        archived = select_rendered(ArchivedShopOrder.objects.filter(shop_id__in=shop_ids),
+                                   OrderPartnerSerializer(many=True, context={'request': request}), self.related)
+        paginator = DateCursorPagination()
+        page = paginator.paginate_queryset(filterset.qs, request, view=self,
+                                           archive=filterset.filter_queryset(archived), archived_before=horizon())
+        serializer = OrderPartnerSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    def patch(self, request, *args, **kwargs):
+        # Moving a batch of the partner sub-orders to a new status
+        ids = request.data.get('ids')
+        status = request.data.get('status')
+        if not ids or not isinstance(ids, list) or not all(isinstance(item, int) for item in ids) \
+                or not isinstance(status, str):
+            return JsonResponse({'Status': False, 'Errors': 'Wrong request format'})
+        if len(ids) > self.max_batch_size:
+            return JsonResponse({'Status': False, 'Errors': f'No more than {self.max_batch_size} orders at once.'})
+        sources = Order.source_statuses(status)
+        if not sources:
+            return JsonResponse({'Status': False, 'Errors': f'Status "{status}" cannot be set.'})
+        with transaction.atomic():
+            shop_orders = {
+                shop_order_id: (current_status, order_id, email)
+                for shop_order_id, current_status, order_id, email in ShopOrder.objects.select_for_update(
+                    of=('self',)).filter(id__in=ids, shop__in=Shop.objects.filter(user_id=request.user.id)).values_list(
+                    'id', 'status', 'order_id', 'order__user__email')
+            }
+            allowed = [shop_order_id for shop_order_id, (current_status, _, _) in shop_orders.items()
+                       if current_status in sources]
+            ShopOrder.objects.filter(id__in=allowed, status__in=sources).update(status=status)
+            Order.objects.filter(id__in={shop_orders[shop_order_id][1] for shop_order_id in allowed}).exclude(
+                shop_orders__status__in=[item for item, _ in Order.CHOICES_STATUS if item != status]).update(
+                status=status)
+        results = {}
+        for shop_order_id in ids:
+            if shop_order_id not in shop_orders:
+                results[shop_order_id] = 'There are no matches in the database.'
+            elif shop_order_id in allowed:
+                results[shop_order_id] = 'Updated'
+            else:
+                results[shop_order_id] = f'Status "{shop_orders[shop_order_id][0]}" cannot be changed to "{status}".'
+        if allowed:
+            order_status_changed.send(sender=self.__class__, status=status,
+                                      changes=[(email, order_id) for _, order_id, email in
+                                               (shop_orders[shop_order_id] for shop_order_id in allowed)])
+        return JsonResponse({'Status': True, 'Updated objects': f'{len(allowed)}', 'Results': results})
+
+
+class Echo:
+    # File-like object for csv.writer that returns the written row instead of buffering it
+    def write(self, value):
+        return value
+
+
+class PartnerOrdersExportView(APIView):
+    # Streaming export of the partner order lines in csv or ndjson format
+    permission_classes = [IsAuthenticated, IsShopOnly]
+    chunk_size = 2000
+    export_fields = (
+        ('shop_order', 'shop_order_id'),
+        ('order', 'order_id'),
+        ('status', 'shop_order__status'),
+        ('dt', 'shop_order__dt'),
+        ('product_info', 'product_info_id'),
+        ('product', 'product_info__product__name'),
+        ('quantity', 'quantity'),
+        ('price', 'product_info__price'),
+    )
+    # Archived lines carry the name and price of their offer
+    archived_lookups = {
+        'product_info__product__name': 'product_name',
+        'product_info__price': 'price',
+    }
+    content_types = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'csv')
+        if output not in self.content_types:
+            return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
+        order_items = OrderItem.objects.filter(shop_order__shop__user_id=request.user.id)
+        filterset = PartnerOrderItemFilterSet(request.query_params, queryset=order_items)
+        if not filterset.is_valid():
+            return JsonResponse({'Status': False, 'Errors': filterset.errors})
+        archived = filterset.filter_queryset(ArchivedOrderItem.objects.filter(
+            shop_order__shop__user_id=request.user.id))
+        # Live and archived lines merged on (dt, shop_order), the shop order ids of both tables are distinct
+        lookups = [lookup for _, lookup in self.export_fields]
+        rows = heapq.merge(*[queryset.order_by('shop_order__dt', 'shop_order_id', 'id').values_list(
+            *queryset_lookups).iterator(chunk_size=self.chunk_size) for queryset, queryset_lookups in (
+            (filterset.qs, lookups), (archived, [self.archived_lookups.get(lookup, lookup) for lookup in lookups]))],
+            key=lambda row: (row[3], row[0]))
+        stream = self.stream_csv(rows) if output == 'csv' else self.stream_ndjson(rows)
+        response = StreamingHttpResponse(stream, content_type=self.content_types[output])
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
+
+    def stream_csv(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow([name for name, _ in self.export_fields])
+        for row in rows:
+            yield writer.writerow(row)
+
+    def stream_ndjson(self, rows):
+        names = [name for name, _ in self.export_fields]
+        for row in rows:
+            yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n'
 
 
 class ContactView(APIView):
@@ -328,24 +653,105 @@ class UserOrderView(APIView):
     permission_classes = [IsAuthenticated, IsBuyerOnly]
 
     def get(self, request, *args, **kwargs):
-        queryset = Order.objects.filter(
-            user_id=request.user.id).exclude(status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderUserSerializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = select_rendered(Order.objects.filter(
+            user_id=request.user.id).exclude(status='basket').annotate(total_sum=order_total()),
+            OrderUserSerializer(many=True, context={'request': request}), order_items_related())
+        filterset = OrderFilterSet(request.query_params, queryset=queryset)
+        if not filterset.is_valid():
+            return JsonResponse({'Status': False, 'Errors': filterset.errors})
+        # Archived orders carry the total computed when they were archived
+        archived = select_rendered(ArchivedOrder.objects.filter(user_id=request.user.id),
+                                   OrderUserSerializer(many=True, context={'request': request}), order_items_related())
+        paginator = DateCursorPagination()
+        page = paginator.paginate_queryset(filterset.qs, request, view=self,
+                                           archive=filterset.filter_queryset(archived), archived_before=horizon())
+        serializer = OrderUserSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     def patch(self, request, *args, **kwargs):
         order_id = request.data.get('id')
         data_type = int
         if not order_id or not isinstance(order_id, data_type):
             return JsonResponse({'Status': False, 'Errors': 'Wrong request format'})
-        order = Order.objects.filter(user_id=request.user.id, id=order_id)
+        order = Order.objects.filter(user_id=request.user.id, id=order_id, status='basket').first()
         if order:
-            order.update(status='new')
-            new_order.send(sender=self.__class__, user_id=request.user.id)
+            with transaction.atomic():
+                order.status = 'new'
+                order.save(update_fields=['status'])
+                order.split_by_shop()
+            new_order.send(sender=self.__class__, user=request.user)
             return JsonResponse({'Status': True})
         else:
             return JsonResponse({'Status': False,
                                  'Errors': 'There are no matches in the database. Data error.'})
+
+
+class BatchView(APIView):
+    # Runs a list of sub-requests {"method", "path", "body"} against the other API routes as the authenticated
+    # user and returns their responses in order. With "atomic" the sub-requests share one transaction and the
+    # first failing one rolls all of them back.
+    permission_classes = [IsAuthenticated]
+    methods = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+    def post(self, request, *args, **kwargs):
+        sub_requests = request.data.get('requests')
+        atomic = request.data.get('atomic', False)
+        if not sub_requests or not isinstance(sub_requests, list) or not isinstance(atomic, bool) \
+                or not all(isinstance(item, dict) for item in sub_requests):
+            return JsonResponse({'Status': False, 'Errors': 'Wrong request format.'})
+        if len(sub_requests) > settings.BATCH_MAX_REQUESTS:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'No more than {settings.BATCH_MAX_REQUESTS} requests at once.'})
+        responses = []
+        with transaction.atomic() if atomic else nullcontext():
+            for number, item in enumerate(sub_requests, start=1):
+                status, body = self.run(request, item)
+                responses.append({'status': status, 'body': body})
+                if atomic and (status >= 400 or isinstance(body, dict) and body.get('Status') is False):
+                    transaction.set_rollback(True)
+                    return JsonResponse({'Status': False, 'Errors': f'Request {number} failed, nothing was saved.',
+                                         'Responses': responses})
+        return JsonResponse({'Status': True, 'Responses': responses})
+
+    @staticmethod
+    def view(match, request):
+        # The view of a route authenticating its requests as the batch user, the token is looked up once
+        initkwargs = {**match.func.initkwargs,
+                      'authentication_classes': [partial(BatchAuthentication, request.user, request.auth)]}
+        if hasattr(match.func, 'actions'):
+            return match.func.cls.as_view(match.func.actions, **initkwargs)
+        return match.func.cls.as_view(**initkwargs)
+
+    def run(self, request, item):
+        # (status code, decoded body) of a sub-request
+        method = str(item.get('method', 'GET')).upper()
+        path, _, query = str(item.get('path', '')).partition('?')
+        if method not in self.methods:
+            return 405, {'Status': False, 'Errors': f'Method "{method}" not allowed.'}
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return 404, {'Status': False, 'Errors': f'Path "{path}" not found.'}
+        view_class = getattr(match.func, 'cls', None)
+        if view_class is None or issubclass(view_class, BatchView) or asyncio.iscoroutinefunction(match.func):
+            return 400, {'Status': False, 'Errors': f'Path "{path}" cannot be batched.'}
+        content = json.dumps(item['body']).encode() if 'body' in item else b''
+        environ = {key: value for key, value in request.META.items() if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH')}
+        environ.update({'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+                        'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(content)),
+                        'wsgi.input': BytesIO(content)})
+        sub_request = WSGIRequest(environ)
+        sub_request.resolver_match = match
+        try:
+            response = self.view(match, request)(sub_request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        except Exception:
+            # One broken sub-request must not lose the responses of the others
+            logger.exception('Batch sub-request %s %s failed', method, path)
+            return 500, {'Status': False, 'Errors': 'Internal server error.'}
+        try:
+            return response.status_code, json.loads(content)
+        except ValueError:
+            return response.status_code, content.decode(errors='replace')